@@ -1,22 +1,33 @@
 from fastapi import FastAPI, HTTPException, Query, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
+import asyncio
+import gc
+import json
 import logging
 import os
+import sys
 from datetime import datetime
 import uvicorn
 from contextlib import asynccontextmanager
 
 from config import Config
-from openai import OpenAI
 from rag_system import RAGSystem
+from vector_store import load_embedding_model
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 以 gunicorn --preload 啟動時，本模組在 fork 前由主進程匯入：先載入嵌入模型並凍結 GC，
+# 各工作進程即以寫入時複製共用模型權重。RAGSystem 本身（背景執行緒、ChromaDB 連線）
+# 不可跨 fork，仍於各進程的 lifespan 中建立；此處也不做推論，避免 fork 前啟動執行緒池。
+if "gunicorn" in sys.modules:
+    load_embedding_model(Config.EMBEDDING_MODEL, Config.EMBEDDING_ONNX_PATH)
+    gc.freeze()
+
 # 全局變量
 rag_system: Optional[RAGSystem] = None
 
@@ -43,6 +54,8 @@ async def lifespan(app: FastAPI):
     
     # 關閉時清理
     logger.info("API服務正在關閉...")
+    if rag_system:
+        rag_system.close()
 
 # 創建FastAPI應用
 app = FastAPI(
@@ -77,6 +90,11 @@ class CourseRecommendationResponse(BaseModel):
     total_found: int
     response_time: float
 
+class ChatRequest(BaseModel):
+    message: str = Field(..., description="用戶消息", min_length=1, max_length=500)
+    session_id: Optional[str] = Field(None, description="對話會話ID（未提供時建立新會話）")
+    api_key: Optional[str] = Field(None, description="OpenAI API密鑰")
+
 class CourseSearchRequest(BaseModel):
     query: str = Field(..., description="搜索關鍵詞", min_length=1, max_length=200)
     k: Optional[int] = Field(10, description="返回課程數量", ge=1, le=50)
@@ -143,10 +161,9 @@ async def recommend_courses(request: CourseRecommendationRequest):
     try:
         # 如果提供了API密鑰，則更新配置
         if request.api_key:
-            rag_system.config.OPENAI_API_KEY = request.api_key
             # 以請求提供的 Key 重新建立 OpenAI 客戶端（v1 寫法）
             try:
-                rag_system.openai_client = OpenAI(api_key=request.api_key)
+                rag_system.update_api_key(request.api_key)
             except Exception:
                 pass
         
@@ -154,8 +171,8 @@ async def recommend_courses(request: CourseRecommendationRequest):
         if not rag_system.config.OPENAI_API_KEY:
             raise HTTPException(status_code=400, detail="請提供OpenAI API密鑰")
         
-        # 獲取課程推薦
-        result = rag_system.get_course_recommendation(request.query, request.k)
+        # 獲取課程推薦（檢索與模型呼叫為阻塞操作，移至執行緒執行，避免卡住事件迴圈）
+        result = await asyncio.to_thread(rag_system.get_course_recommendation, request.query, request.k)
         
         response_time = (datetime.now() - start_time).total_seconds()
         
@@ -172,6 +189,75 @@ async def recommend_courses(request: CourseRecommendationRequest):
         logger.error(f"課程推薦失敗: {e}")
         raise HTTPException(status_code=500, detail=f"推薦過程中發生錯誤: {str(e)}")
 
+def _sse_event(data: str, event: str = None) -> str:
+    """組成一筆 Server-Sent Event；多行資料拆成多個 data 欄位"""
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+@app.post("/recommend/stream")
+async def recommend_courses_stream(request: CourseRecommendationRequest):
+    """課程推薦串流端點（SSE）：先送出檢索到的課程，再逐段送出推薦文字"""
+    if not rag_system:
+        raise HTTPException(status_code=503, detail="RAG系統未就緒")
+    
+    if request.api_key:
+        try:
+            rag_system.update_api_key(request.api_key)
+        except Exception:
+            pass
+    
+    if not rag_system.config.OPENAI_API_KEY:
+        raise HTTPException(status_code=400, detail="請提供OpenAI API密鑰")
+    
+    def event_stream():
+        # 同步產生器由 StreamingResponse 在執行緒池中逐段取用，不會阻塞事件迴圈
+        try:
+            courses = rag_system._retrieve_for_recommendation(request.query, request.k)
+            yield _sse_event(json.dumps(courses, ensure_ascii=False, default=str), event="courses")
+            for piece in rag_system.stream_course_recommendation(request.query, courses):
+                yield _sse_event(piece)
+        except Exception as e:
+            logger.error(f"串流課程推薦失敗: {e}")
+            yield _sse_event(f"推薦過程中發生錯誤: {str(e)}", event="error")
+        yield _sse_event("", event="done")
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """聊天串流端點（SSE）：先送出會話ID，再逐段送出AI回應（課程問題走推薦，其餘為一般聊天）"""
+    if not rag_system:
+        raise HTTPException(status_code=503, detail="RAG系統未就緒")
+    
+    if request.api_key:
+        try:
+            rag_system.update_api_key(request.api_key)
+        except Exception:
+            pass
+    
+    if not rag_system.config.OPENAI_API_KEY:
+        raise HTTPException(status_code=400, detail="請提供OpenAI API密鑰")
+    
+    session_id = request.session_id or rag_system.create_conversation_session()
+    
+    def event_stream():
+        yield _sse_event(session_id, event="session")
+        # chat_with_user_stream 自行記錄對話並在失敗時產出錯誤訊息
+        for piece in rag_system.chat_with_user_stream(session_id, request.message):
+            yield _sse_event(piece)
+        yield _sse_event("", event="done")
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/search", response_model=CourseSearchResponse)
 async def search_courses(request: CourseSearchRequest):
     """課程搜索端點（僅向量檢索，不使用GPT）"""
@@ -181,8 +267,8 @@ async def search_courses(request: CourseSearchRequest):
     start_time = datetime.now()
     
     try:
-        # 檢索相關課程
-        courses = rag_system.retrieve_relevant_courses(request.query, request.k)
+        # 檢索相關課程（阻塞操作移至執行緒執行，並發請求才能同時進行並合併檢索）
+        courses = await asyncio.to_thread(rag_system.retrieve_relevant_courses, request.query, request.k)
         
         response_time = (datetime.now() - start_time).total_seconds()
         
@@ -8,7 +8,7 @@ import os
 import time
 import logging
 from datetime import datetime
-from threading import Thread
+from threading import Event, Thread
 import streamlit as st
 from config import Config
 
@@ -27,12 +27,13 @@ class FileMonitor:
         self.last_mtime = None
         self.is_monitoring = False
         self.monitoring_thread = None
+        self.change_pending = Event()  # 背景執行緒偵測到檔案變動、尚待處理
         
     def get_file_mtime(self) -> float:
         """獲取檔案修改時間"""
         try:
-            if os.path.exists(self.config.COURSE_DATA_PATH):
-                return os.path.getmtime(self.config.COURSE_DATA_PATH)
+            return os.stat(self.config.COURSE_DATA_PATH).st_mtime
+        except FileNotFoundError:
             return 0
         except Exception as e:
             logger.error(f"獲取檔案修改時間失敗: {e}")
@@ -59,10 +60,43 @@ class FileMonitor:
         
         return False
     
+    def start_monitoring(self, interval: float = None):
+        """啟動背景執行緒定期檢查檔案，偵測到變動時設定 change_pending（重複呼叫無作用）"""
+        if self.is_monitoring:
+            return
+        if self.last_mtime is None:
+            self.initialize()
+        self.is_monitoring = True
+        self.monitoring_thread = Thread(
+            target=self._monitor_loop,
+            args=(interval or self.config.FILE_MONITOR_INTERVAL_SECONDS,),
+            name="file-monitor",
+            daemon=True
+        )
+        self.monitoring_thread.start()
+        logger.info("已啟動背景檔案監控")
+    
+    def _monitor_loop(self, interval: float):
+        """背景檢查迴圈"""
+        while self.is_monitoring:
+            if self.check_file_changed():
+                self.change_pending.set()
+            time.sleep(interval)
+    
+    def consume_change(self) -> bool:
+        """回傳背景執行緒是否偵測到檔案變動，並重設旗標"""
+        if not self.change_pending.is_set():
+            return False
+        self.change_pending.clear()
+        return True
+    
     def get_file_info(self) -> dict:
         """獲取檔案資訊"""
         try:
-            if not os.path.exists(self.config.COURSE_DATA_PATH):
+            # 單次 stat 同時取得修改時間與大小
+            try:
+                file_stat = os.stat(self.config.COURSE_DATA_PATH)
+            except FileNotFoundError:
                 return {
                     'exists': False,
                     'size': 0,
@@ -70,8 +104,8 @@ class FileMonitor:
                     'mtime': 0
                 }
             
-            mtime = os.path.getmtime(self.config.COURSE_DATA_PATH)
-            size = os.path.getsize(self.config.COURSE_DATA_PATH)
+            mtime = file_stat.st_mtime
+            size = file_stat.st_size
             
             return {
                 'exists': True,
@@ -104,8 +138,9 @@ def check_and_update_data():
         if monitor.last_mtime is None:
             monitor.initialize()
         
-        # 檢查檔案是否已修改
-        if monitor.check_file_changed():
+        # 檢查檔案是否已修改（背景監控運作中時只讀取旗標，不在頁面執行路徑上 stat 檔案）
+        changed = monitor.consume_change() if monitor.is_monitoring else monitor.check_file_changed()
+        if changed:
             logger.info("檢測到檔案更新，觸發資料重新載入")
             
             # 強制重建資料庫（使用改進的方法）
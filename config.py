@@ -10,19 +10,60 @@ class Config:
     # OpenAI 設定
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', 'your_openai_api_key_here')
     MODEL_NAME = "gpt-5-mini"  # 預設模型（可用 .env 覆寫）
+    # 同時進行的 OpenAI 請求上限（依帳號 QPM 等級調整）
+    OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '8'))
+    # OpenAI 閒置連線保留秒數（涵蓋使用者兩次提問間的思考時間，避免每輪重新 TLS 握手）
+    OPENAI_KEEPALIVE_SECONDS = float(os.getenv('OPENAI_KEEPALIVE_SECONDS', '60'))
+    # 一般聊天回應的生成上限範圍（依會話近期回應長度在此範圍內調整）
+    CHAT_MAX_TOKENS = int(os.getenv('CHAT_MAX_TOKENS', '300'))
+    CHAT_MIN_TOKENS = int(os.getenv('CHAT_MIN_TOKENS', '160'))
     
     # 向量數據庫設定
     VECTOR_DB_PATH = "./chroma_db"
     COLLECTION_NAME = "ai_courses"
+    # 上次建立知識庫時的課程資料摘要（setup_database.py 據此略過內容未變的重建）
+    KB_DIGEST_PATH = os.getenv('KB_DIGEST_PATH', './.kb_digest')
+    # 網頁介面背景檢查資料檔案修改時間的間隔（秒）
+    FILE_MONITOR_INTERVAL_SECONDS = float(os.getenv('FILE_MONITOR_INTERVAL_SECONDS', '5'))
+    # HNSW 索引參數（僅在建立集合時生效，修改後需重建知識庫）
+    HNSW_M = int(os.getenv('HNSW_M', '32'))
+    HNSW_CONSTRUCTION_EF = int(os.getenv('HNSW_CONSTRUCTION_EF', '200'))
+    HNSW_SEARCH_EF = int(os.getenv('HNSW_SEARCH_EF', '64'))
     
     # 嵌入模型設定
     # 改為多語模型以提升中文檢索品質
     EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    # 已匯出的 ONNX 模型目錄（設定後改以 ONNX Runtime 推論；切換後需重建知識庫）
+    EMBEDDING_ONNX_PATH = os.getenv('EMBEDDING_ONNX_PATH', '')
+    # 建立知識庫時每批向量化並寫入的課程數（寫入前一批的同時計算下一批的向量）
+    EMBEDDING_ADD_BATCH_SIZE = int(os.getenv('EMBEDDING_ADD_BATCH_SIZE', '256'))
+    # 模型單次前向計算的文本數（大批次可提高 GPU/CPU 使用率）
+    EMBEDDING_ENCODE_BATCH_SIZE = int(os.getenv('EMBEDDING_ENCODE_BATCH_SIZE', '128'))
+    # 查詢文本向量的 LRU 快取容量（相同文本不再重新計算）
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '4096'))
     
     # 檢索設定
     RETRIEVAL_K = 5  # 檢索相似課程數量
     # 提升閾值降低噪音（建議 0.6~0.8）
     SIMILARITY_THRESHOLD = 0.7
+    # 課程數不超過此值時，將全部向量載入記憶體以矩陣乘法精確檢索（超過則使用 ChromaDB 的 HNSW 索引）
+    EXACT_SEARCH_MAX_COURSES = int(os.getenv('EXACT_SEARCH_MAX_COURSES', '5000'))
+    # 合併並發檢索（檢索進行中到達的查詢於完成後一次批次處理；單一查詢不會額外等待）；設為 0 停用
+    RETRIEVAL_BATCHING = os.getenv('RETRIEVAL_BATCHING', '1') == '1'
+
+    # 語意快取設定（相似查詢直接沿用先前的推薦結果）
+    CACHE_SIM_THRESHOLD = float(os.getenv('CACHE_SIM_THRESHOLD', '0.92'))
+    # 一般聊天回應的語意快取門檻（需同時符合相同對話脈絡，門檻較推薦嚴格）
+    CHAT_CACHE_SIM_THRESHOLD = float(os.getenv('CHAT_CACHE_SIM_THRESHOLD', '0.95'))
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '256'))
+    SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv('SEMANTIC_CACHE_TTL_SECONDS', '3600'))
+
+    # 同一會話重送相同訊息時沿用上一輪結果（精確比對）
+    TURN_CACHE_MAX_ENTRIES = int(os.getenv('TURN_CACHE_MAX_ENTRIES', '2048'))
+    TURN_CACHE_TTL_SECONDS = float(os.getenv('TURN_CACHE_TTL_SECONDS', '60'))
+
+    # 系統統計（資料檔 stat、向量庫筆數）的快取秒數，避免儀表板輪詢時重複查詢
+    STATS_CACHE_TTL_SECONDS = float(os.getenv('STATS_CACHE_TTL_SECONDS', '5'))
 
     # 觸發檢索的關鍵詞（可透過 .env 覆寫，逗號分隔）
     COURSE_TRIGGER_VERBS = os.getenv(
@@ -42,6 +83,12 @@ class Config:
         '週,周,星期,禮拜'
     )
     
+    # 無需呼叫模型、直接以制式回覆處理的簡短訊息（逗號分隔）
+    CHAT_ACK_TERMS = os.getenv(
+        'CHAT_ACK_TERMS',
+        'ok,OK,嗯,好,謝謝,感謝'
+    )
+    
     # 課程文件路徑 (已由資料庫取代)
     COURSE_DATA_PATH = "AI課程.json"
 
@@ -52,3 +99,6 @@ class Config:
     DB_USER = os.getenv('DB_USER', 'your_username')
     DB_PASSWORD = os.getenv('DB_PASSWORD', 'your_password')
     DB_TABLE = os.getenv('DB_TABLE', 'courses') 
+    # 資料庫連線池大小（同時保留的連線數上限）
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+    DB_FETCH_BATCH_SIZE = int(os.getenv('DB_FETCH_BATCH_SIZE', '1000'))  # 每次 fetchmany 取回的列數
@@ -1,5 +1,7 @@
-import json
+import orjson
+import threading
 import uuid
+from collections import deque
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 import logging
@@ -8,46 +10,111 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY
+
+# 聊天回應長度 EMA 的平滑係數（越大越偏重最近的回應）
+OUTPUT_LENGTH_EMA_ALPHA = 0.3
+
+# 反饋追問規則：(觸發詞, 追問問題)，依序比對，命中的問題依規則順序串接
+FOLLOWUP_RULES = (
+    (("不適合", "不符合"), (
+        "能告訴我具體哪方面不符合您的需求嗎？",
+        "是時間安排、費用、難度程度，還是其他方面的問題？"
+    )),
+    (("時間",), (
+        "您比較偏好什麼時段的課程？",
+        "是希望平日還是假日的課程？"
+    )),
+    (("費用", "貴"), (
+        "您希望的課程費用大概在什麼範圍內？",
+        "您是否考慮體驗課程或優惠方案？"
+    )),
+    (("難度",), (
+        "您希望的課程難度如何？初學者、進階還是專業級？",
+        "您之前有相關經驗嗎？"
+    )),
+)
+
+# 沒有命中任何規則時的通用追問
+DEFAULT_FOLLOWUP_QUESTIONS = (
+    "能更詳細地描述您理想中的課程嗎？",
+    "除了剛才推薦的課程，您還有其他特殊需求嗎？",
+    "您最看重課程的哪個方面？例如教學品質、價格、時間彈性等？"
+)
+
+MAX_FOLLOWUP_QUESTIONS = 3
+
 class ConversationManager:
     """對話管理器 - 負責處理對話上下文和用戶反饋"""
     
+    RECENT_CHAT_WINDOW = 6  # 聊天提示中引用的最近消息數
+    
     def __init__(self):
         self.conversations = {}  # 存儲所有對話會話
         self.session_file = "conversations.json"
+        # 各會話最近消息的已格式化聊天行（僅存於記憶體，新增消息時增量更新）
+        self._recent_chat_lines: Dict[str, deque] = {}
+        self._recent_chat_text: Dict[str, str] = {}
+        # 各會話已序列化的消息片段（消息新增後不再變動，保存時不必重新編碼整段歷史）
+        self._message_json: Dict[str, List[bytes]] = {}
+        # 共用實例可能同時被多個執行緒寫入；新增消息、片段快取與寫檔需串行進行（可重入：新增消息時可能建立會話）
+        self._lock = threading.RLock()
         self.load_conversations()
     
     def create_session(self, user_id: str = None) -> str:
         """創建新的對話會話"""
         session_id = user_id or str(uuid.uuid4())
-        self.conversations[session_id] = {
-            "session_id": session_id,
-            "created_at": datetime.now().isoformat(),
-            "messages": [],
-            "user_preferences": {},
-            "rejected_courses": [],  # 用戶不滿意的課程
-            "preferred_features": {},  # 用戶偏好的特徵
-            "feedback_history": []  # 反饋歷史
-        }
-        self.save_conversations()
+        with self._lock:
+            self.conversations[session_id] = {
+                "session_id": session_id,
+                "created_at": datetime.now().isoformat(),
+                "messages": [],
+                "user_preferences": {},
+                "rejected_courses": [],  # 用戶不滿意的課程
+                "preferred_features": {},  # 用戶偏好的特徵
+                "feedback_history": []  # 反饋歷史
+            }
+            self._recent_chat_lines.pop(session_id, None)
+            self._recent_chat_text.pop(session_id, None)
+            self._message_json.pop(session_id, None)
+            self.save_conversations()
         return session_id
     
     def add_message(self, session_id: str, message_type: str, content: str, 
                    courses: List[Dict] = None, metadata: Dict = None):
         """添加消息到對話歷史"""
-        if session_id not in self.conversations:
-            session_id = self.create_session(session_id)
-        
-        message = {
-            "timestamp": datetime.now().isoformat(),
-            "type": message_type,  # 'user_query', 'system_response', 'user_feedback', 'user_message', 'ai_response'
+        self.batch_add_messages(session_id, [{
+            "type": message_type,
             "content": content,
-            "courses": courses or [],
-            "metadata": metadata or {}
-        }
-        
-        self.conversations[session_id]["messages"].append(message)
-        self.save_conversations()
-        logger.info(f"會話 {session_id} 添加 {message_type} 消息")
+            "courses": courses,
+            "metadata": metadata
+        }])
+    
+    def batch_add_messages(self, session_id: str, messages: List[Dict]):
+        """一次添加多條消息（每項含 type/content，可選 courses/metadata），只保存一次文件"""
+        if not messages:
+            return
+        with self._lock:
+            if session_id not in self.conversations:
+                session_id = self.create_session(session_id)
+            
+            history = self.conversations[session_id]["messages"]
+            recent_lines = self._recent_chat_lines.get(session_id)
+            for item in messages:
+                message = {
+                    "timestamp": datetime.now().isoformat(),
+                    "type": item["type"],  # 'user_query', 'system_response', 'user_feedback', 'user_message', 'ai_response'
+                    "content": item["content"],
+                    "courses": item.get("courses") or [],
+                    "metadata": item.get("metadata") or {}
+                }
+                history.append(message)
+                if recent_lines is not None:
+                    recent_lines.append(self._format_chat_line(message))
+                logger.info(f"會話 {session_id} 添加 {message['type']} 消息")
+            
+            self._recent_chat_text.pop(session_id, None)
+            self.save_conversations()
     
     def add_user_feedback(self, session_id: str, feedback_type: str, 
                          feedback_content: str, rejected_courses: List[str] = None,
@@ -103,51 +170,67 @@ class ConversationManager:
         conversation = self.conversations[session_id]
         return {
             "messages": conversation["messages"][-10:],  # 最近10條消息
+            "recent_formatted": self.get_recent_chat_text(session_id),
             "user_preferences": conversation["user_preferences"],
             "rejected_courses": conversation["rejected_courses"],
-            "feedback_count": len(conversation["feedback_history"])
+            "feedback_count": len(conversation["feedback_history"]),
+            "out_len_ema": conversation.get("out_len_ema")
         }
     
+    def update_output_length(self, session_id: str, length: int):
+        """以指數移動平均記錄聊天回應長度（供動態調整生成上限）"""
+        if session_id not in self.conversations:
+            return
+        conversation = self.conversations[session_id]
+        ema = conversation.get("out_len_ema")
+        conversation["out_len_ema"] = float(length) if ema is None else \
+            OUTPUT_LENGTH_EMA_ALPHA * length + (1 - OUTPUT_LENGTH_EMA_ALPHA) * ema
+    
+    def reset_output_length(self, session_id: str):
+        """清除回應長度 EMA（回應被生成上限截斷時，下一輪改用最大上限）"""
+        if session_id in self.conversations:
+            self.conversations[session_id].pop("out_len_ema", None)
+    
+    @staticmethod
+    def _format_chat_line(message: Dict) -> Optional[str]:
+        """將聊天消息格式化為提示用的一行文字（非聊天類型回傳 None）"""
+        if message["type"] == "user_message":
+            return f"用戶: {message['content']}"
+        if message["type"] == "ai_response":
+            return f"助手: {message['content']}"
+        return None
+    
+    def get_recent_chat_text(self, session_id: str) -> str:
+        """獲取最近消息中的聊天內容（已格式化並串接，僅在新增消息後重新串接）"""
+        if session_id not in self.conversations:
+            return ""
+        
+        text = self._recent_chat_text.get(session_id)
+        if text is None:
+            lines = self._recent_chat_lines.get(session_id)
+            if lines is None:
+                recent = self.conversations[session_id]["messages"][-self.RECENT_CHAT_WINDOW:]
+                lines = deque((self._format_chat_line(m) for m in recent), maxlen=self.RECENT_CHAT_WINDOW)
+                self._recent_chat_lines[session_id] = lines
+            text = "\n".join(line for line in lines if line)
+            self._recent_chat_text[session_id] = text
+        return text
+    
     def generate_followup_questions(self, session_id: str, feedback_content: str) -> List[str]:
         """根據用戶反饋生成追問問題"""
-        context = self.get_conversation_context(session_id)
-        
-        # 基本追問問題
         questions = []
-        
-        if "不適合" in feedback_content or "不符合" in feedback_content:
-            questions.extend([
-                "能告訴我具體哪方面不符合您的需求嗎？",
-                "是時間安排、費用、難度程度，還是其他方面的問題？"
-            ])
-        
-        if "時間" in feedback_content:
-            questions.extend([
-                "您比較偏好什麼時段的課程？",
-                "是希望平日還是假日的課程？"
-            ])
-        
-        if "費用" in feedback_content or "貴" in feedback_content:
-            questions.extend([
-                "您希望的課程費用大概在什麼範圍內？",
-                "您是否考慮體驗課程或優惠方案？"
-            ])
-        
-        if "難度" in feedback_content:
-            questions.extend([
-                "您希望的課程難度如何？初學者、進階還是專業級？",
-                "您之前有相關經驗嗎？"
-            ])
+        for triggers, rule_questions in FOLLOWUP_RULES:
+            if any(trigger in feedback_content for trigger in triggers):
+                questions.extend(rule_questions)
+                # 已湊滿上限，後續規則不必再比對
+                if len(questions) >= MAX_FOLLOWUP_QUESTIONS:
+                    break
         
         # 如果沒有具體問題，使用通用問題
         if not questions:
-            questions = [
-                "能更詳細地描述您理想中的課程嗎？",
-                "除了剛才推薦的課程，您還有其他特殊需求嗎？",
-                "您最看重課程的哪個方面？例如教學品質、價格、時間彈性等？"
-            ]
+            questions = list(DEFAULT_FOLLOWUP_QUESTIONS)
         
-        return questions[:3]  # 最多返回3個問題
+        return questions[:MAX_FOLLOWUP_QUESTIONS]
     
     def should_ask_followup(self, session_id: str) -> bool:
         """判斷是否應該追問"""
@@ -204,28 +287,54 @@ class ConversationManager:
     
     def load_conversations(self):
         """從文件加載對話歷史"""
-        try:
-            with open(self.session_file, 'r', encoding='utf-8') as f:
-                self.conversations = json.load(f)
-        except FileNotFoundError:
-            self.conversations = {}
-        except Exception as e:
-            logger.error(f"載入對話歷史失敗: {e}")
-            self.conversations = {}
+        with self._lock:
+            self._recent_chat_lines = {}
+            self._recent_chat_text = {}
+            self._message_json = {}
+            try:
+                with open(self.session_file, 'rb') as f:
+                    self.conversations = orjson.loads(f.read())
+            except FileNotFoundError:
+                self.conversations = {}
+            except Exception as e:
+                logger.error(f"載入對話歷史失敗: {e}")
+                self.conversations = {}
+    
+    def _serialize_session(self, session_id: str, session: Dict) -> bytes:
+        """序列化單一會話；消息沿用已快取的片段，只重新編碼其餘欄位"""
+        messages = session["messages"]
+        fragments = self._message_json.setdefault(session_id, [])
+        if len(fragments) > len(messages):
+            fragments.clear()
+        # 只編碼上次保存後新增的消息
+        fragments.extend(orjson.dumps(m, option=_ORJSON_OPTIONS) for m in messages[len(fragments):])
+        
+        head = orjson.dumps({k: v for k, v in session.items() if k != "messages"}, option=_ORJSON_OPTIONS)
+        separator = b"," if len(head) > 2 else b""
+        return head[:-1] + separator + b'"messages":[' + b",".join(fragments) + b"]}"
     
     def save_conversations(self):
         """保存對話歷史到文件"""
         try:
-            with open(self.session_file, 'w', encoding='utf-8') as f:
-                json.dump(self.conversations, f, ensure_ascii=False, indent=2)
+            with self._lock:
+                payload = b",".join(
+                    orjson.dumps(session_id) + b":" + self._serialize_session(session_id, session)
+                    for session_id, session in self.conversations.items()
+                )
+                with open(self.session_file, 'wb') as f:
+                    f.write(b"{" + payload + b"}")
         except Exception as e:
             logger.error(f"保存對話歷史失敗: {e}")
     
     def clear_session(self, session_id: str):
         """清空指定會話"""
-        if session_id in self.conversations:
-            del self.conversations[session_id]
-            self.save_conversations()
+        with self._lock:
+            if session_id in self.conversations:
+                del self.conversations[session_id]
+                self._recent_chat_lines.pop(session_id, None)
+                self._recent_chat_text.pop(session_id, None)
+                self._message_json.pop(session_id, None)
+                self.save_conversations()
     
     def get_all_sessions(self) -> List[str]:
         """獲取所有會話ID"""
@@ -7,6 +7,26 @@ from config import Config
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 各課程類別的相關關鍵詞（加入可搜尋文本以提高語義匹配率）
+CATEGORY_KEYWORDS = {
+    'SG　泳訓團體': '游泳 泳訓 游泳課程 泳池 水中運動 游泳教學 泳技 水性 戲水',
+    'A　有氧系列': '有氧運動 燃脂 減肥 心肺 塑身 雕塑 體適能',
+    'B　舞蹈系列': '舞蹈 跳舞 律動 舞步 音樂 節奏',
+    'C　瑜珈系列': '瑜珈 瑜伽 伸展 放鬆 冥想 體位法 柔軟度',
+    'D　飛輪系列': '飛輪 單車 腳踏車 心肺訓練 燃脂',
+    'E　武術系列': '武術 太極 氣功 功夫 武功 防身術',
+    'F　專業運動': '專業運動 體適能 肌力 訓練 健身',
+    'G　幼兒/兒童系列': '幼兒 兒童 小孩 孩子 親子 兒童課程 幼兒課程',
+    'H　空中瑜珈': '空中瑜珈 空中 懸吊 反重力',
+    'J　肌力系列': '肌力 重訓 肌肉 力量 訓練',
+    'K　水中運動': '水中運動 水中 水療 水中健身',
+    'O　球類團體': '球類 團體運動 球類運動 羽球 桌球 網球',
+    'DV　潛水系列': '潛水 深潛 水肺潛水 自由潛水'
+}
+
+# 可搜尋文本「詳細資訊」段落依序列出的欄位
+DETAIL_FIELDS = ('授課教師', '年齡限制', '上課時間', '課程費用', '體驗費用')
+
 class CourseProcessor:
     """課程數據處理器 - 從 SQL Server 處理和準備課程數據"""
     
@@ -32,16 +52,23 @@ class CourseProcessor:
             print(f"DEBUG: 正在嘗試連線，使用的連線字串: {conn_str}")
             # ----------------------------------------------------
 
-            with pyodbc.connect(conn_str) as cnxn:
+            # 唯讀查詢：自動提交，省去隱含交易
+            with pyodbc.connect(conn_str, autocommit=True) as cnxn:
                 cursor = cnxn.cursor()
+                cursor.arraysize = self.config.DB_FETCH_BATCH_SIZE
                 query = """SELECT C.k02 as 大類,B.k03 as 課程名稱,B.k18 as 課程介紹,D.k02 as 教室名稱,A.k34 as 課程代碼,B.k03 as 課程名稱1,isnull(E.k02,'無') as 授課教師,case when A.k80 = 0 then '無' when A.k80 = 1 then '有' end as 年齡限制, isnull(A.k07,'無') as 上課週次,CONVERT(VARCHAR(5), A.k08, 108) AS 上課時間,A.k13 as 課程費用,A.k14 as 體驗費用,A.k16 as 開班人數,A.k17 as 滿班人數 FROM wk05 A INNER JOIN wk01 B on A.k04=B.k00 INNER JOIN wk00 C on B.k01=C.k00 INNER JOIN wk02 D on A.k02=D.k00 INNER JOIN wk03eee E on A.k05=E.k00 WHERE A.k06 = 1"""
                 cursor.execute(query)
                 
                 # 獲取欄位名稱
                 columns = [column[0] for column in cursor.description]
                 
-                # 轉換為字典列表
-                rows = cursor.fetchall()
+                # 以批次 fetchmany 取回全部資料列
+                rows = []
+                while True:
+                    batch = cursor.fetchmany(cursor.arraysize)
+                    if not batch:
+                        break
+                    rows.extend(batch)
 
                 # --- DEBUG: 印出抓取到的資料 ---
                 print(f"DEBUG: 資料庫查詢完成，抓取到 {len(rows)} 筆資料。")
@@ -117,7 +144,7 @@ class CourseProcessor:
         
         # 其他詳細資訊
         additional_info = []
-        for key in ['授課教師', '年齡限制', '上課時間', '課程費用', '體驗費用']:
+        for key in DETAIL_FIELDS:
             if course.get(key):
                 additional_info.append(f"{key}: {course[key]}")
         
@@ -128,23 +155,7 @@ class CourseProcessor:
     
     def _get_category_keywords(self, category: str) -> str:
         """根據課程類別添加相關關鍵詞，提高語義匹配率"""
-        keyword_mapping = {
-            'SG　泳訓團體': '游泳 泳訓 游泳課程 泳池 水中運動 游泳教學 泳技 水性 戲水',
-            'A　有氧系列': '有氧運動 燃脂 減肥 心肺 塑身 雕塑 體適能',
-            'B　舞蹈系列': '舞蹈 跳舞 律動 舞步 音樂 節奏',
-            'C　瑜珈系列': '瑜珈 瑜伽 伸展 放鬆 冥想 體位法 柔軟度',
-            'D　飛輪系列': '飛輪 單車 腳踏車 心肺訓練 燃脂',
-            'E　武術系列': '武術 太極 氣功 功夫 武功 防身術',
-            'F　專業運動': '專業運動 體適能 肌力 訓練 健身',
-            'G　幼兒/兒童系列': '幼兒 兒童 小孩 孩子 親子 兒童課程 幼兒課程',
-            'H　空中瑜珈': '空中瑜珈 空中 懸吊 反重力',
-            'J　肌力系列': '肌力 重訓 肌肉 力量 訓練',
-            'K　水中運動': '水中運動 水中 水療 水中健身',
-            'O　球類團體': '球類 團體運動 球類運動 羽球 桌球 網球',
-            'DV　潛水系列': '潛水 深潛 水肺潛水 自由潛水'
-        }
-        
-        return keyword_mapping.get(category, '')
+        return CATEGORY_KEYWORDS.get(category, '')
     
     def get_course_categories(self) -> List[str]:
         """獲取所有課程類別"""
@@ -0,0 +1,93 @@
+import queue
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Iterator
+import pyodbc
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class ConnectionPool:
+    """ODBC 連線池 - 重用已建立的資料庫連線，省去每次查詢的 TCP/TDS 握手與驗證"""
+
+    def __init__(self, conn_str: str, size: int = 4, timeout: int = 5,
+                 health_check_after: float = 30.0):
+        self.conn_str = conn_str
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.health_check_after = health_check_after  # 閒置超過此秒數的連線在重用前先檢查
+        self._idle: "queue.LifoQueue" = queue.LifoQueue()  # (連線, 歸還時間)
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _connect(self):
+        """建立新連線（自動提交，查詢不需額外 commit）"""
+        return pyodbc.connect(self.conn_str, timeout=self.timeout, autocommit=True)
+
+    def _is_alive(self, cnxn) -> bool:
+        """以 SELECT 1 確認連線仍可用"""
+        try:
+            cnxn.cursor().execute("SELECT 1").fetchone()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def _discard(self, cnxn):
+        """關閉並移除失效的連線"""
+        try:
+            cnxn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def _acquire(self):
+        """取得連線：優先重用閒置連線，未達上限時新建，否則等待歸還"""
+        while True:
+            try:
+                cnxn, returned_at = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                cnxn, returned_at = self._idle.get()
+
+            if time.time() - returned_at < self.health_check_after or self._is_alive(cnxn):
+                return cnxn
+            logger.info("資料庫連線已失效，重新建立")
+            self._discard(cnxn)
+
+    @contextmanager
+    def connection(self) -> Iterator:
+        """借用一條連線；連線層級錯誤時丟棄該連線，其餘情況（含 SQL 語法錯誤）歸還連線池"""
+        cnxn = self._acquire()
+        try:
+            yield cnxn
+        except (pyodbc.OperationalError, pyodbc.InterfaceError):
+            self._discard(cnxn)
+            raise
+        except Exception:
+            self._idle.put((cnxn, time.time()))
+            raise
+        else:
+            self._idle.put((cnxn, time.time()))
+
+    def close(self):
+        """關閉所有閒置連線"""
+        while True:
+            try:
+                cnxn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(cnxn)
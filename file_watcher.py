@@ -0,0 +1,60 @@
+import os
+import threading
+import logging
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # 未安裝 watchdog 時由呼叫端退回輪詢檔案修改時間
+    FileSystemEventHandler = object
+    Observer = None
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class DataFileWatcher(FileSystemEventHandler):
+    """資料檔案監看器 - 以作業系統檔案事件（Linux inotify / macOS FSEvents）標記檔案變動，取代輪詢"""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = os.path.abspath(path)
+        self._changed = threading.Event()
+        self._observer = None
+
+    def start(self) -> bool:
+        """開始監看資料檔案所在目錄；無法使用檔案事件時回傳 False"""
+        if Observer is None:
+            return False
+        try:
+            observer = Observer()
+            observer.schedule(self, os.path.dirname(self.path), recursive=False)
+            observer.daemon = True
+            observer.start()
+        except Exception as e:
+            logger.warning(f"無法啟動檔案監看，改用輪詢檢查: {e}")
+            return False
+        self._observer = observer
+        return True
+
+    def on_any_event(self, event):
+        """資料檔案被修改、建立或以更名方式替換時標記為已變動"""
+        if event.event_type not in ('modified', 'created', 'moved'):
+            return
+        paths = (event.src_path, getattr(event, 'dest_path', None))
+        if any(p and os.path.abspath(p) == self.path for p in paths):
+            self._changed.set()
+
+    def consume_change(self) -> bool:
+        """回傳自上次呼叫以來檔案是否有變動，並重設標記"""
+        if not self._changed.is_set():
+            return False
+        self._changed.clear()
+        return True
+
+    def stop(self):
+        """停止監看"""
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=1)
+            self._observer = None
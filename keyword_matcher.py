@@ -0,0 +1,38 @@
+import re
+from typing import Dict, Iterable, Set
+
+class KeywordMatcher:
+    """多關鍵字比對器 - 以單一編譯後的正則表達式一次掃描，找出訊息命中的所有關鍵字類別"""
+
+    def __init__(self, groups: Dict[str, Iterable[str]]):
+        kinds_by_word: Dict[str, Set[str]] = {}
+        for kind, words in groups.items():
+            for word in words:
+                if word:
+                    kinds_by_word.setdefault(word, set()).add(kind)
+
+        # 某關鍵字命中時，其包含的較短關鍵字必然也出現在訊息中，預先合併其類別
+        self._kinds_by_word = {
+            word: frozenset().union(*(kinds for other, kinds in kinds_by_word.items() if other in word))
+            for word in kinds_by_word
+        }
+
+        # 所有關鍵字的首字元；訊息若不含其中任何字元，必定沒有命中
+        self.first_chars = frozenset(word[0] for word in kinds_by_word)
+
+        # 長字優先；以前瞻 (?=...) 在每個位置各比對一次，重疊的關鍵字也不會漏掉
+        alternation = "|".join(re.escape(w) for w in sorted(kinds_by_word, key=len, reverse=True))
+        self._pattern = re.compile(f"(?=({alternation}))") if alternation else None
+
+    def match_kinds(self, text: str, stop_kinds: Iterable[str] = ()) -> Set[str]:
+        """回傳文字中出現的關鍵字類別集合；命中 stop_kinds 中任一類別即停止掃描"""
+        kinds: Set[str] = set()
+        if not self._pattern or not text:
+            return kinds
+        stop = frozenset(stop_kinds)
+        for match in self._pattern.finditer(text):
+            found = self._kinds_by_word[match.group(1)]
+            kinds |= found
+            if stop and not stop.isdisjoint(found):
+                break
+        return kinds
@@ -0,0 +1,76 @@
+import os
+import logging
+from typing import List
+import numpy as np
+
+try:
+    import onnxruntime as ort
+    from transformers import AutoTokenizer
+except ImportError:  # 未安裝時 vector_store 使用 sentence-transformers（PyTorch）推論
+    ort = None
+    AutoTokenizer = None
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class OnnxEmbedder:
+    """ONNX Runtime 嵌入器 - 以匯出（可 int8 量化）的模型推論，介面相容 SentenceTransformer.encode
+
+    模型目錄需包含 ONNX 模型與 tokenizer 檔案，可用 optimum 轉換：
+        optimum-cli export onnx --model sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2 \\
+            --task feature-extraction ./onnx_model
+        optimum-cli onnxruntime quantize --onnx_model ./onnx_model --avx2 -o ./onnx_model_int8
+    """
+
+    def __init__(self, model_dir: str, max_length: int = 128):
+        if ort is None:
+            raise ImportError("使用 ONNX 嵌入模型需要安裝 onnxruntime 與 transformers")
+
+        # 優先使用量化後的模型
+        file_name = next(
+            (name for name in ("model_quantized.onnx", "model.onnx")
+             if os.path.exists(os.path.join(model_dir, name))),
+            "model.onnx"
+        )
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = os.cpu_count() or 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, file_name),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length  # 與原模型的 max_seq_length 一致
+        self._input_names = [node.name for node in self.session.get_inputs()]
+        logger.info(f"已載入 ONNX 嵌入模型: {os.path.join(model_dir, file_name)}")
+
+    def encode(self, texts: List[str], batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        """批次計算句向量（mean pooling，與 sentence-transformers 的設定相同）"""
+        pooled = []
+        for start in range(0, len(texts), batch_size):
+            tokens = self.tokenizer(
+                list(texts[start:start + batch_size]),
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np"
+            )
+            input_ids = tokens["input_ids"].astype(np.int64)
+            # 匯出的模型可能需要 tokenizer 未提供的 token_type_ids，以 0 補齊
+            feeds = {
+                name: tokens[name].astype(np.int64) if name in tokens else np.zeros_like(input_ids)
+                for name in self._input_names
+            }
+            hidden = self.session.run(None, feeds)[0]  # (batch, seq_len, dim)
+            mask = tokens["attention_mask"][..., np.newaxis].astype(np.float32)
+            pooled.append((hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None))
+
+        if not pooled:
+            return np.empty((0, 0), dtype=np.float32)
+        embeddings = np.vstack(pooled).astype(np.float32)
+        if normalize_embeddings:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings
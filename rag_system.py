@@ -1,56 +1,182 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import httpx
+import orjson
+from pydantic import BaseModel, ValidationError
 import pyodbc
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator, Tuple
+import asyncio
+import copy
+import functools
+import hashlib
+import io
 import logging
+import operator
 import os
+import re
+import string
+import threading
 import time
 from datetime import datetime
 from config import Config
-from vector_store import VectorStore
+from vector_store import VectorStore, RetrievalBatcher
 from course_processor import CourseProcessor
 from conversation_manager import ConversationManager
+from semantic_cache import SemanticCache, TTLCache
+from keyword_matcher import KeywordMatcher
+from db_pool import ConnectionPool
+from file_watcher import DataFileWatcher
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class RAGSystem:
-    """RAG課程推薦系統 - 整合檢索增強生成功能"""
-    
-    def __init__(self, config: Config = None):
-        self.config = config or Config()
-        self.vector_store = None
-        self.course_processor = None
-        self.openai_client = None
-        self.conversation_manager = ConversationManager()  # 新增對話管理器
-        self.last_data_file_mtime = None  # 記錄資料檔案的最後修改時間
-        self.setup_system()
-    
-    def setup_system(self):
-        """初始化RAG系統"""
-        try:
-            # 設定 OpenAI v1 客戶端
-            self.openai_client = OpenAI(api_key=self.config.OPENAI_API_KEY)
-            
-            # 初始化課程處理器
-            self.course_processor = CourseProcessor()
-            
-            # 初始化向量數據庫
-            self.vector_store = VectorStore(self.config)
-            
-            logger.info("RAG系統初始化完成")
-            
-        except Exception as e:
-            logger.error(f"RAG系統初始化失敗: {e}")
-            raise
+# HTTP/2 需要 h2 套件（httpx[http2]）；未安裝時退回 HTTP/1.1 keep-alive
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
 
-    def generate_sql_where_clause(self, user_query: str) -> str:
-        """
-        使用 AI 將自然語言查詢轉換為 SQL WHERE 條件子句（採用思維鏈 CoT 技術）。
-        """
-        logger.info(f"開始為查詢生成 SQL WHERE 子句 (CoT): {user_query}")
+# OpenAI 連線池設定（所有請求共用，省去每次的 TLS 握手與連線建立）
+_OPENAI_HTTP_LIMITS = httpx.Limits(
+    max_keepalive_connections=50, max_connections=100, keepalive_expiry=Config.OPENAI_KEEPALIVE_SECONDS
+)
+_OPENAI_HTTP_TIMEOUT = httpx.Timeout(30.0, connect=3.0)
+
+# 回應文字中禁止出現的用語（避免模型越權描述上課型態或不存在的風格）
+BANNED_TERMS = [
+    "線上", "線上課", "實體", "線下", "遠距",
+    "哈達", "流瑜伽", "流瑜珈", "陰瑜伽", "陰瑜珈", "阿斯坦加", "艾揚格", "熱瑜珈"
+]
+# 單次掃描偵測所有禁詞（長詞優先，例如「線上課」先於「線上」）
+_BANNED_RE = re.compile("|".join(re.escape(w) for w in sorted(BANNED_TERMS, key=len, reverse=True)))
+# 串流清理時保留未輸出的尾端長度，確保跨片段的禁詞也能被完整比對
+_BANNED_HOLDBACK = max(len(w) for w in BANNED_TERMS) - 1
+
+# 單字元禁詞（且不屬於任何較長禁詞的一部分）改以 str.translate 查表刪除，其餘交給正則
+_BANNED_SINGLE_CHARS = "".join(sorted({
+    w for w in BANNED_TERMS
+    if len(w) == 1 and not any(w in other for other in BANNED_TERMS if len(other) > 1)
+}))
+_BANNED_DELETE_MAP = str.maketrans("", "", _BANNED_SINGLE_CHARS)
+_BANNED_MULTI = sorted((w for w in BANNED_TERMS if w not in _BANNED_SINGLE_CHARS), key=len, reverse=True)
+_BANNED_MULTI_RE = re.compile("|".join(re.escape(w) for w in _BANNED_MULTI)) if _BANNED_MULTI else None
+
+def _strip_banned_terms(text: str) -> str:
+    """移除禁詞（多字元詞單次正則掃描、單字元詞查表刪除）；有移除時以 debug 等級記錄被移除的詞"""
+    cleaned, removed = _BANNED_MULTI_RE.subn("", text) if _BANNED_MULTI_RE else (text, 0)
+    if _BANNED_SINGLE_CHARS:
+        shorter = cleaned.translate(_BANNED_DELETE_MAP)
+        removed += len(cleaned) - len(shorter)
+        cleaned = shorter
+    if removed and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"已移除禁詞 {removed} 處: {_BANNED_RE.findall(text)}")
+    return cleaned
+
+class _BannedTermStreamFilter:
+    """串流禁詞過濾：保留尚未清理的原文尾端，跨片段的禁詞（如「線上」+「課程」）與整段清理結果一致"""
+
+    def __init__(self):
+        self._raw = ""
+
+    def feed(self, text: str) -> str:
+        """加入新片段，回傳已可安全輸出的清理後文字"""
+        self._raw += text
+        cut = len(self._raw) - _BANNED_HOLDBACK
+        if cut <= 0:
+            return ""
+        # 起點在切點之前的禁詞已完整收到；若跨越切點，連同整個詞一起處理
+        for match in _BANNED_RE.finditer(self._raw):
+            if match.start() >= cut:
+                break
+            if match.end() > cut:
+                cut = match.end()
+                break
+        ready, self._raw = self._raw[:cut], self._raw[cut:]
+        return _strip_banned_terms(ready)
+
+    def flush(self) -> str:
+        """串流結束：清理並回傳保留的尾端"""
+        rest, self._raw = self._raw, ""
+        return _strip_banned_terms(rest)
+
+# 時段/星期信號需搭配以下課程意圖詞才觸發檢索
+COURSE_INLINE_KEYWORDS = frozenset(['課', '上課', '課程', '瑜珈', '有氧', '游泳', '健身', '運動'])
+# 單獨命中即判定為課程查詢的關鍵字類別
+_DECISIVE_TRIGGER_KINDS = frozenset(['category', 'verb'])
+
+# 課程代碼（英數混合碼）的必要字元；訊息缺任一類即不必執行代碼擷取
+_ASCII_ALPHA = frozenset(string.ascii_letters)
+_ASCII_DIGITS = frozenset(string.digits)
 
-        schema_description = """
+def _split_env_list(value: str) -> list:
+    """解析以逗號分隔的設定字串"""
+    return [x.strip() for x in (value or '').split(',') if x.strip()]
+
+@functools.lru_cache(maxsize=8)
+def _build_course_trigger_matcher(source: tuple) -> KeywordMatcher:
+    """依 (類別詞, 動詞, 時段, 星期) 設定字串建立觸發關鍵字比對器（同一設定只建立一次）"""
+    keywords, verbs, time_signals, week_signals = source
+    return KeywordMatcher({
+        'category': _split_env_list(keywords),
+        'verb': _split_env_list(verbs),
+        'time': _split_env_list(time_signals),
+        'week': _split_env_list(week_signals),
+        'course': COURSE_INLINE_KEYWORDS,
+    })
+
+# 匯入時即以預設設定建立比對器，首個請求不必負擔編譯成本
+_build_course_trigger_matcher((
+    Config.COURSE_TRIGGER_KEYWORDS,
+    Config.COURSE_TRIGGER_VERBS,
+    Config.COURSE_TRIGGER_TIME_SIGNALS,
+    Config.COURSE_TRIGGER_WEEK_SIGNALS,
+))
+
+# 串流時用來提早擷取 JSON 中已完整的 "intro" 欄位
+_INTRO_FIELD_RE = re.compile(r'"intro"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+# 空白、單字元或純附和訊息的制式回覆（不呼叫模型）
+_CANNED_ACK_RESPONSE = "好的！如果想找課程，可以告訴我想上的類別、時段或星期，我來幫您推薦。"
+
+# 生成推薦失敗時的回覆（含此文字的推薦不寫入快取）
+_RECOMMEND_ERROR_TEXT = "抱歉，生成推薦時發生錯誤。請稍後再試。"
+
+# 生成的 WHERE 子句中禁止出現的關鍵字（單次掃描、不分大小寫）；
+# 以 ASCII 字界比對：允許 UPDATE_TIME 這類欄位名稱，但「DROP表」等緊鄰中文的寫法仍會被擋下
+_FORBIDDEN_SQL_RE = re.compile(r'\b(?:DROP|DELETE|UPDATE|INSERT)\b|;', re.IGNORECASE | re.ASCII)
+
+# AI 使用的欄位別名 → 真實 SQL 欄位
+_SQL_COLUMN_MAP = {
+    '大類': 'C.k02',
+    '課程名稱': 'B.k03',
+    '課程介紹': 'B.k18',
+    '教室名稱': 'D.k02',
+    '課程代碼': 'A.k34',
+    '授課教師': 'E.k02',
+    '上課週次': 'A.k07',
+    '課程費用': 'A.k13',
+    '體驗費用': 'A.k14',
+    '開班人數': 'A.k16',
+    '滿班人數': 'A.k17',
+    # 處理 CASE 和 CONVERT 的特殊情況
+    '年齡限制': "(CASE WHEN A.k80 = 0 THEN '無' ELSE '有' END)",
+    '上課時間': "(CONVERT(VARCHAR(5), A.k08, 108))"
+}
+# 長別名優先，避免較短的別名先在較長別名內命中
+_SQL_COLUMN_RE = re.compile("|".join(re.escape(k) for k in sorted(_SQL_COLUMN_MAP, key=len, reverse=True)))
+
+# 各類請求的提示快取路由鍵：相同前綴的請求導向同一快取分片以提高命中率
+# （openai 1.12 尚無此參數，透過 extra_body 傳遞；修改對應提示時請一併更新版本號）
+_PROMPT_CACHE_KEYS = {
+    'sql': "rag-sql-v1",
+    'clarify': "rag-clarify-v1",
+    'recommend': "rag-recommend-v2",
+    'chat': "rag-chat-v1",
+}
+
+# SQL WHERE 子句生成的固定提示（綱要、步驟與範例；只有用戶請求會變動）
+_SQL_SCHEMA_DESCRIPTION = """
         - 課程代碼 (NVARCHAR): 課程的唯一識別碼，格式類似 '114A47'.
         - 大類 (NVARCHAR): 課程的主要分類，例如 '有氧系列', '瑜珈系列', '舞蹈系列'.
         - 課程名稱 (NVARCHAR): 課程的具體名稱.
@@ -60,11 +186,11 @@ class RAGSystem:
         - 課程費用 (INT): 課程的價格.
         """
 
-        system_prompt = f"""
+_SQL_SYSTEM_PROMPT = f"""
         你是一個頂級的 SQL 專家，專長是將自然語言轉換為 SQL 查詢條件。請遵循「思維鏈」的步驟來分析用戶請求，並以 JSON 格式輸出結果。
 
         【資料庫欄位綱要】
-        {schema_description}
+        {_SQL_SCHEMA_DESCRIPTION}
 
         【執行步驟】
         1.  **思考 (thought)**: 逐步分析用戶的請求，拆解出所有的查詢意圖、實體和限制條件。
@@ -104,34 +230,285 @@ class RAGSystem:
         ```
         """
 
+# 找不到課程時生成澄清問題的固定提示
+_CLARIFY_SYSTEM_PROMPT = """
+        你是一個友善且專業的AI課程顧問。系統剛剛根據用戶的查詢找不到任何完全匹配的課程。
+        你的任務是：
+        1.  首先，明確地告知用戶，沒有找到完全符合他們「所有」條件的課程。請務必提到用戶的具體條件（例如「下午」、「王老師」等）。
+        2.  接著，立刻無縫地轉為提出有幫助的、引導性的問題，來放寬或修改搜尋條件。
+
+        重要原則:
+        1.  語氣要自然、友善。
+        2.  第一句話必須是直接的回應，承認找不到「完全符合」的結果。
+        3.  第二句話必須是開放性的提問，提供替代方案或詢問其他偏好。
+        4.  用繁體中文回答。
+
+        範例:
+        - 用戶查詢: "我想上一些下午的瑜伽課程"
+        - 你的回應: "抱歉，目前沒有找到完全符合在「下午」開課的瑜珈課程。不過我們有很多在早上或晚上開課的瑜珈選項，請問您對這些時段方便嗎？或者您對特定老師有沒有偏好呢？"
+        - 用戶查詢: "我想找王大明老師的課"
+        - 你的回應: "我們目前沒有找到「王大明」老師開設的課程。請問老師的名字是否正確？或者，您對其他老師的同類型課程會感興趣嗎？"
+        """
+
+# 課程推薦的固定系統提示：要求回傳 JSON，課名只能從允許清單挑選，且逐字一致
+_RECOMMEND_SYSTEM_PROMPT = """
+你是嚴謹的課程推薦助手。嚴格遵守：
+1) 只能推薦我提供的課程清單中的標題（逐字一致），不得創造新課名或新課程類型；
+2) 只能引用以下欄位：課程名稱（必須來自清單）、類別、授課教師、上課時間、費用、介紹；
+3) 若找不到合適課程，請提出一個澄清問題，不可輸出任何課名；
+4) 用繁體中文，口語但專業，簡明扼要；
+5) 僅輸出 JSON（不要任何額外文字）。
+
+澄清問題的限制：
+- 只能詢問以下面向：時段（早上/下午/晚上/平日/週末）、指定老師、價格範圍、偏好類別；
+- 禁止提及「線上/實體」除非提供的課程資訊中明確出現「線上」字樣；
+- 禁止舉例任何未在允許清單中的課名或風格名稱（例如哈達、流瑜珈、陰瑜珈等）除非該名稱就出現在允許清單中；
+
+請輸出以下 JSON 格式：
+{
+  "intro": "對用戶需求的簡短回應",
+  "recommendations": [
+    {"title": "必須是允許清單中的課名", "reason": "為何匹配"},
+    ... 最多 3 筆
+  ],
+  "clarify_question": "若無法完全匹配時的一句澄清問題（否則可為空字串）"
+}
+"""
+
+# 每次請求不同的允許清單（置於 user 訊息開頭，固定系統提示之後）
+_RECOMMEND_ALLOWED_TEMPLATE = """【允許的課程名稱（只能從此清單中挑選，且需逐字一致）】
+{allowed_titles}
+
+【允許的類別（可引用）】
+{allowed_categories}
+
+【允許的老師（可引用；可能為空）】
+{allowed_teachers}
+"""
+
+# 一般聊天情境的系統提示（非課程情境下，禁止提及具體課名/老師/風格/線上實體）
+# 每次請求都傳入同一個字串物件，對話歷史與用戶訊息一律放在第二則 user 訊息，
+# 使系統訊息前綴逐位元組一致，可命中 OpenAI 的提示前綴快取。
+# 注意：前綴快取只對 1024 tokens 以上的提示生效；此提示較短，目前主要效益是避免每次重建字串，
+# 若日後擴充規則使整體提示超過門檻，請勿在此字串中插入任何變動內容（含結尾空白）。
+_CHAT_SYSTEM_PROMPT = """你是一個友善的AI課程推薦助手，現在是一般聊天情境：
+1) 不要提及、舉例或推薦任何具體的課程名稱、老師姓名、課程風格（如哈達/流/陰瑜珈等）或上課型態（線上/實體）。
+2) 若對方主動詢問課程，請引導他簡述需求（時段/星期/老師/價格/類別），並說明你將根據「我們場館的現有課程」來推薦；在未檢索前仍不要說任何具體課名。
+3) 用繁體中文、自然友善、簡短回應。
+4) 如果話題與課程無關，就正常閒聊，但避免產出可能被誤解為我們場館提供的服務/課程資訊。
+"""
+
+_CHAT_USER_PROMPT_TEMPLATE = """
+            對話歷史:
+            {conversation_context}
+
+            用戶剛剛說: {user_message}
+
+            請根據對話歷史給出適當的回應。如果用戶在詢問課程相關問題，可以引導他們使用更具體的描述來獲得課程推薦。
+            """
+
+class SQLOut(BaseModel):
+    """generate_sql_where_clause 的模型輸出格式"""
+    thought: Optional[str] = ""
+    sql: Optional[str] = ""
+
+class RecommendationItem(BaseModel):
+    """單筆課程推薦"""
+    title: Optional[str] = ""
+    reason: Optional[str] = ""
+
+class RecommendationOut(BaseModel):
+    """generate_course_recommendation 的模型輸出格式"""
+    intro: Optional[str] = ""
+    recommendations: List[Optional[RecommendationItem]] = []
+    clarify_question: Optional[str] = ""
+
+class RAGSystem:
+    """RAG課程推薦系統 - 整合檢索增強生成功能"""
+    
+    def __init__(self, config: Config = None):
+        self.config = config or Config()
+        self.vector_store = None
+        self.retrieval_batcher = None
+        self.course_processor = None
+        self.openai_client = None
+        self.async_openai_client = None
+        self._http_client = None  # OpenAI 客戶端共用的 httpx 連線池（更換金鑰時沿用）
+        self._async_http_client = None
+        self._db_pool = None  # SQL Server 連線池（首次查詢時建立）
+        self._db_pool_lock = threading.Lock()
+        self._openai_semaphore = None  # 限制並發 OpenAI 請求數（於事件迴圈內建立）
+        self._openai_last_warm = 0.0  # 上次（預先）使用 OpenAI 連線的時間（monotonic）
+        self._loop = None  # 供同步呼叫端使用的背景事件迴圈
+        self._loop_lock = threading.Lock()
+        self.conversation_manager = ConversationManager()  # 新增對話管理器
+        self.last_data_file_mtime = None  # 記錄資料檔案的最後修改時間
+        self._categories_cache = None  # 課程類別快取（知識庫重建時失效）
+        self._grounding_cache: Dict[str, str] = {}  # 課程 id → grounding 描述（知識庫重建時失效）
+        # 課程 id 序列 → 允許清單與課程資料區塊；相同檢索結果重用逐字相同的提示前綴
+        self._grounding_block_cache = TTLCache(max_entries=128, ttl_seconds=float('inf'))
+        self._course_trigger_source = None  # 目前觸發關鍵字所依據的設定字串
+        self._ack_terms_source = None  # 目前制式回覆詞所依據的設定字串
+        self._ack_terms = frozenset()
+        self._load_course_triggers()
+        self.semantic_cache = SemanticCache(
+            threshold=self.config.CACHE_SIM_THRESHOLD,
+            max_entries=self.config.SEMANTIC_CACHE_MAX_ENTRIES,
+            ttl_seconds=self.config.SEMANTIC_CACHE_TTL_SECONDS
+        )
+        # 一般聊天回應的語意快取：相近訊息且對話脈絡相同時沿用先前回應
+        self.chat_cache = SemanticCache(
+            threshold=self.config.CHAT_CACHE_SIM_THRESHOLD,
+            max_entries=self.config.SEMANTIC_CACHE_MAX_ENTRIES,
+            ttl_seconds=self.config.SEMANTIC_CACHE_TTL_SECONDS
+        )
+        # 精確比對層：同一會話重送相同查詢時直接回傳上一輪結果（連向量都不必計算）
+        self._turn_cache = TTLCache(
+            max_entries=self.config.TURN_CACHE_MAX_ENTRIES,
+            ttl_seconds=self.config.TURN_CACHE_TTL_SECONDS
+        )
+        # 資料檔 stat 與向量庫統計的短期快取（_update_file_mtime 時失效）
+        self._stats_cache = TTLCache(max_entries=8, ttl_seconds=self.config.STATS_CACHE_TTL_SECONDS)
+        # 以檔案事件得知資料檔案變動；無法使用時 _should_update_data 退回比對修改時間
+        self._data_file_watcher = DataFileWatcher(self.config.COURSE_DATA_PATH)
+        self._data_file_watched = self._data_file_watcher.start()
+        self.setup_system()
+    
+    def setup_system(self):
+        """初始化RAG系統"""
+        try:
+            # 設定 OpenAI v1 客戶端（同步與非同步）
+            self.update_api_key(self.config.OPENAI_API_KEY)
+            
+            # 初始化課程處理器
+            self.course_processor = CourseProcessor()
+            
+            # 初始化向量數據庫
+            self.vector_store = VectorStore(self.config)
+            
+            # 合併並發查詢的檢索批次器
+            self.retrieval_batcher = RetrievalBatcher(
+                self.vector_store, self.config.RETRIEVAL_BATCHING
+            )
+            
+            # 背景預熱嵌入模型，與知識庫檢查等其餘啟動工作重疊
+            threading.Thread(
+                target=self.vector_store.warm_up, name="embedding-warm-up", daemon=True
+            ).start()
+            
+            logger.info("RAG系統初始化完成")
+            
+        except Exception as e:
+            logger.error(f"RAG系統初始化失敗: {e}")
+            raise
+
+    def update_api_key(self, api_key: str):
+        """以指定的 API 金鑰重新建立 OpenAI 客戶端（沿用既有連線池）"""
+        # 金鑰未變且客戶端仍可用時不重建（API 每個請求都可能帶同一把金鑰）
+        if (api_key == self.config.OPENAI_API_KEY and self._http_client is not None
+                and getattr(self, 'openai_client', None) is not None):
+            return
+        self.config.OPENAI_API_KEY = api_key
+        if self._http_client is None:
+            self._http_client = httpx.Client(
+                http2=_HTTP2_AVAILABLE, limits=_OPENAI_HTTP_LIMITS, timeout=_OPENAI_HTTP_TIMEOUT
+            )
+            self._async_http_client = httpx.AsyncClient(
+                http2=_HTTP2_AVAILABLE, limits=_OPENAI_HTTP_LIMITS, timeout=_OPENAI_HTTP_TIMEOUT
+            )
+        self.openai_client = OpenAI(api_key=api_key, http_client=self._http_client)
+        self.async_openai_client = AsyncOpenAI(api_key=api_key, http_client=self._async_http_client)
+
+    def close(self):
+        """關閉 OpenAI 連線池與背景事件迴圈"""
+        try:
+            if self._http_client is not None:
+                self._http_client.close()
+            if self._async_http_client is not None and self._loop is not None:
+                self.run_sync(self._async_http_client.aclose())
+        except Exception as e:
+            logger.warning(f"關閉連線時出現警告: {e}")
+        finally:
+            self._http_client = None
+            self._async_http_client = None
+            if self._db_pool is not None:
+                self._db_pool.close()
+                self._db_pool = None
+            self._data_file_watcher.stop()
+            with self._loop_lock:
+                if self._loop is not None:
+                    self._loop.call_soon_threadsafe(self._loop.stop)
+                    self._loop = None
+                    self._openai_semaphore = None
+
+    def run_sync(self, coro):
+        """在背景事件迴圈執行協程並等待結果（供 Streamlit 等同步呼叫端使用）。
+
+        所有非同步呼叫共用同一個事件迴圈，避免 AsyncOpenAI 的連線池跨迴圈使用。
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop()).result()
+
+    def iter_sync(self, agen: AsyncIterator) -> Iterator:
+        """在背景事件迴圈上逐項取用非同步產生器（供同步呼叫端轉發串流）"""
+        loop = self._get_loop()
+        try:
+            while True:
+                try:
+                    yield asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+                except StopAsyncIteration:
+                    return
+        finally:
+            asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """取得（必要時啟動）背景事件迴圈"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="rag-async-loop", daemon=True
+                ).start()
+        return self._loop
+
+    def _get_openai_semaphore(self) -> asyncio.Semaphore:
+        """取得 OpenAI 並發限制號誌（需在事件迴圈內呼叫）"""
+        if self._openai_semaphore is None:
+            self._openai_semaphore = asyncio.Semaphore(self.config.OPENAI_MAX_CONCURRENCY)
+        return self._openai_semaphore
+
+    def generate_sql_where_clause(self, user_query: str) -> str:
+        """
+        使用 AI 將自然語言查詢轉換為 SQL WHERE 條件子句（採用思維鏈 CoT 技術）。
+        """
+        logger.info(f"開始為查詢生成 SQL WHERE 子句 (CoT): {user_query}")
+
         try:
             response = self.openai_client.chat.completions.create(
                 model=self.config.MODEL_NAME,
                 messages=[
-                    {"role": "system", "content": system_prompt},
+                    {"role": "system", "content": _SQL_SYSTEM_PROMPT},
                     {"role": "user", "content": f"用戶請求: \"{user_query}\""}
                 ],
                 temperature=0.0,
                 max_tokens=500,
-                response_format={"type": "json_object"}
+                response_format={"type": "json_object"},
+                extra_body={"prompt_cache_key": _PROMPT_CACHE_KEYS['sql']}
             )
             
-            response_text = response.choices[0].message.content.strip()
+            # json_object 模式保證回傳 JSON；前後空白由解析器略過，不需先 strip
+            response_text = response.choices[0].message.content
             logger.info(f"AI (CoT) response: {response_text}")
             
-            import json
             try:
-                data = json.loads(response_text)
-                where_clause = data.get("sql", "")
+                where_clause = SQLOut.model_validate_json(response_text).sql or ""
                 
                 # 基本的安全檢查
-                forbidden_keywords = ['DROP', 'DELETE', 'UPDATE', 'INSERT', ';']
-                if any(keyword in where_clause.upper() for keyword in forbidden_keywords):
+                if _FORBIDDEN_SQL_RE.search(where_clause):
                     logger.warning(f"檢測到潛在的惡意 SQL 關鍵字，拒絕生成: {where_clause}")
                     return ""
                 
                 return where_clause
-            except json.JSONDecodeError:
+            except ValidationError:
                 logger.error(f"無法解析 AI 回傳的 JSON: {response_text}")
                 return ""
 
@@ -143,26 +520,53 @@ class RAGSystem:
         """
         使用提供的完整 SQL 查詢來獲取課程資料。
         """
+        columns, rows = self._fetch_rows(sql_query)
+        return [dict(zip(columns, row)) for row in rows]
+
+    def _fetch_rows(self, sql_query: str) -> Tuple[List[str], List[Any]]:
+        """執行 SQL 查詢並以批次 fetchmany 取回原始資料列；回傳 (欄位名稱, 資料列)"""
         logger.info(f"執行 SQL 查詢: {sql_query[:200]}...")
-        conn_str = (
-            f"DRIVER={self.config.DB_DRIVER};"
-            f"SERVER={self.config.DB_SERVER};"
-            f"DATABASE={self.config.DB_DATABASE};"
-            f"UID={self.config.DB_USER};"
-            f"PWD={self.config.DB_PASSWORD};"
-        )
-        courses = []
+        columns, rows = [], []
         try:
-            with pyodbc.connect(conn_str, timeout=5) as cnxn:
-                cursor = cnxn.cursor()
-                cursor.execute(sql_query)
-                columns = [column[0] for column in cursor.description]
-                rows = cursor.fetchall()
-                courses = [dict(zip(columns, row)) for row in rows]
-            logger.info(f"查詢成功，獲取了 {len(courses)} 筆課程。")
+            pool = self._get_db_pool()
+            # 池中連線可能已被伺服器中斷：連線層級錯誤時以新連線重試一次
+            for attempt in range(2):
+                try:
+                    with pool.connection() as cnxn:
+                        cursor = cnxn.cursor()
+                        cursor.arraysize = self.config.DB_FETCH_BATCH_SIZE
+                        cursor.execute(sql_query)
+                        columns = [column[0] for column in cursor.description]
+                        rows = []
+                        while True:
+                            batch = cursor.fetchmany(cursor.arraysize)
+                            if not batch:
+                                break
+                            rows.extend(batch)
+                    break
+                except (pyodbc.OperationalError, pyodbc.InterfaceError):
+                    if attempt:
+                        raise
+                    logger.warning("資料庫連線中斷，重新連線後重試")
+            logger.info(f"查詢成功，獲取了 {len(rows)} 筆課程。")
         except Exception as e:
             logger.error(f"執行 SQL 查詢失敗: {e}")
-        return courses
+            columns, rows = [], []
+        return columns, rows
+
+    def _get_db_pool(self) -> ConnectionPool:
+        """取得（必要時建立）SQL Server 連線池"""
+        with self._db_pool_lock:
+            if self._db_pool is None:
+                conn_str = (
+                    f"DRIVER={self.config.DB_DRIVER};"
+                    f"SERVER={self.config.DB_SERVER};"
+                    f"DATABASE={self.config.DB_DATABASE};"
+                    f"UID={self.config.DB_USER};"
+                    f"PWD={self.config.DB_PASSWORD};"
+                )
+                self._db_pool = ConnectionPool(conn_str, size=self.config.DB_POOL_SIZE, timeout=5)
+            return self._db_pool
 
     def query_database_with_ai(self, user_query: str) -> List[Dict[str, Any]]:
         """
@@ -175,27 +579,8 @@ class RAGSystem:
             logger.info("AI 未能生成有效的 WHERE 子句，返回空結果。")
             return []
 
-        # --- 翻譯層：將 AI 使用的別名翻譯回真實的 SQL 欄位 ---
-        translation_map = {
-            '大類': 'C.k02',
-            '課程名稱': 'B.k03',
-            '課程介紹': 'B.k18',
-            '教室名稱': 'D.k02',
-            '課程代碼': 'A.k34',
-            '授課教師': 'E.k02',
-            '上課週次': 'A.k07',
-            '課程費用': 'A.k13',
-            '體驗費用': 'A.k14',
-            '開班人數': 'A.k16',
-            '滿班人數': 'A.k17',
-            # 處理 CASE 和 CONVERT 的特殊情況
-            '年齡限制': "(CASE WHEN A.k80 = 0 THEN '無' ELSE '有' END)",
-            '上課時間': "(CONVERT(VARCHAR(5), A.k08, 108))"
-        }
-        
-        translated_where_clause = where_clause
-        for alias, real_column in translation_map.items():
-            translated_where_clause = translated_where_clause.replace(alias, real_column)
+        # --- 翻譯層：將 AI 使用的別名翻譯回真實的 SQL 欄位（單次掃描替換）---
+        translated_where_clause = _SQL_COLUMN_RE.sub(lambda m: _SQL_COLUMN_MAP[m.group(0)], where_clause)
         
         logger.info(f"翻譯後的 WHERE 子句: {translated_where_clause}")
         # --------------------------------------------------------
@@ -217,22 +602,32 @@ class RAGSystem:
         final_sql = f"{base_query} AND ({translated_where_clause})"
         
         # 執行查詢
-        courses_from_db = self.fetch_courses_by_sql(final_sql)
+        columns, rows = self._fetch_rows(final_sql)
+
+        # 將資料庫查詢結果轉換為 UI 期望的格式（欄位位置只計算一次，逐列以 itemgetter 直接取值，
+        # 不先轉成中介 dict）
+        position = {name: i for i, name in enumerate(columns)}
+        def column_getter(name: str):
+            i = position.get(name)
+            return operator.itemgetter(i) if i is not None else (lambda row: None)
+        title, category, description, teacher, age_limit, start_time, fee, trial_fee = (
+            column_getter(name) for name in
+            ('課程名稱', '大類', '課程介紹', '授課教師', '年齡限制', '上課時間', '課程費用', '體驗費用')
+        )
 
-        # 將資料庫查詢結果轉換為 UI 期望的格式
         transformed_courses = []
-        for course in courses_from_db:
+        for row in rows:
             transformed_courses.append({
-                'title': course.get('課程名稱'),
-                'category': course.get('大類'),
-                'description': course.get('課程介紹'),
+                'title': title(row),
+                'category': category(row),
+                'description': description(row),
                 'similarity_score': 1.0,  # 因為是精確篩選，所以給定一個假分數
                 'metadata': {
-                    'meta_授課教師': course.get('授課教師'),
-                    'meta_年齡限制': course.get('年齡限制'),
-                    'meta_上課時間': course.get('上課時間'),
-                    'meta_課程費用': course.get('課程費用'),
-                    'meta_體驗費用': course.get('體驗費用')
+                    'meta_授課教師': teacher(row),
+                    'meta_年齡限制': age_limit(row),
+                    'meta_上課時間': start_time(row),
+                    'meta_課程費用': fee(row),
+                    'meta_體驗費用': trial_fee(row)
                 }
             })
         
@@ -242,35 +637,23 @@ class RAGSystem:
         """
         當找不到課程時，生成一個澄清問題。
         """
-        logger.info(f"為查詢生成澄清問題: {user_query}")
-        system_prompt = """
-        你是一個友善且專業的AI課程顧問。系統剛剛根據用戶的查詢找不到任何完全匹配的課程。
-        你的任務是：
-        1.  首先，明確地告知用戶，沒有找到完全符合他們「所有」條件的課程。請務必提到用戶的具體條件（例如「下午」、「王老師」等）。
-        2.  接著，立刻無縫地轉為提出有幫助的、引導性的問題，來放寬或修改搜尋條件。
+        return self.run_sync(self._generate_clarifying_question_async(user_query))
 
-        重要原則:
-        1.  語氣要自然、友善。
-        2.  第一句話必須是直接的回應，承認找不到「完全符合」的結果。
-        3.  第二句話必須是開放性的提問，提供替代方案或詢問其他偏好。
-        4.  用繁體中文回答。
-
-        範例:
-        - 用戶查詢: "我想上一些下午的瑜伽課程"
-        - 你的回應: "抱歉，目前沒有找到完全符合在「下午」開課的瑜珈課程。不過我們有很多在早上或晚上開課的瑜珈選項，請問您對這些時段方便嗎？或者您對特定老師有沒有偏好呢？"
-        - 用戶查詢: "我想找王大明老師的課"
-        - 你的回應: "我們目前沒有找到「王大明」老師開設的課程。請問老師的名字是否正確？或者，您對其他老師的同類型課程會感興趣嗎？"
-        """
+    async def _generate_clarifying_question_async(self, user_query: str) -> str:
+        """非同步生成澄清問題，可與放寬條件的檢索同時進行"""
+        logger.info(f"為查詢生成澄清問題: {user_query}")
         try:
-            response = self.openai_client.chat.completions.create(
-                model=self.config.MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"用戶查詢: \"{user_query}\""}
-                ],
-                temperature=0.8,
-                max_tokens=300
-            )
+            async with self._get_openai_semaphore():
+                response = await self.async_openai_client.chat.completions.create(
+                    model=self.config.MODEL_NAME,
+                    messages=[
+                        {"role": "system", "content": _CLARIFY_SYSTEM_PROMPT},
+                        {"role": "user", "content": f"用戶查詢: \"{user_query}\""}
+                    ],
+                    temperature=0.8,
+                    max_tokens=300,
+                    extra_body={"prompt_cache_key": _PROMPT_CACHE_KEYS['clarify']}
+                )
             return response.choices[0].message.content.strip()
         except Exception as e:
             logger.error(f"生成澄清問題失敗: {e}")
@@ -284,6 +667,11 @@ class RAGSystem:
                 logger.info("檢測到資料檔案已更新，重新建立知識庫...")
                 force_rebuild = True
             
+            # 既有集合以舊的距離空間建立時必須重建
+            if self.vector_store.index_outdated:
+                logger.info("向量索引設定已過時，重新建立知識庫...")
+                force_rebuild = True
+            
             # 檢查是否已有數據
             stats = self.vector_store.get_collection_stats()
             
@@ -309,6 +697,13 @@ class RAGSystem:
             # 添加到向量數據庫
             self.vector_store.add_courses(courses_data)
             
+            # 類別與推薦內容可能隨資料變動，清除快取
+            self._categories_cache = None
+            self._grounding_cache = {}
+            self._grounding_block_cache.clear()
+            self.semantic_cache.clear()
+            self._turn_cache.clear()
+            
             # 更新檔案修改時間記錄
             self._update_file_mtime()
             
@@ -318,11 +713,43 @@ class RAGSystem:
             logger.error(f"初始化知識庫失敗: {e}")
             raise
     
-    def retrieve_relevant_courses(self, query: str, k: int = None) -> List[Dict[str, Any]]:
-        """檢索相關課程"""
+    def reload_index(self) -> Dict[str, int]:
+        """重新載入課程資料並只更新有變動的向量（保留嵌入模型、OpenAI 客戶端與連線池）"""
+        try:
+            # 捨棄已載入的課程資料，重新查詢
+            self.course_processor.courses_data = []
+            courses_data = self.course_processor.prepare_for_vectorization()
+            if not courses_data:
+                raise ValueError("未載入任何課程資料，保留現有知識庫")
+            
+            if self.vector_store.index_outdated:
+                # 增量同步無法更換距離空間，改為完整重建
+                self.initialize_knowledge_base(force_rebuild=True, check_updates=False)
+                return {'updated': len(courses_data), 'removed': 0, 'unchanged': 0}
+            
+            result = self.vector_store.sync_courses(courses_data)
+            
+            # 類別與推薦內容可能隨資料變動，清除快取
+            self._categories_cache = None
+            self._grounding_cache = {}
+            self._grounding_block_cache.clear()
+            self.semantic_cache.clear()
+            self._turn_cache.clear()
+            
+            # 更新檔案修改時間記錄
+            self._update_file_mtime()
+            return result
+            
+        except Exception as e:
+            logger.error(f"重新載入知識庫失敗: {e}")
+            raise
+    
+    def retrieve_relevant_courses(self, query: str, k: int = None,
+                                  query_embedding: List[float] = None) -> List[Dict[str, Any]]:
+        """檢索相關課程（可傳入預先計算的查詢向量以略過嵌入計算）"""
         try:
             k = k or self.config.RETRIEVAL_K
-            relevant_courses = self.vector_store.search_similar_courses(query, k)
+            relevant_courses = self.retrieval_batcher.search(query, k, query_embedding)
             
             # 如果返回空結果且可能是集合錯誤，嘗試重建
             if not relevant_courses:
@@ -340,8 +767,12 @@ class RAGSystem:
             
             # 記錄檢索結果
             logger.info(f"檢索到 {len(relevant_courses)} 個相關課程")
-            for course in relevant_courses:
-                logger.debug(f"課程: {course['title']}, 相似度: {course['similarity_score']:.3f}")
+            # 逐課程明細只在 DEBUG 層級組裝，並合併為單一訊息輸出
+            if relevant_courses and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("\n".join(
+                    f"課程: {course['title']}, 相似度: {course['similarity_score']:.3f}"
+                    for course in relevant_courses
+                ))
             
             return relevant_courses
             
@@ -358,216 +789,345 @@ class RAGSystem:
                     logger.error(f"重建後仍然失敗: {rebuild_error}")
             return []
     
-    def generate_course_recommendation(self, query: str, retrieved_courses: List[Dict[str, Any]], 
-                                      session_id: str = None) -> str:
-        """使用 GPT 生成課程推薦（嚴格避免幻覺；只允許輸出 Top‑K 中的課名）"""
-        try:
-            import json
-            if not retrieved_courses:
-                return "抱歉，我找不到符合您需求的課程。請嘗試用不同的關鍵字搜尋。"
-
-            # 允許的課名與老師名清單（用於約束 LLM 輸出）
-            allowed_titles = [c.get('title') for c in retrieved_courses if c.get('title')]
-            allowed_categories = list({c.get('category') for c in retrieved_courses if c.get('category')})
-            allowed_teachers = list({
-                c.get('metadata', {}).get('meta_授課教師')
-                for c in retrieved_courses if c.get('metadata', {}).get('meta_授課教師')
-            })
+    def _build_recommendation_messages(self, query: str,
+                                       retrieved_courses: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """構建課程推薦的 system/user 訊息（嚴格限制只能引用 Top‑K 課名）"""
+        # 課程區塊在前、查詢在後：相同檢索結果的 user 訊息前綴逐位元組一致，可命中提示快取
+        user_prompt = f"{self._grounding_block(retrieved_courses)}\n用戶查詢: {query}"
 
-            # Grounding：將課程轉為精簡、可讀的描述
-            grounding_texts = []
-            for course in retrieved_courses:
-                course_for_text = {
-                    '課程名稱': course.get('title'),
-                    '大類': course.get('category'),
-                    '課程介紹': course.get('description'),
-                    **course.get('metadata', {})
-                }
-                grounding_texts.append(self.course_processor.create_searchable_text(course_for_text))
+        return [
+            {"role": "system", "content": _RECOMMEND_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]
 
-            # 對話上下文
-            context = self.conversation_manager.get_conversation_context(session_id) if session_id else {}
+    def _grounding_block(self, retrieved_courses: List[Dict[str, Any]]) -> str:
+        """組裝允許清單與課程資料區塊；依課程 id 序列快取（知識庫重建時清除）"""
+        ids = tuple(c.get('id') for c in retrieved_courses)
+        cache_key = ids if None not in ids else None
+        if cache_key is not None:
+            block = self._grounding_block_cache.get(cache_key)
+            if block is not None:
+                return block
 
-            # 嚴格系統提示：要求回傳 JSON，課名只能從 allowed_titles 挑選，且逐字一致
-            system_prompt = f"""
-你是嚴謹的課程推薦助手。嚴格遵守：
-1) 只能推薦我提供的課程清單中的標題（逐字一致），不得創造新課名或新課程類型；
-2) 只能引用以下欄位：課程名稱（必須來自清單）、類別、授課教師、上課時間、費用、介紹；
-3) 若找不到合適課程，請提出一個澄清問題，不可輸出任何課名；
-4) 用繁體中文，口語但專業，簡明扼要；
-5) 僅輸出 JSON（不要任何額外文字）。
+        # 允許的課名、類別與老師名清單（用於約束 LLM 輸出）；單次走訪，
+        # 以 dict 去重並保留出現順序，使相同檢索結果產生逐字相同的提示
+        allowed_titles = []
+        categories = {}
+        teachers = {}
+        for c in retrieved_courses:
+            title = c.get('title')
+            if title:
+                allowed_titles.append(title)
+            category = c.get('category')
+            if category:
+                categories[category] = None
+            teacher = c.get('metadata', {}).get('meta_授課教師')
+            if teacher:
+                teachers[teacher] = None
+        allowed_categories = list(categories)
+        allowed_teachers = list(teachers)
 
-澄清問題的限制：
-- 只能詢問以下面向：時段（早上/下午/晚上/平日/週末）、指定老師、價格範圍、偏好類別；
-- 禁止提及「線上/實體」除非提供的課程資訊中明確出現「線上」字樣；
-- 禁止舉例任何未在允許清單中的課名或風格名稱（例如哈達、流瑜珈、陰瑜珈等）除非該名稱就出現在允許清單中；
+        # Grounding：將課程轉為精簡、可讀的描述（同一課程只組裝一次）
+        grounding_texts = [self._grounding_text(course) for course in retrieved_courses]
 
-【允許的課程名稱（只能從此清單中挑選，且需逐字一致）】
-{allowed_titles}
+        # 本次檢索的允許清單屬動態內容，與課程資料、查詢一起放在最後的 user 訊息，
+        # 讓固定系統提示逐位元組一致以命中提示快取
+        allowed_prompt = _RECOMMEND_ALLOWED_TEMPLATE.format_map({
+            'allowed_titles': allowed_titles,
+            'allowed_categories': allowed_categories,
+            'allowed_teachers': allowed_teachers
+        })
 
-【允許的類別（可引用）】
-{allowed_categories}
+        parts = [allowed_prompt, "相關課程資訊："]
+        for i, text in enumerate(grounding_texts, 1):
+            parts.append(f"--- 課程 {i} ---\n{text}")
+        block = "\n".join(parts)
+        if cache_key is not None:
+            self._grounding_block_cache.put(cache_key, block)
+        return block
 
-【允許的老師（可引用；可能為空）】
-{allowed_teachers}
+    def _grounding_text(self, course: Dict[str, Any]) -> str:
+        """取得課程的 grounding 描述；有課程 id 時快取結果（知識庫重建時清除）"""
+        course_id = course.get('id')
+        if course_id is not None:
+            text = self._grounding_cache.get(course_id)
+            if text is not None:
+                return text
 
-請輸出以下 JSON 格式：
-{{
-  "intro": "對用戶需求的簡短回應",
-  "recommendations": [
-    {{"title": "必須是允許清單中的課名", "reason": "為何匹配"}},
-    ... 最多 3 筆
-  ],
-  "clarify_question": "若無法完全匹配時的一句澄清問題（否則可為空字串）"
-}}
-"""
+        course_for_text = {
+            '課程名稱': course.get('title'),
+            '大類': course.get('category'),
+            '課程介紹': course.get('description'),
+            **course.get('metadata', {})
+        }
+        text = self.course_processor.create_searchable_text(course_for_text)
+        if course_id is not None:
+            self._grounding_cache[course_id] = text
+        return text
 
-            # 構建使用者訊息（包含查詢、對話重點與課程資料）
-            parts = [f"用戶查詢: {query}", "相關課程資訊："]
-            for i, text in enumerate(grounding_texts, 1):
-                parts.append(f"--- 課程 {i} ---\n{text}")
-            user_prompt = "\n".join(parts)
+    def _render_intro_line(self, intro: Optional[str]) -> str:
+        """組裝推薦開場白（移除越權用語）"""
+        intro = intro or "以下是根據您需求整理的推薦："
+        return f"🤖 {_strip_banned_terms(intro)}"
 
-            # 低溫度，要求輸出 JSON
-            response = self.openai_client.chat.completions.create(
+    def _render_recommendation_lines(self, data: RecommendationOut,
+                                     retrieved_courses: List[Dict[str, Any]]) -> List[str]:
+        """將模型回傳的 JSON 組裝為可讀文字（第一行固定為開場白）"""
+        # 後處理：只保留合法課名的推薦
+        safe_recs = []
+        titles_set = {c.get('title') for c in retrieved_courses if c.get('title')}
+        for r in data.recommendations:
+            if r and r.title in titles_set:
+                safe_recs.append(r)
+
+        # 保底策略：若模型未返回合法推薦，但我們有檢索結果，則使用檢索結果前3筆
+        if not safe_recs and retrieved_courses:
+            for c in retrieved_courses[:3]:
+                safe_recs.append(RecommendationItem(
+                    title=c.get('title'),
+                    reason='與您的需求最相關，且確實存在於我們的課程資料中。'
+                ))
+
+        # 組裝最終可讀文字（並淨化所有文字避免越權用語）
+        lines = [self._render_intro_line(data.intro)]
+
+        if safe_recs:
+            for idx, r in enumerate(safe_recs[:3], 1):
+                title = r.title
+                reason = r.reason or "這堂課與您的需求高度相符。"
+                reason = _strip_banned_terms(reason)
+                # 取出該課的其他資訊輔助展示（非必須）
+                matched = next((c for c in retrieved_courses if c.get('title') == title), None)
+                extra = []
+                if matched:
+                    cat = matched.get('category')
+                    teacher = matched.get('metadata', {}).get('meta_授課教師')
+                    time_ = matched.get('metadata', {}).get('meta_上課時間')
+                    fee = matched.get('metadata', {}).get('meta_課程費用')
+                    if cat: extra.append(f"類別：{cat}")
+                    if teacher: extra.append(f"老師：{teacher}")
+                    if time_: extra.append(f"時間：{time_}")
+                    if fee: extra.append(f"費用：{fee}")
+                details = (" • " + "；".join(extra)) if extra else ""
+                lines.append(f"\n⭐ 推薦 {idx}：{title}{details}\n• 理由：{reason}")
+        else:
+            clarify = data.clarify_question or "您是否接受不同的上課時段（早上/晚上），或有偏好的授課教師與價格範圍？"
+            if _BANNED_RE.search(clarify):
+                clarify = "您是否接受不同的上課時段（早上/晚上），或有偏好的授課教師與價格範圍？"
+            lines.append("目前沒有找到完全匹配的課程。")
+            lines.append(f"👉 {clarify}")
+
+        return lines
+
+    def stream_course_recommendation(self, query: str, retrieved_courses: List[Dict[str, Any]],
+                                     session_id: str = None) -> Iterator[str]:
+        """串流生成課程推薦：開場白一生成即輸出，其餘內容在 JSON 完整後輸出。
+
+        產出的片段直接串接（``"".join(...)``）即為完整推薦文字。
+        """
+        if not retrieved_courses:
+            yield "抱歉，我找不到符合您需求的課程。請嘗試用不同的關鍵字搜尋。"
+            return
+
+        # 語意快取：相近的查詢且檢索到同一組課程時，直接沿用先前生成的推薦
+        cache_namespace = (
+            'recommendation',
+            tuple(sorted(str(c.get('id') or c.get('title') or '') for c in retrieved_courses))
+        )
+        query_embedding = self._embed_query_for_cache(query)
+        if query_embedding is not None:
+            cached = self.semantic_cache.get(query_embedding, cache_namespace)
+            if cached is not None:
+                yield cached
+                return
+
+        emitted = False
+        produced = []
+        try:
+            messages = self._build_recommendation_messages(query, retrieved_courses)
+
+            buffer = io.StringIO()
+            depth = 0
+            in_string = False
+            escaped = False
+            closed = False
+            intro_line = None
+            deltas = self.iter_sync(self._stream_recommendation_deltas(messages))
+            try:
+                for delta in deltas:
+                    # 追蹤大括號深度（忽略字串內容），物件閉合即可停止接收
+                    for ch in delta:
+                        buffer.write(ch)
+                        if in_string:
+                            if escaped:
+                                escaped = False
+                            elif ch == '\\':
+                                escaped = True
+                            elif ch == '"':
+                                in_string = False
+                        elif ch == '"':
+                            in_string = True
+                        elif ch == '{':
+                            depth += 1
+                        elif ch == '}':
+                            depth -= 1
+                            if depth == 0:
+                                closed = True
+                                break
+
+                    # 開場白欄位完整後立即輸出，降低首字延遲
+                    if intro_line is None and not closed:
+                        match = _INTRO_FIELD_RE.search(buffer.getvalue())
+                        if match:
+                            intro = orjson.loads(f'"{match.group(1)}"')
+                            if intro:
+                                intro_line = self._render_intro_line(intro)
+                                emitted = True
+                                produced.append(intro_line)
+                                yield intro_line
+
+                    if closed:
+                        break
+            finally:
+                # 提前停止接收時立即關閉串流，釋放號誌並歸還連線
+                deltas.close()
+
+            data = RecommendationOut.model_validate_json(buffer.getvalue().strip())
+            lines = self._render_recommendation_lines(data, retrieved_courses)
+            if intro_line is not None and lines[0] == intro_line:
+                lines = lines[1:]
+            for line in lines:
+                piece = f"\n{line}" if emitted else line
+                emitted = True
+                produced.append(piece)
+                yield piece
+
+            if query_embedding is not None:
+                self.semantic_cache.put(query_embedding, "".join(produced), cache_namespace)
+
+        except Exception as e:
+            logger.error(f"生成課程推薦失敗: {e}")
+            yield f"\n{_RECOMMEND_ERROR_TEXT}" if emitted else _RECOMMEND_ERROR_TEXT
+
+    async def _stream_recommendation_deltas(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """串流取得推薦 JSON 的文字片段（與其他 OpenAI 呼叫共用並發上限）"""
+        async with self._get_openai_semaphore():
+            # 低溫度，要求輸出 JSON；以串流方式接收
+            stream = await self.async_openai_client.chat.completions.create(
                 model=self.config.MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
+                messages=messages,
                 temperature=0.0,
                 max_tokens=600,
-                response_format={"type": "json_object"}
+                response_format={"type": "json_object"},
+                stream=True,
+                extra_body={"prompt_cache_key": _PROMPT_CACHE_KEYS['recommend']}
             )
+            try:
+                async for chunk in stream:
+                    if chunk.choices:
+                        yield chunk.choices[0].delta.content or ""
+            finally:
+                # 呼叫端在 JSON 物件閉合後即停止，需關閉回應才會釋放連線池中的連線
+                await stream.response.aclose()
 
-            raw = response.choices[0].message.content.strip()
-            data = json.loads(raw)
-
-            # 後處理：只保留合法課名的推薦
-            recs = data.get('recommendations', []) or []
-            safe_recs = []
-            titles_set = set(allowed_titles)
-            for r in recs:
-                t = (r or {}).get('title', '')
-                if t in titles_set:
-                    safe_recs.append(r)
-
-            # 保底策略：若模型未返回合法推薦，但我們有檢索結果，則使用檢索結果前3筆
-            if not safe_recs and retrieved_courses:
-                for c in retrieved_courses[:3]:
-                    safe_recs.append({
-                        'title': c.get('title'),
-                        'reason': '與您的需求最相關，且確實存在於我們的課程資料中。'
-                    })
-
-            # 組裝最終可讀文字（並淨化所有文字避免越權用語）
-            lines = []
-            intro = data.get('intro') or "以下是根據您需求整理的推薦："
-            banned_terms = [
-                "線上", "線上課", "實體", "線下", "遠距",
-                "哈達", "流瑜伽", "流瑜珈", "陰瑜伽", "陰瑜珈", "阿斯坦加", "艾揚格", "熱瑜珈"
-            ]
-            for bt in banned_terms:
-                if bt in intro:
-                    intro = intro.replace(bt, "")
-            lines.append(f"🤖 {intro}")
-
-            if safe_recs:
-                for idx, r in enumerate(safe_recs[:3], 1):
-                    title = r.get('title')
-                    reason = r.get('reason') or "這堂課與您的需求高度相符。"
-                    for bt in banned_terms:
-                        if bt in reason:
-                            reason = reason.replace(bt, "")
-                    # 取出該課的其他資訊輔助展示（非必須）
-                    matched = next((c for c in retrieved_courses if c.get('title') == title), None)
-                    extra = []
-                    if matched:
-                        cat = matched.get('category')
-                        teacher = matched.get('metadata', {}).get('meta_授課教師')
-                        time_ = matched.get('metadata', {}).get('meta_上課時間')
-                        fee = matched.get('metadata', {}).get('meta_課程費用')
-                        if cat: extra.append(f"類別：{cat}")
-                        if teacher: extra.append(f"老師：{teacher}")
-                        if time_: extra.append(f"時間：{time_}")
-                        if fee: extra.append(f"費用：{fee}")
-                    details = (" • " + "；".join(extra)) if extra else ""
-                    lines.append(f"\n⭐ 推薦 {idx}：{title}{details}\n• 理由：{reason}")
-            else:
-                clarify = data.get('clarify_question') or "您是否接受不同的上課時段（早上/晚上），或有偏好的授課教師與價格範圍？"
-                if any(bt in clarify for bt in banned_terms):
-                    clarify = "您是否接受不同的上課時段（早上/晚上），或有偏好的授課教師與價格範圍？"
-                lines.append("目前沒有找到完全匹配的課程。")
-                lines.append(f"👉 {clarify}")
-
-            text = "\n".join(lines).strip()
-            logger.info(f"生成推薦完成，長度: {len(text)} 字符")
-            return text
-            
+    def _embed_query_for_cache(self, query: str) -> Optional[List[float]]:
+        """計算查詢向量供語意快取比對；失敗時回傳 None（略過快取）"""
+        try:
+            if self.vector_store and query:
+                return self.vector_store.embed_text(query) or None
         except Exception as e:
-            logger.error(f"生成課程推薦失敗: {e}")
-            return "抱歉，生成推薦時發生錯誤。請稍後再試。"
+            logger.warning(f"計算快取用查詢向量失敗: {e}")
+        return None
+
+    def generate_course_recommendation(self, query: str, retrieved_courses: List[Dict[str, Any]], 
+                                      session_id: str = None) -> str:
+        """使用 GPT 生成課程推薦（嚴格避免幻覺；只允許輸出 Top‑K 中的課名）"""
+        text = "".join(self.stream_course_recommendation(query, retrieved_courses, session_id)).strip()
+        logger.info(f"生成推薦完成，長度: {len(text)} 字符")
+        return text
     
-    def get_course_recommendation(self, query: str, k: int = None, session_id: str = None) -> Dict[str, Any]:
-        """獲取課程推薦（Top‑K 流程）：檢索 Top‑K → 交給 AI 生成口語化推薦"""
-        try:
-            logger.info(f"開始處理查詢 (Top-K): {query}")
+    def _warm_openai_connection(self):
+        """連線池可能已閒置過期時，於背景先建立到 OpenAI 的連線，讓 TLS 握手與嵌入、檢索重疊進行"""
+        now = time.monotonic()
+        idle = now - self._openai_last_warm
+        self._openai_last_warm = now
+        if self._http_client is None or self.openai_client is None or idle < self.config.OPENAI_KEEPALIVE_SECONDS:
+            return
+        threading.Thread(target=self._open_openai_connection, name="openai-warm", daemon=True).start()
 
-            # 記錄用戶查詢
-            if session_id:
-                self.conversation_manager.add_message(session_id, "user_query", query)
+    def _open_openai_connection(self):
+        """以不需驗證的 HEAD 請求建立連線並放回連線池"""
+        try:
+            self._http_client.head(str(self.openai_client.base_url))
+        except Exception as e:
+            logger.debug(f"預先建立 OpenAI 連線失敗: {e}")
 
-            # 1) 檢索 Top‑K 相關課程
-            topk = k or self.config.RETRIEVAL_K
-            retrieved_courses = self.retrieve_relevant_courses(query, topk)
+    def _retrieve_for_recommendation(self, query: str, k: int = None,
+                                     query_embedding: List[float] = None) -> List[Dict[str, Any]]:
+        """檢索 Top‑K 課程，並依用語中的時段字樣做二次過濾（例如：早上/下午/晚上）"""
+        # 檢索之後必定呼叫 OpenAI 生成推薦，先行建立連線
+        self._warm_openai_connection()
+        topk = k or self.config.RETRIEVAL_K
+        retrieved_courses = self.retrieve_relevant_courses(query, topk, query_embedding)
 
-            # 1.1) 依用語中的時段字樣做二次過濾（例如：早上/下午/晚上）
-            def parse_time_ok(t: str, bucket: str) -> bool:
-                try:
-                    if not t:
-                        return False
-                    hh, mm = t.split(":")
-                    mins = int(hh) * 60 + int(mm)
-                    if bucket == 'morning':  # 00:00–11:59
-                        return mins < 12 * 60
-                    if bucket == 'afternoon':  # 12:00–17:59
-                        return 12 * 60 <= mins < 18 * 60
-                    if bucket == 'evening':  # 18:00–23:59
-                        return mins >= 18 * 60
-                    return True
-                except:
+        def parse_time_ok(t: str, bucket: str) -> bool:
+            try:
+                if not t:
                     return False
+                hh, mm = t.split(":")
+                mins = int(hh) * 60 + int(mm)
+                if bucket == 'morning':  # 00:00–11:59
+                    return mins < 12 * 60
+                if bucket == 'afternoon':  # 12:00–17:59
+                    return 12 * 60 <= mins < 18 * 60
+                if bucket == 'evening':  # 18:00–23:59
+                    return mins >= 18 * 60
+                return True
+            except:
+                return False
+
+        q = query or ""
+        bucket = None
+        if '下午' in q:
+            bucket = 'afternoon'
+        elif any(w in q for w in ['早上', '上午']):
+            bucket = 'morning'
+        elif '晚上' in q:
+            bucket = 'evening'
+
+        filtered_courses = []
+        if bucket:
+            for c in retrieved_courses:
+                t = c.get('metadata', {}).get('meta_上課時間')
+                if parse_time_ok(t, bucket):
+                    filtered_courses.append(c)
+            # 若有符合時段的課，採用過濾後的集合
+            if filtered_courses:
+                retrieved_courses = filtered_courses
+
+        return retrieved_courses
+
+    def get_course_recommendation(self, query: str, k: int = None, session_id: str = None) -> Dict[str, Any]:
+        """獲取課程推薦（Top‑K 流程）：檢索 Top‑K → 交給 AI 生成口語化推薦"""
+        # 本輪要寫入對話歷史的消息，結束時一次保存
+        pending_messages = [{"type": "user_query", "content": query}]
+        try:
+            logger.info(f"開始處理查詢 (Top-K): {query}")
 
-            q = query or ""
-            bucket = None
-            if '下午' in q:
-                bucket = 'afternoon'
-            elif any(w in q for w in ['早上', '上午']):
-                bucket = 'morning'
-            elif '晚上' in q:
-                bucket = 'evening'
-
-            filtered_courses = []
-            if bucket:
-                for c in retrieved_courses:
-                    t = c.get('metadata', {}).get('meta_上課時間')
-                    if parse_time_ok(t, bucket):
-                        filtered_courses.append(c)
-                # 若有符合時段的課，採用過濾後的集合
-                if filtered_courses:
-                    retrieved_courses = filtered_courses
+            # 1) 檢索 Top‑K 相關課程（含時段二次過濾）
+            retrieved_courses = self._retrieve_for_recommendation(query, k)
 
             # 2) 生成推薦（僅基於檢索到的結果）
             recommendation = self.generate_course_recommendation(query, retrieved_courses, session_id)
 
-            # 3) 記錄系統回應與課程
+            # 3) 記錄用戶查詢、系統回應與課程
             if session_id:
-                self.conversation_manager.add_message(
-                    session_id,
-                    "system_response",
-                    recommendation,
-                    courses=retrieved_courses
-                )
+                pending_messages.append({
+                    "type": "system_response",
+                    "content": recommendation,
+                    "courses": retrieved_courses
+                })
+                self.conversation_manager.batch_add_messages(session_id, pending_messages)
 
             return {
                 'query': query,
@@ -579,6 +1139,9 @@ class RAGSystem:
 
         except Exception as e:
             logger.error(f"獲取課程推薦失敗 (Top-K): {e}")
+            # 失敗時仍保留用戶查詢紀錄
+            if session_id and len(pending_messages) == 1:
+                self.conversation_manager.batch_add_messages(session_id, pending_messages)
             return {
                 'query': query,
                 'retrieved_courses': [],
@@ -614,10 +1177,19 @@ class RAGSystem:
                     logger.error(f"重建後仍然失敗: {rebuild_error}")
             return []
     
+    def get_all_courses(self) -> List[Dict[str, Any]]:
+        """獲取全部課程（供介面一次載入後自行分組）"""
+        return self.vector_store.get_all_courses()
+    
     def get_all_categories(self) -> List[str]:
-        """獲取所有課程類別"""
+        """獲取所有課程類別（快取至知識庫重建為止）"""
         try:
-            return self.course_processor.get_course_categories()
+            if self._categories_cache is None:
+                categories = self.course_processor.get_course_categories()
+                if not categories:
+                    return []
+                self._categories_cache = tuple(categories)
+            return list(self._categories_cache)
         except Exception as e:
             logger.error(f"獲取課程類別失敗: {e}")
             return []
@@ -625,7 +1197,7 @@ class RAGSystem:
     def get_system_stats(self) -> Dict[str, Any]:
         """獲取系統統計資訊"""
         try:
-            vector_stats = self.vector_store.get_collection_stats()
+            vector_stats = self._get_collection_stats()
             categories = self.get_all_categories()
             
             # 獲取資料檔案資訊
@@ -649,11 +1221,18 @@ class RAGSystem:
     def _should_update_data(self) -> bool:
         """檢查是否需要更新資料"""
         try:
-            if not os.path.exists(self.config.COURSE_DATA_PATH):
+            # 有檔案事件監看時，未收到變動事件即可直接判定無更新（不必 stat）
+            if self.last_data_file_mtime is not None and self._data_file_watched:
+                if not self._data_file_watcher.consume_change():
+                    return False
+                self._stats_cache.clear()
+            
+            file_stat = self._stat_data_file()
+            if file_stat is None:
                 logger.warning(f"資料檔案不存在: {self.config.COURSE_DATA_PATH}")
                 return False
             
-            current_mtime = os.path.getmtime(self.config.COURSE_DATA_PATH)
+            current_mtime = file_stat.st_mtime
             
             # 如果是第一次檢查，先檢查知識庫是否有資料
             if self.last_data_file_mtime is None:
@@ -682,9 +1261,12 @@ class RAGSystem:
     
     def _update_file_mtime(self):
         """更新檔案修改時間記錄"""
+        # 資料已重新載入：捨棄快取的檔案與向量庫統計
+        self._stats_cache.clear()
         try:
-            if os.path.exists(self.config.COURSE_DATA_PATH):
-                self.last_data_file_mtime = os.path.getmtime(self.config.COURSE_DATA_PATH)
+            file_stat = self._stat_data_file()
+            if file_stat is not None:
+                self.last_data_file_mtime = file_stat.st_mtime
                 logger.debug(f"更新檔案修改時間記錄: {datetime.fromtimestamp(self.last_data_file_mtime)}")
         except Exception as e:
             logger.error(f"更新檔案修改時間失敗: {e}")
@@ -692,26 +1274,44 @@ class RAGSystem:
     def _get_data_file_info(self) -> Dict[str, Any]:
         """獲取資料檔案資訊"""
         try:
-            if not os.path.exists(self.config.COURSE_DATA_PATH):
+            file_stat = self._stat_data_file()
+            if file_stat is None:
                 return {'last_modified': '檔案不存在', 'size': 0}
             
-            mtime = os.path.getmtime(self.config.COURSE_DATA_PATH)
-            size = os.path.getsize(self.config.COURSE_DATA_PATH)
-            
             return {
-                'last_modified': datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S"),
-                'size': f"{size / 1024:.1f} KB"
+                'last_modified': datetime.fromtimestamp(file_stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
+                'size': f"{file_stat.st_size / 1024:.1f} KB"
             }
         except Exception as e:
             logger.error(f"獲取檔案資訊失敗: {e}")
             return {'last_modified': '錯誤', 'size': 0}
     
+    def _stat_data_file(self) -> Optional[os.stat_result]:
+        """取得資料檔案的 stat 結果（不存在時為 None）；短時間內的重複查詢沿用快取"""
+        cached = self._stats_cache.get('data_file')
+        if cached is None:
+            try:
+                cached = (os.stat(self.config.COURSE_DATA_PATH),)
+            except FileNotFoundError:
+                cached = (None,)
+            self._stats_cache.put('data_file', cached)
+        return cached[0]
+    
+    def _get_collection_stats(self) -> Dict[str, Any]:
+        """取得向量庫統計；短時間內的重複查詢沿用快取"""
+        stats = self._stats_cache.get('collection')
+        if stats is None:
+            stats = self.vector_store.get_collection_stats()
+            self._stats_cache.put('collection', stats)
+        return stats
+    
     def check_and_reload_if_updated(self) -> Dict[str, Any]:
         """檢查並重新載入更新的資料"""
         try:
             if self._should_update_data():
                 logger.info("檢測到資料更新，開始重新載入...")
                 self.initialize_knowledge_base(force_rebuild=True, check_updates=False)
+                self._categories_cache = None
                 return {
                     'updated': True,
                     'message': '資料已成功更新',
@@ -745,21 +1345,20 @@ class RAGSystem:
             is_course_query = self._is_course_related_query(refined_query)
             
             if is_course_query:
-                # 如果是課程相關查詢，使用 get_course_recommendation 進行處理
-                logger.info(f"使用 get_course_recommendation 處理課程問題: {refined_query}")
-                
-                # 呼叫我們修改過的 RAG 函式
-                # 注意: get_course_recommendation 內部已經記錄了 user_query，所以這裡不用重複記錄
-                recommendation_result = self.get_course_recommendation(refined_query, session_id=session_id)
+                # 如果是課程相關查詢，使用聊天課程推薦流程（含語意快取）處理
+                logger.info(f"使用聊天課程推薦處理課程問題: {refined_query}")
+                recommendation_result = self.run_sync(
+                    self._get_course_recommendation_for_chat(session_id, refined_query, user_message)
+                )
                 
                 ai_response = recommendation_result['recommendation']
                 courses = recommendation_result['retrieved_courses']
                 
-                # 注意：推薦和訊息記錄已在 get_course_recommendation 內部完成，此處無需重複
+                # 注意：user_query 與推薦的訊息記錄已在 _get_course_recommendation_for_chat 內部完成，此處無需重複
             else:
                 # 如果是一般聊天，使用原有的聊天回應生成邏輯
                 context = self.conversation_manager.get_conversation_context(session_id)
-                ai_response = self._generate_chat_response(user_message, context)
+                ai_response = self.run_sync(self._generate_chat_response(user_message, context, session_id))
                 courses = []
                 
                 # 記錄AI回應
@@ -788,70 +1387,252 @@ class RAGSystem:
                 'is_course_query': False
             }
     
-    def _get_course_recommendation_for_chat(self, user_message: str, session_id: str) -> Dict[str, Any]:
-        """專門用於聊天的課程推薦方法"""
+    def chat_with_user_stream(self, session_id: str, user_message: str) -> Iterator[str]:
+        """聊天功能（串流版）- 逐段產出 AI 回應文字，供 WebSocket/SSE 等介面即時轉發。
+
+        串流結束後回應與推薦課程已寫入對話歷史，可透過 get_conversation_history 取得課程清單。
+        """
+        pieces = []
         try:
-            # 記錄用戶消息為聊天消息
+            # 記錄用戶原始消息
             self.conversation_manager.add_message(session_id, "user_message", user_message)
-            
-            # 獲取對話上下文並優化查詢
+
+            # 結合對話歷史，生成一個更豐富的查詢
             refined_query = self.conversation_manager.get_refined_query(session_id, user_message)
-            
-            # 檢索相關課程
-            retrieved_courses = self.retrieve_relevant_courses(refined_query)
-            
-            if not retrieved_courses:
-                recommendation = "抱歉，我找不到符合您需求的課程。請嘗試用不同的關鍵字搜尋，例如：'有氧運動'、'瑜珈'、'游泳'、'球類運動'等。"
+            logger.info(f"原始查詢: '{user_message}', 上下文優化後查詢: '{refined_query}'")
+
+            if self._is_course_related_query(refined_query):
+                logger.info(f"使用串流推薦處理課程問題: {refined_query}")
+                self.conversation_manager.add_message(session_id, "user_query", refined_query)
+                courses = yield from self._stream_course_turn(session_id, refined_query, pieces, user_message)
+
+                self.conversation_manager.add_message(
+                    session_id, "system_response", "".join(pieces).strip(), courses=courses
+                )
             else:
-                # 生成推薦
-                recommendation = self.generate_course_recommendation(user_message, retrieved_courses, session_id)
-            
-            # 記錄AI回應為聊天回應
-            self.conversation_manager.add_message(
-                session_id, "ai_response", recommendation, courses=retrieved_courses
-            )
-            
-            return {
-                'recommendation': recommendation,
-                'retrieved_courses': retrieved_courses,
-                'success': len(retrieved_courses) > 0
+                context = self.conversation_manager.get_conversation_context(session_id)
+                for piece in self.iter_sync(self._stream_chat_response(user_message, context, session_id)):
+                    pieces.append(piece)
+                    yield piece
+
+                ai_response = "".join(pieces).strip()
+                self.conversation_manager.add_message(
+                    session_id, "ai_response", ai_response, courses=[]
+                )
+
+        except Exception as e:
+            logger.error(f"串流聊天處理失敗: {e}")
+            error_response = "抱歉，我遇到了一些問題。請稍後再試。"
+            self.conversation_manager.add_message(session_id, "ai_response", error_response)
+            if not pieces:
+                yield error_response
+
+    async def _plan_course_turn(self, session_id: str, query: str, user_message: str = None) -> Dict[str, Any]:
+        """聊天課程回合的前置處理：重送比對、語意快取比對，未命中時檢索課程
+
+        回傳的 plan 含 'result'（快取命中或查無課程時的澄清問題，可直接回覆）
+        或 'retrieved_courses'（待生成推薦）；生成完成後交由 _finish_course_turn 寫入快取。
+        """
+        # 重送（重試/重新連線）的同一查詢：直接沿用上一輪結果，連向量都不必計算
+        turn_key = (session_id, " ".join(query.split()))
+        turn_result = self._turn_cache.get(turn_key)
+        if turn_result is not None:
+            logger.info(f"重送的查詢，沿用上一輪結果: {query}")
+            return {'turn_key': turn_key, 'result': copy.deepcopy(turn_result)}
+        
+        # 一次批次計算查詢與原始訊息的向量：前者用於快取比對與檢索，後者作為快取別名
+        embed_inputs = [query]
+        if user_message and user_message != query:
+            embed_inputs.append(user_message)
+        embeddings = await asyncio.to_thread(self.vector_store.embed_texts, embed_inputs) if query else []
+        query_embedding = embeddings[0] if embeddings else None
+        cache_namespace = self._semantic_cache_namespace(query)
+        plan = {
+            'turn_key': turn_key,
+            'query_embedding': query_embedding,
+            'cache_namespace': cache_namespace,
+            'aliases': list(zip(embed_inputs[1:], embeddings[1:]))
+        }
+        
+        # 語意快取：相似查詢（且時段/星期/課程代碼條件一致）直接沿用先前結果，略過檢索與生成
+        cached = self.semantic_cache.get(query_embedding, cache_namespace) if query_embedding else None
+        if cached:
+            plan['result'] = {
+                'recommendation': cached['recommendation'],
+                'retrieved_courses': cached['retrieved_courses'],
+                'success': True
             }
+            return plan
+        
+        # 檢索相關課程（沿用已算好的查詢向量；阻塞操作移至執行緒，避免卡住事件迴圈）
+        retrieved_courses = await asyncio.to_thread(
+            self._retrieve_for_recommendation, query, None, query_embedding
+        )
+        
+        if not retrieved_courses:
+            # 查無課程：以原始訊息放寬檢索，同時生成澄清問題，兩者重疊以省下一次往返
+            clarify_task = asyncio.ensure_future(self._generate_clarifying_question_async(user_message or query))
+            for text, embedding in plan['aliases']:
+                retrieved_courses = await asyncio.to_thread(
+                    self._retrieve_for_recommendation, text, None, embedding or None
+                )
+            if retrieved_courses:
+                clarify_task.cancel()
+            else:
+                plan['result'] = {
+                    'recommendation': await clarify_task,
+                    'retrieved_courses': [],
+                    'success': False
+                }
+                return plan
+        
+        plan['retrieved_courses'] = retrieved_courses
+        return plan
+    
+    def _finish_course_turn(self, plan: Dict[str, Any], recommendation: str,
+                            retrieved_courses: List[Dict[str, Any]]):
+        """生成推薦後寫入重送快取與語意快取（生成失敗的回覆不寫入；查無課程時不寫入語意快取）"""
+        if _RECOMMEND_ERROR_TEXT in recommendation:
+            return
+        self._turn_cache.put(plan['turn_key'], copy.deepcopy({
+            'recommendation': recommendation,
+            'retrieved_courses': retrieved_courses,
+            'success': True
+        }))
+        if not plan['query_embedding'] or not retrieved_courses:
+            return
+        payload = {
+            'recommendation': recommendation,
+            'retrieved_courses': retrieved_courses
+        }
+        self.semantic_cache.put(plan['query_embedding'], payload, plan['cache_namespace'])
+        # 原始訊息的向量作為別名鍵（條件一致時），讓相近說法下次直接命中
+        for text, embedding in plan['aliases']:
+            if embedding and self._semantic_cache_namespace(text) == plan['cache_namespace']:
+                self.semantic_cache.put(embedding, payload, plan['cache_namespace'])
+    
+    async def _get_course_recommendation_for_chat(self, session_id: str, query: str,
+                                                  user_message: str = None) -> Dict[str, Any]:
+        """聊天中的課程推薦：與 get_course_recommendation 相同流程，並先比對語意快取"""
+        # 本輪要寫入對話歷史的消息，結束時一次保存
+        pending_messages = [{"type": "user_query", "content": query}]
+        try:
+            plan = await self._plan_course_turn(session_id, query, user_message)
+            result = plan.get('result')
+            if result is None:
+                retrieved_courses = plan['retrieved_courses']
+                recommendation = await asyncio.to_thread(
+                    self.generate_course_recommendation, query, retrieved_courses, session_id
+                )
+                self._finish_course_turn(plan, recommendation, retrieved_courses)
+                result = {
+                    'recommendation': recommendation,
+                    'retrieved_courses': retrieved_courses,
+                    'success': True
+                }
+            
+            pending_messages.append({
+                "type": "system_response",
+                "content": result['recommendation'],
+                "courses": result['retrieved_courses']
+            })
+            self.conversation_manager.batch_add_messages(session_id, pending_messages)
+            return result
             
         except Exception as e:
             logger.error(f"聊天課程推薦失敗: {e}")
+            if len(pending_messages) == 1:
+                self.conversation_manager.batch_add_messages(session_id, pending_messages)
             return {
                 'recommendation': "抱歉，我遇到了一些問題。請稍後再試。",
                 'retrieved_courses': [],
                 'success': False
             }
     
+    def _stream_course_turn(self, session_id: str, query: str, pieces: List[str],
+                            user_message: str = None) -> Iterator[str]:
+        """串流聊天中的課程推薦（語意快取命中時一次產出）；產出片段同時附加到 pieces，回傳推薦課程"""
+        plan = self.run_sync(self._plan_course_turn(session_id, query, user_message))
+        result = plan.get('result')
+        if result is not None:
+            pieces.append(result['recommendation'])
+            yield result['recommendation']
+            return result['retrieved_courses']
+        
+        retrieved_courses = plan['retrieved_courses']
+        for piece in self.stream_course_recommendation(query, retrieved_courses, session_id):
+            pieces.append(piece)
+            yield piece
+        self._finish_course_turn(plan, "".join(pieces).strip(), retrieved_courses)
+        return retrieved_courses
+    
+    def _semantic_cache_namespace(self, query: str) -> tuple:
+        """語意快取的命名空間：語意相近但時段/星期/課程代碼不同的查詢不可共用結果"""
+        return (
+            self.vector_store._extract_time_bucket(query),
+            tuple(self.vector_store._extract_weekday_filter(query)),
+            tuple(self.vector_store._extract_course_codes(query))
+        )
+    
+    @staticmethod
+    def _chat_cache_namespace(recent_formatted: str, user_message: str) -> tuple:
+        """聊天快取的命名空間：本輪之前對話脈絡的雜湊
+
+        呼叫端在取得上下文前已寫入本輪用戶消息，需去除結尾這一行，
+        否則命名空間包含訊息原文，只有逐字相同的訊息才會命中。
+        """
+        history = recent_formatted
+        current_line = ConversationManager._format_chat_line({"type": "user_message", "content": user_message})
+        if history == current_line:
+            history = ""
+        elif history.endswith("\n" + current_line):
+            history = history[:-len(current_line) - 1]
+        return ('chat', hashlib.blake2b(history.encode('utf-8'), digest_size=16).hexdigest())
+    
+    def _load_course_triggers(self):
+        """解析觸發關鍵字設定並建立比對器；僅在設定字串變動時重新建立"""
+        source = (
+            self.config.COURSE_TRIGGER_KEYWORDS,
+            self.config.COURSE_TRIGGER_VERBS,
+            self.config.COURSE_TRIGGER_TIME_SIGNALS,
+            self.config.COURSE_TRIGGER_WEEK_SIGNALS,
+        )
+        if source == self._course_trigger_source:
+            return
+
+        self._course_trigger_matcher = _build_course_trigger_matcher(source)
+        self._course_trigger_source = source
+
     def _is_course_related_query(self, message: str) -> bool:
         """判斷消息是否與課程相關（積極模式，較容易觸發檢索）。"""
         if not message:
             return False
         msg = str(message)
 
-        # 1) 類別/課程關鍵字（包含單字「課」與更廣義的類別詞）
-        def _split_env_list(value: str) -> list:
-            return [x.strip() for x in (value or '').split(',') if x.strip()]
+        self._load_course_triggers()
 
-        category_keywords = _split_env_list(self.config.COURSE_TRIGGER_KEYWORDS)
-        if any(k in msg for k in category_keywords):
-            return True
+        # 課程代碼須同時含英文字母與數字
+        has_code_chars = not _ASCII_DIGITS.isdisjoint(msg) and not _ASCII_ALPHA.isdisjoint(msg)
 
+        # 快速預篩：不含任何關鍵字首字元、也不可能含課程代碼的訊息必定不相關
+        if not has_code_chars and self._course_trigger_matcher.first_chars.isdisjoint(msg):
+            return False
+
+        # 單次掃描取得命中的關鍵字類別；類別詞或觸發動詞已足以判定，命中即停止掃描
+        hits = self._course_trigger_matcher.match_kinds(msg, _DECISIVE_TRIGGER_KINDS)
+
+        # 1) 類別/課程關鍵字（包含單字「課」與更廣義的類別詞）
         # 2) 觸發動詞（學/學習/想學/想上/想報名/想參加）
-        intent_verbs = _split_env_list(self.config.COURSE_TRIGGER_VERBS)
-        if any(v in msg for v in intent_verbs):
+        if 'category' in hits or 'verb' in hits:
             return True
 
         # 3) 時段/星期信號 + 類別/課程意圖的組合
-        time_signals = _split_env_list(self.config.COURSE_TRIGGER_TIME_SIGNALS)
-        week_signals = _split_env_list(self.config.COURSE_TRIGGER_WEEK_SIGNALS)
-        if (any(t in msg for t in time_signals) or any(w in msg for w in week_signals)) and \
-           any(k in msg for k in ['課', '上課', '課程', '瑜珈', '有氧', '游泳', '健身', '運動']):
+        if ('time' in hits or 'week' in hits) and 'course' in hits:
             return True
 
         # 4) 課程代碼信號（英數混合碼）
+        if not has_code_chars:
+            return False
         try:
             if hasattr(self, 'vector_store') and self.vector_store:
                 codes = self.vector_store._extract_course_codes(msg)
@@ -862,65 +1643,113 @@ class RAGSystem:
 
         return False
     
-    def _generate_chat_response(self, user_message: str, context: Dict[str, Any]) -> str:
+    def _is_trivial_message(self, user_message: str) -> bool:
+        """判斷是否為空白、單字元或純附和（如「ok」「嗯」）的訊息"""
+        stripped = (user_message or '').strip()
+        if len(stripped) <= 1:
+            return True
+        ack_source = self.config.CHAT_ACK_TERMS
+        if self._ack_terms_source != ack_source:
+            self._ack_terms = frozenset(_split_env_list(ack_source))
+            self._ack_terms_source = ack_source
+        return stripped in self._ack_terms
+    
+    def _chat_token_budget(self, context: Dict[str, Any]) -> int:
+        """依會話近期回應長度（EMA，字元數）決定聊天回應的生成上限
+
+        中文約一字一個 token 以上，上限取 EMA 的 3 倍另加餘裕，避免略長的回應被截斷。
+        """
+        ema = context.get('out_len_ema')
+        if ema is None:
+            return self.config.CHAT_MAX_TOKENS
+        return max(self.config.CHAT_MIN_TOKENS, min(self.config.CHAT_MAX_TOKENS, int(3 * ema) + 64))
+    
+    async def _generate_chat_response(self, user_message: str, context: Dict[str, Any],
+                                      session_id: str = None) -> str:
         """生成聊天回應（非課程查詢時）。嚴禁捏造課程/風格/線上實體等資訊。"""
-        try:
-            # 構建聊天提示（非課程情境下，禁止提及具體課名/老師/風格/線上實體）
-            system_prompt = """你是一個友善的AI課程推薦助手，現在是一般聊天情境：
-1) 不要提及、舉例或推薦任何具體的課程名稱、老師姓名、課程風格（如哈達/流/陰瑜珈等）或上課型態（線上/實體）。
-2) 若對方主動詢問課程，請引導他簡述需求（時段/星期/老師/價格/類別），並說明你將根據「我們場館的現有課程」來推薦；在未檢索前仍不要說任何具體課名。
-3) 用繁體中文、自然友善、簡短回應。
-4) 如果話題與課程無關，就正常閒聊，但避免產出可能被誤解為我們場館提供的服務/課程資訊。
-"""
+        pieces = [piece async for piece in self._stream_chat_response(user_message, context, session_id)]
+        return "".join(pieces).strip()
+    
+    async def _stream_chat_response(self, user_message: str, context: Dict[str, Any],
+                                    session_id: str = None) -> AsyncIterator[str]:
+        """串流生成聊天回應：逐段產出已移除禁詞的文字，首段在模型輸出第一個 token 後即送出。
 
-            # 構建對話歷史
-            chat_history = []
-            if context.get('messages'):
-                recent_messages = context['messages'][-6:]  # 最近6條消息
-                for msg in recent_messages:
-                    if msg['type'] == 'user_message':
-                        chat_history.append(f"用戶: {msg['content']}")
-                    elif msg['type'] == 'ai_response':
-                        chat_history.append(f"助手: {msg['content']}")
-            
-            # 構建完整提示
-            conversation_context = "\n".join(chat_history) if chat_history else "這是對話的開始。"
-            
-            user_prompt = f"""
-            對話歷史:
-            {conversation_context}
+        提供 session_id 時，依模型完整生成的回應更新該會話的回應長度 EMA。
+        """
+        emitted = False
+        produced = []
+        finish_reason = None
+        try:
+            # 對話歷史由 ConversationManager 在新增消息時預先格式化
+            conversation_context = context.get('recent_formatted') or "這是對話的開始。"
 
-            用戶剛剛說: {user_message}
+            # 語意快取：以訊息向量比對，命名空間為本輪之前的對話脈絡，脈絡不同的回應不會被沿用
+            cache_namespace = self._chat_cache_namespace(context.get('recent_formatted') or "", user_message)
+            message_embedding = await asyncio.to_thread(self._embed_query_for_cache, user_message)
+            if message_embedding is not None:
+                cached = self.chat_cache.get(message_embedding, cache_namespace)
+                if cached is not None:
+                    emitted = True
+                    yield cached
+                    return
 
-            請根據對話歷史給出適當的回應。如果用戶在詢問課程相關問題，可以引導他們使用更具體的描述來獲得課程推薦。
-            """
+            user_prompt = _CHAT_USER_PROMPT_TEMPLATE.format_map({
+                'conversation_context': conversation_context,
+                'user_message': user_message
+            })
 
-            # 呼叫GPT
-            response = self.openai_client.chat.completions.create(
-                model=self.config.MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.2,
-                max_tokens=300,
-                top_p=0.9
-            )
+            # 呼叫GPT（非同步串流，並以號誌限制並發數）
+            async with self._get_openai_semaphore():
+                stream = await self.async_openai_client.chat.completions.create(
+                    model=self.config.MODEL_NAME,
+                    messages=[
+                        {"role": "system", "content": _CHAT_SYSTEM_PROMPT},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    temperature=0.2,
+                    max_tokens=self._chat_token_budget(context),
+                    top_p=0.9,
+                    stream=True,
+                    extra_body={"prompt_cache_key": _PROMPT_CACHE_KEYS['chat']}
+                )
+                
+                # 最後防呆：逐段移除常見禁詞；尾端原文保留數字元，避免禁詞被切在兩個片段之間
+                banned_filter = _BannedTermStreamFilter()
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    finish_reason = chunk.choices[0].finish_reason or finish_reason
+                    text = banned_filter.feed(chunk.choices[0].delta.content or "")
+                    if not emitted:
+                        text = text.lstrip()
+                    if text:
+                        emitted = True
+                        produced.append(text)
+                        yield text
+                
+                tail = banned_filter.flush()
+                tail = tail.rstrip() if emitted else tail.strip()
+                if tail:
+                    emitted = True
+                    produced.append(tail)
+                    yield tail
             
-            text = response.choices[0].message.content.strip()
-            # 最後防呆：移除常見禁詞，避免誤導
-            banned_terms = [
-                "線上", "線上課", "實體", "線下", "遠距",
-                "哈達", "流瑜伽", "流瑜珈", "陰瑜伽", "陰瑜珈", "阿斯坦加", "艾揚格", "熱瑜珈"
-            ]
-            for bt in banned_terms:
-                if bt in text:
-                    text = text.replace(bt, "")
-            return text
+            if finish_reason == "length":
+                # 回應被生成上限截斷：不快取、不以截斷的長度更新 EMA，下一輪恢復最大上限
+                logger.info("聊天回應達到生成上限被截斷，下一輪恢復最大上限")
+                if session_id:
+                    self.conversation_manager.reset_output_length(session_id)
+            elif produced:
+                reply = "".join(produced)
+                if message_embedding is not None:
+                    self.chat_cache.put(message_embedding, reply, cache_namespace)
+                if session_id:
+                    self.conversation_manager.update_output_length(session_id, len(reply))
             
         except Exception as e:
-            logger.error(f"生成聊天回應失敗: {e}")
-            return "我好像有點不太明白，可以換個方式說嗎？或者告訴我您想了解什麼樣的課程？"
+            logger.error("生成聊天回應失敗: %s", e)
+            if not emitted:
+                yield "我好像有點不太明白，可以換個方式說嗎？或者告訴我您想了解什麼樣的課程？"
     
     def handle_user_feedback(self, session_id: str, feedback_content: str, 
                            feedback_type: str = "dissatisfied", 
@@ -957,7 +1786,7 @@ class RAGSystem:
             }
             
         except Exception as e:
-            logger.error(f"處理用戶反饋失敗: {e}")
+            logger.error("處理用戶反饋失敗: %s", e)
             return {
                 'success': False,
                 'message': f'處理反饋時發生錯誤: {str(e)}',
@@ -976,24 +1805,35 @@ class RAGSystem:
         """清空對話歷史"""
         self.conversation_manager.clear_session(session_id)
     
-    def process_user_query_for_existing_message(self, session_id: str, user_message: str) -> Dict[str, Any]:
-        """處理已存在的用戶消息 - NOW USES RAG"""
+    async def process_user_query_for_existing_message(self, session_id: str, user_message: str) -> Dict[str, Any]:
+        """處理已存在的用戶消息 - NOW USES RAG（同步呼叫端請透過 run_sync 執行）"""
         try:
             is_course_query = self._is_course_related_query(user_message)
             
+            # 快速路徑：空白、單字元或純附和的訊息直接以制式回覆處理，不呼叫模型
+            if not is_course_query and self._is_trivial_message(user_message):
+                logger.info(f"簡短訊息，使用制式回覆: {user_message!r}")
+                self.conversation_manager.add_message(
+                    session_id, "ai_response", _CANNED_ACK_RESPONSE, courses=[]
+                )
+                return {
+                    'success': True,
+                    'ai_response': _CANNED_ACK_RESPONSE,
+                    'courses': [],
+                    'is_course_query': False
+                }
+            
             if is_course_query:
-                logger.info(f"使用 get_course_recommendation 處理課程問題: {user_message}")
-                
-                # 呼叫我們修改過的 RAG 函式
-                recommendation_result = self.get_course_recommendation(user_message, session_id=session_id)
+                logger.info(f"使用聊天課程推薦處理課程問題: {user_message}")
+                recommendation_result = await self._get_course_recommendation_for_chat(session_id, user_message)
                 
                 ai_response = recommendation_result['recommendation']
                 courses = recommendation_result['retrieved_courses']
                 
-                # 注意：推薦和訊息記錄已在 get_course_recommendation 內部完成
+                # 注意：推薦和訊息記錄已在 _get_course_recommendation_for_chat 內部完成
             else:
                 context = self.conversation_manager.get_conversation_context(session_id)
-                ai_response = self._generate_chat_response(user_message, context)
+                ai_response = await self._generate_chat_response(user_message, context, session_id)
                 courses = []
                 # 為非課程相關的回應記錄訊息
                 self.conversation_manager.add_message(
@@ -1008,7 +1848,7 @@ class RAGSystem:
             }
             
         except Exception as e:
-            logger.error(f"處理用戶查詢失敗: {e}")
+            logger.error("處理用戶查詢失敗: %s", e)
             error_response = "抱歉，我遇到了一些問題。請稍後再試。"
             self.conversation_manager.add_message(session_id, "ai_response", error_response)
             return {
@@ -1017,3 +1857,44 @@ class RAGSystem:
                 'courses': [],
                 'is_course_query': False
             }
+
+    def process_user_query_for_existing_message_stream(self, session_id: str, user_message: str) -> Iterator[str]:
+        """處理已存在的用戶消息（串流版）- 逐段產出 AI 回應文字，串流結束後回應已寫入對話歷史"""
+        pieces = []
+        try:
+            is_course_query = self._is_course_related_query(user_message)
+            
+            if not is_course_query and self._is_trivial_message(user_message):
+                logger.info(f"簡短訊息，使用制式回覆: {user_message!r}")
+                self.conversation_manager.add_message(
+                    session_id, "ai_response", _CANNED_ACK_RESPONSE, courses=[]
+                )
+                yield _CANNED_ACK_RESPONSE
+                return
+            
+            if is_course_query:
+                logger.info(f"使用串流推薦處理課程問題: {user_message}")
+                courses = yield from self._stream_course_turn(session_id, user_message, pieces)
+                
+                # 與 get_course_recommendation 相同：一次保存用戶查詢與系統回應
+                self.conversation_manager.batch_add_messages(session_id, [
+                    {"type": "user_query", "content": user_message},
+                    {"type": "system_response", "content": "".join(pieces).strip(), "courses": courses}
+                ])
+            else:
+                context = self.conversation_manager.get_conversation_context(session_id)
+                for piece in self.iter_sync(self._stream_chat_response(user_message, context, session_id)):
+                    pieces.append(piece)
+                    yield piece
+                
+                ai_response = "".join(pieces).strip()
+                self.conversation_manager.add_message(
+                    session_id, "ai_response", ai_response, courses=[]
+                )
+                
+        except Exception as e:
+            logger.error("串流處理用戶查詢失敗: %s", e)
+            error_response = "抱歉，我遇到了一些問題。請稍後再試。"
+            self.conversation_manager.add_message(session_id, "ai_response", error_response)
+            if not pieces:
+                yield error_response
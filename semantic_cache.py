@@ -0,0 +1,126 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Hashable
+import numpy as np
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class SemanticCache:
+    """語意快取 - 以查詢嵌入向量的餘弦相似度比對歷史回應，命中時跳過 LLM 呼叫"""
+
+    def __init__(self, threshold: float = 0.92, max_entries: int = 256, ttl_seconds: float = 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._matrix = None  # 已正規化的嵌入向量 (N, d)
+        self._entries: List[Dict[str, Any]] = []  # 與 _matrix 列對應的 {namespace, payload, ts}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding) -> Optional[np.ndarray]:
+        """轉為單位向量，使內積即為餘弦相似度"""
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if vec.ndim != 1 or norm == 0:
+            return None
+        return vec / norm
+
+    def get(self, embedding, namespace: Hashable = None) -> Optional[Any]:
+        """查詢最相似的快取項目；相似度達門檻且命名空間一致時回傳 payload"""
+        vec = self._normalize(embedding)
+        with self._lock:
+            if vec is None or self._matrix is None or self._matrix.shape[1] != vec.shape[0]:
+                self.misses += 1
+                return None
+
+            sims = self._matrix @ vec
+            now = time.time()
+            for idx in np.argsort(-sims):
+                if sims[idx] < self.threshold:
+                    break
+                entry = self._entries[idx]
+                if entry['namespace'] != namespace or now - entry['ts'] > self.ttl_seconds:
+                    continue
+                self.hits += 1
+                logger.info(f"語意快取命中，相似度: {sims[idx]:.3f}")
+                return entry['payload']
+
+            self.misses += 1
+            return None
+
+    def put(self, embedding, payload: Any, namespace: Hashable = None):
+        """寫入快取項目（超過容量時淘汰最舊的項目）"""
+        vec = self._normalize(embedding)
+        if vec is None:
+            return
+        with self._lock:
+            entry = {'namespace': namespace, 'payload': payload, 'ts': time.time()}
+            if self._matrix is None or self._matrix.shape[1] != vec.shape[0]:
+                self._matrix = vec[np.newaxis, :]
+                self._entries = [entry]
+                return
+
+            self._matrix = np.vstack([self._matrix, vec])
+            self._entries.append(entry)
+            if len(self._entries) > self.max_entries:
+                overflow = len(self._entries) - self.max_entries
+                self._matrix = self._matrix[overflow:]
+                self._entries = self._entries[overflow:]
+
+    def clear(self):
+        """清空快取（例如知識庫重建後）"""
+        with self._lock:
+            self._matrix = None
+            self._entries = []
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取命中率統計，供調整門檻使用"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'threshold': self.threshold
+        }
+
+
+class TTLCache:
+    """精確比對快取 - 以鍵直接查表的 LRU，項目超過存活時間即失效（用於重送同一訊息的情境）"""
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (ts, payload)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """取得未過期的項目，並標記為最近使用"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if time.time() - item[0] > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return item[1]
+
+    def put(self, key: Hashable, payload: Any):
+        """寫入項目（超過容量時淘汰最久未使用的項目）"""
+        with self._lock:
+            self._entries[key] = (time.time(), payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._entries.clear()
@@ -7,7 +7,10 @@
 
 import os
 import sys
+import time
+import hashlib
 import logging
+import orjson
 from config import Config
 from rag_system import RAGSystem
 
@@ -18,6 +21,26 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def compute_knowledge_base_digest(rag_system: RAGSystem) -> str:
+    """計算課程資料列與嵌入模型設定的摘要；無法取得資料時回傳空字串"""
+    rows = rag_system.course_processor.load_courses()
+    if not rows:
+        return ""
+    config = rag_system.config
+    payload = orjson.dumps(
+        [config.EMBEDDING_MODEL, config.EMBEDDING_ONNX_PATH, rows],
+        default=str  # Decimal、datetime 等 SQL 型別
+    )
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+def read_saved_digest(path: str) -> str:
+    """讀取上次建立知識庫時的摘要"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
 def main():
     """主要設置流程"""
     try:
@@ -37,8 +60,22 @@ def main():
         print("🔧 初始化向量數據庫...")
         print("📚 載入課程數據（SQL Server）...")
         
-        # 強制重建知識庫
-        rag_system.initialize_knowledge_base(force_rebuild=True)
+        # 課程資料與模型設定皆未變動且向量庫已存在時略過重建（刪除摘要檔即可強制重建）
+        digest = compute_knowledge_base_digest(rag_system)
+        unchanged = (
+            bool(digest)
+            and digest == read_saved_digest(config.KB_DIGEST_PATH)
+            and os.path.isdir(config.VECTOR_DB_PATH)
+        )
+        if unchanged:
+            print("⏭️  課程資料未變動，沿用既有向量庫")
+            rag_system.initialize_knowledge_base(check_updates=False)
+        else:
+            # 強制重建知識庫
+            rag_system.initialize_knowledge_base(force_rebuild=True)
+            if digest:
+                with open(config.KB_DIGEST_PATH, 'w', encoding='utf-8') as f:
+                    f.write(digest)
         
         # 獲取系統統計
         stats = rag_system.get_system_stats()
@@ -65,6 +102,10 @@ def main():
         # 測試查詢
         print("\n🧪 執行測試查詢...")
         test_query = "減肥燃脂課程"
+        started = time.perf_counter()
+        retrieved = rag_system.retrieve_relevant_courses(test_query)
+        retrieval_ms = (time.perf_counter() - started) * 1000
+        print(f"   • 檢索耗時: {retrieval_ms:.1f} ms（{len(retrieved)} 筆）")
         result = rag_system.get_course_recommendation(test_query)
         
         if result['success']:
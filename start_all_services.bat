@@ -30,9 +30,12 @@ if not exist "streamlit_app.py" (
 echo ✅ 環境檢查通過
 echo.
 
-REM 創建新的命令提示符視窗來啟動API服務
+REM 創建新的命令提示符視窗來啟動API服務（重載模式僅在 DEV_RELOAD=1 時開啟）
 echo 🚀 正在啟動API服務...
-start "AI課程推薦API服務" cmd /k "python -m uvicorn api_server:app --host 0.0.0.0 --port 8000 --reload"
+set "API_ARGS=--workers 1"
+if defined API_WORKERS set "API_ARGS=--workers %API_WORKERS%"
+if "%DEV_RELOAD%"=="1" set "API_ARGS=--reload"
+start "AI課程推薦API服務" cmd /k "python -m uvicorn api_server:app --host 0.0.0.0 --port 8000 %API_ARGS%"
 
 REM 等待2秒
 timeout /t 2 /nobreak >nul
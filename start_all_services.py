@@ -3,13 +3,14 @@
 同時啟動API服務和Streamlit網頁服務的腳本
 """
 
+import asyncio
 import os
 import sys
 import time
 import subprocess
 import signal
+import importlib.util
 import logging
-from pathlib import Path
 import threading
 from typing import List, Optional
 
@@ -17,32 +18,34 @@ from typing import List, Optional
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Windows 上無逾時的 Event.wait() 無法被 Ctrl+C 中斷，需分段等待；POSIX 可直接阻塞
+_EXIT_WAIT_SLICE = 1.0 if os.name == 'nt' else None
+
 class ServiceManager:
     """服務管理器"""
     
     def __init__(self):
         self.processes: List[subprocess.Popen] = []
         self.running = True
+        self._process_exited = threading.Event()  # 任一子進程結束時設定，主迴圈據此醒來
         
     def check_environment(self) -> bool:
         """檢查運行環境"""
         logger.info("正在檢查運行環境...")
         
-        # 檢查必要檔案
+        # 檢查必要檔案（課程資料來自 SQL Server，AI課程.json 僅供更新監看，非必要）
         required_files = [
             "api_server.py",
             "streamlit_app.py",
             "config.py",
             "rag_system.py",
             "vector_store.py",
-            "course_processor.py",
-            "AI課程.json"
+            "course_processor.py"
         ]
         
-        missing_files = []
-        for file_name in required_files:
-            if not Path(file_name).exists():
-                missing_files.append(file_name)
+        # 一次列出目錄內容後比對，不逐一 stat
+        present_files = set(os.listdir("."))
+        missing_files = [file_name for file_name in required_files if file_name not in present_files]
         
         if missing_files:
             logger.error(f"缺少必要檔案: {missing_files}")
@@ -50,13 +53,8 @@ class ServiceManager:
         
         # 檢查依賴包
         required_packages = ["fastapi", "uvicorn", "streamlit", "openai", "chromadb"]
-        missing_packages = []
-        
-        for package in required_packages:
-            try:
-                __import__(package)
-            except ImportError:
-                missing_packages.append(package)
+        # 只查找模組規格確認已安裝，不實際匯入（避免載入 torch、開啟 ChromaDB 等副作用）
+        missing_packages = [package for package in required_packages if importlib.util.find_spec(package) is None]
         
         if missing_packages:
             logger.error(f"缺少依賴包: {missing_packages}")
@@ -71,22 +69,22 @@ class ServiceManager:
         try:
             logger.info("正在啟動API服務...")
             
-            # 使用uvicorn啟動FastAPI
+            # 使用uvicorn啟動FastAPI（重載模式僅在 DEV_RELOAD=1 時開啟）
             cmd = [
                 sys.executable, "-m", "uvicorn",
                 "api_server:app",
                 "--host", "0.0.0.0",
-                "--port", "8000",
-                "--reload"
+                "--port", "8000"
             ]
+            if os.getenv("DEV_RELOAD") == "1":
+                cmd.append("--reload")
+            else:
+                cmd.extend(["--workers", os.getenv("API_WORKERS", "1")])
             
             process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
+                stderr=subprocess.PIPE  # 二進位模式，輸出原樣轉寫，省去解碼與重新編碼
             )
             
             self.processes.append(process)
@@ -116,10 +114,7 @@ class ServiceManager:
             process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
+                stderr=subprocess.PIPE  # 二進位模式，輸出原樣轉寫，省去解碼與重新編碼
             )
             
             self.processes.append(process)
@@ -132,14 +127,18 @@ class ServiceManager:
             return None
     
     def monitor_process(self, process: subprocess.Popen, service_name: str):
-        """監控進程輸出"""
+        """監控進程輸出與結束"""
         def read_output(pipe, prefix):
+            prefix_bytes = f"[{prefix}] ".encode()
+            out = sys.stdout.buffer
             try:
-                for line in iter(pipe.readline, ''):
-                    if line.strip() and self.running:
-                        print(f"[{prefix}] {line.strip()}")
+                for raw in iter(pipe.readline, b''):
                     if not self.running:
                         break
+                    if not raw.isspace():
+                        # 單次寫入整行，避免兩個讀取線程的輸出交錯
+                        out.write(prefix_bytes + raw)
+                        out.flush()
             except:
                 pass
         
@@ -157,33 +156,48 @@ class ServiceManager:
                 args=(process.stderr, f"{service_name}-ERR"),
                 daemon=True
             ).start()
+        
+        # 阻塞等待進程結束後通知主迴圈，取代定期輪詢
+        def wait_exit():
+            process.wait()
+            self._process_exited.set()
+        
+        threading.Thread(target=wait_exit, daemon=True).start()
     
-    def wait_for_services(self):
-        """等待服務啟動"""
+    def wait_for_services(self, timeout: float = 30.0):
+        """等待服務啟動（同時探測兩個服務，就緒即返回）"""
         logger.info("等待服務啟動中...")
-        time.sleep(3)
-        
-        # 檢查API服務
-        try:
-            import requests
-            response = requests.get("http://localhost:8000/health", timeout=5)
-            if response.status_code == 200:
-                logger.info("✅ API服務健康檢查通過")
-            else:
-                logger.warning("⚠️  API服務可能還在初始化中")
-        except Exception as e:
-            logger.warning(f"⚠️  API服務檢查失敗: {e}")
+        asyncio.run(self._probe_services(timeout))
+    
+    async def _probe_services(self, timeout: float):
+        """並行探測 API 與 Streamlit 服務"""
+        import httpx
+        async with httpx.AsyncClient() as client:
+            await asyncio.gather(
+                self._probe_service(client, "API服務", "http://127.0.0.1:8000/health", timeout),
+                self._probe_service(client, "Streamlit服務", "http://127.0.0.1:8501", timeout)
+            )
+    
+    async def _probe_service(self, client, name: str, url: str, timeout: float) -> bool:
+        """以指數退避重試探測服務，直到回應 200 或逾時"""
+        import httpx
+        started = time.monotonic()
+        attempt = 0
+        last_error = None
+        while time.monotonic() - started < timeout:
+            try:
+                response = await client.get(url, timeout=0.5)
+                if response.status_code == 200:
+                    logger.info(f"✅ {name}健康檢查通過")
+                    return True
+                last_error = f"HTTP {response.status_code}"
+            except httpx.HTTPError as e:
+                last_error = e
+            await asyncio.sleep(min(0.05 * 1.5 ** attempt, 0.5))
+            attempt += 1
         
-        # 檢查Streamlit服務
-        try:
-            import requests
-            response = requests.get("http://localhost:8501", timeout=5)
-            if response.status_code == 200:
-                logger.info("✅ Streamlit服務檢查通過")
-            else:
-                logger.warning("⚠️  Streamlit服務可能還在初始化中")
-        except Exception as e:
-            logger.warning(f"⚠️  Streamlit服務檢查失敗: {e}")
+        logger.warning(f"⚠️  {name}在 {timeout:.0f} 秒內未就緒，可能還在初始化中（最後錯誤: {last_error}）")
+        return False
     
     def setup_signal_handlers(self):
         """設定信號處理器"""
@@ -258,8 +272,6 @@ class ServiceManager:
             
             # 保持運行
             while self.running:
-                time.sleep(1)
-                
                 # 檢查進程是否還活著
                 for process in self.processes[:]:  # 創建副本來避免修改問題
                     if process.poll() is not None:  # 進程已結束
@@ -270,6 +282,11 @@ class ServiceManager:
                 if not self.processes:
                     logger.error("所有服務都已停止")
                     break
+                
+                # 直到有子進程結束才醒來再次檢查（不定期輪詢）
+                while not self._process_exited.wait(_EXIT_WAIT_SLICE):
+                    pass
+                self._process_exited.clear()
                     
         except KeyboardInterrupt:
             logger.info("收到中斷信號...")
@@ -62,8 +62,12 @@ cleanup() {
 trap cleanup SIGINT SIGTERM
 
 echo "🚀 正在啟動API服務..."
-# 啟動API服務
-$PYTHON_CMD -m uvicorn api_server:app --host 0.0.0.0 --port 8000 --reload > logs/api.log 2>&1 &
+# 啟動API服務（重載模式僅在 DEV_RELOAD=1 時開啟）
+API_ARGS="--workers ${API_WORKERS:-1}"
+if [ "$DEV_RELOAD" = "1" ]; then
+    API_ARGS="--reload"
+fi
+$PYTHON_CMD -m uvicorn api_server:app --host 0.0.0.0 --port 8000 $API_ARGS > logs/api.log 2>&1 &
 API_PID=$!
 
 echo "✅ API服務已啟動 (PID: $API_PID)"
@@ -5,6 +5,7 @@ AI課程推薦API服務啟動腳本
 
 import os
 import sys
+import importlib.util
 import logging
 import uvicorn
 from pathlib import Path
@@ -25,20 +26,18 @@ def check_environment():
     
     logger.info(f"Python版本: {python_version.major}.{python_version.minor}.{python_version.micro}")
     
-    # 檢查必要檔案
+    # 檢查必要檔案（課程資料來自 SQL Server，AI課程.json 僅供更新監看，非必要）
     required_files = [
         "api_server.py",
         "config.py", 
         "rag_system.py",
         "vector_store.py",
-        "course_processor.py",
-        "AI課程.json"
+        "course_processor.py"
     ]
     
-    missing_files = []
-    for file_name in required_files:
-        if not Path(file_name).exists():
-            missing_files.append(file_name)
+    # 一次列出目錄內容後比對，不逐一 stat
+    present_files = set(os.listdir("."))
+    missing_files = [file_name for file_name in required_files if file_name not in present_files]
     
     if missing_files:
         logger.error(f"缺少必要檔案: {missing_files}")
@@ -62,12 +61,8 @@ def check_dependencies():
         "numpy"
     ]
     
-    missing_packages = []
-    for package in required_packages:
-        try:
-            __import__(package)
-        except ImportError:
-            missing_packages.append(package)
+    # 只查找模組規格確認已安裝，不實際匯入（避免載入 torch、開啟 ChromaDB 等副作用）
+    missing_packages = [package for package in required_packages if importlib.util.find_spec(package) is None]
     
     if missing_packages:
         logger.error(f"缺少依賴包: {missing_packages}")
@@ -126,12 +121,17 @@ def main():
     print("="*60)
     
     try:
+        # 重載模式會多開監看進程並重複匯入模型，僅在開發時以 DEV_RELOAD=1 開啟；
+        # uvicorn[standard] 已安裝時自動採用 uvloop/httptools
+        reload = os.getenv("DEV_RELOAD") == "1"
+        
         # 啟動API服務
         uvicorn.run(
             "api_server:app",
             host="0.0.0.0",
             port=8000,
-            reload=True,
+            reload=reload,
+            workers=None if reload else int(os.getenv("API_WORKERS", "1")),
             log_level="info",
             access_log=True
         )
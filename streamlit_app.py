@@ -1,11 +1,12 @@
 import streamlit as st
 import pandas as pd
 from typing import Dict, Any
+from functools import lru_cache
+import html
 import logging
 import os
+import re
 from config import Config
-from openai import OpenAI
-from rag_system import RAGSystem
 
 # 設定頁面配置
 st.set_page_config(
@@ -19,51 +20,45 @@ st.set_page_config(
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# 自定義CSS
-st.markdown("""
-<style>
-    .main-header {
-        font-size: 2.5rem;
-        font-weight: bold;
-        color: #1f77b4;
-        text-align: center;
-        margin-bottom: 2rem;
-    }
-    .course-card {
-        background-color: #f0f2f6;
-        padding: 1rem;
-        border-radius: 10px;
-        margin-bottom: 1rem;
-        border-left: 4px solid #1f77b4;
-    }
-    .similarity-score {
-        background-color: #e8f4f8;
-        padding: 0.2rem 0.5rem;
-        border-radius: 5px;
-        font-size: 0.8rem;
-        font-weight: bold;
-    }
-    .category-tag {
-        background-color: #ff6b6b;
-        color: white;
-        padding: 0.2rem 0.8rem;
-        border-radius: 15px;
-        font-size: 0.8rem;
-        margin-right: 0.5rem;
-    }
-</style>
-""", unsafe_allow_html=True)
+# 瀏覽課程頁面每頁顯示的課程數
+COURSES_PER_PAGE = 20
+
+# 課程卡片「詳細資訊」依序列出的 (metadata 鍵, 顯示名稱)
+COURSE_DETAIL_FIELDS = tuple(
+    (f"meta_{name}", name) for name in ('授課教師', '年齡限制', '上課時間', '課程費用', '體驗費用')
+)
+
+@st.cache_resource
+def load_app_css() -> str:
+    """讀取自定義樣式表並壓縮空白（每個進程只讀檔一次，縮小每次重新執行送出的內容）"""
+    css_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app_style.css")
+    try:
+        with open(css_path, encoding="utf-8") as f:
+            css = re.sub(r"/\*.*?\*/", "", f.read(), flags=re.S)
+    except OSError as e:
+        logger.error(f"讀取樣式表失敗: {e}")
+        return ""
+    return f"<style>{' '.join(css.split())}</style>"
+
+# 自定義CSS（每次重新執行都需輸出，否則 Streamlit 會移除此元素）
+app_css = load_app_css()
+if app_css:
+    st.markdown(app_css, unsafe_allow_html=True)
 
 @st.cache_resource
 def initialize_rag_system():
     """初始化RAG系統（使用快取避免重複初始化）"""
     try:
+        # 延遲匯入：rag_system 會載入 chromadb、sentence-transformers 等大型套件，
+        # 移至此處可讓頁面標題與樣式先顯示，匯入在初始化期間進行（每個進程僅一次）
+        from rag_system import RAGSystem
         from auto_file_monitor import get_file_monitor
         
-        # 初始化檔案監控器
+        # 初始化檔案監控器，並在背景定期檢查資料檔案（每個進程只啟動一次）
         monitor = get_file_monitor()
         if monitor.last_mtime is None:
             monitor.initialize()
+        monitor.start_monitoring()
         
         config = Config()
         rag_system = RAGSystem(config)
@@ -89,42 +84,276 @@ def initialize_rag_system():
         st.error(f"初始化RAG系統失敗: {e}")
         return None
 
-def display_course_card(course: Dict[str, Any], show_similarity: bool = True):
-    """顯示課程卡片"""
-    with st.container():
-        st.markdown('<div class="course-card">', unsafe_allow_html=True)
-        
-        # 課程標題和類別
-        col1, col2 = st.columns([3, 1])
+@st.cache_data(show_spinner=False)
+def load_courses_by_category(_rag_system, data_version) -> Dict[str, list]:
+    """一次載入全部課程並依類別分組；資料更新後 data_version 改變即重新載入"""
+    courses = _rag_system.get_all_courses()
+    if not courses:
+        return {}
+    courses_df = pd.DataFrame(courses)
+    return {
+        category: group.to_dict('records')
+        for category, group in courses_df.groupby('category', sort=False)
+    }
+
+@st.cache_data(show_spinner=False, max_entries=64)  # 類別 × 顯示數量的組合有限，限制快取項目數
+def load_category_courses(_rag_system, category: str, limit, data_version):
+    """取得類別課程並預先建立小寫搜尋索引（課程名稱與介紹）；資料更新後 data_version 改變即重新載入"""
+    courses = load_courses_by_category(_rag_system, data_version).get(category)
+    if courses is None:
+        # 分組中沒有此類別時改以原查詢取得（知識庫異常時會自動重建）
+        courses = _rag_system.get_courses_by_category(category, limit=limit)
+    courses = courses[:limit]
+    search_index = pd.Series(
+        [f"{course['title']}\n{course['description']}".lower() for course in courses],
+        dtype=object
+    )
+    return courses, search_index
+
+def message_content_html(content: str) -> str:
+    """轉義消息內容並以 <br> 保留換行（內容中的 HTML 或空行不會破壞氣泡版面）"""
+    return html.escape(content).replace("\n", "<br>")
+
+def user_bubble_html(content: str, time_str: str = '') -> str:
+    """用戶消息的聊天氣泡 HTML（單行，可與其他氣泡串接後一次輸出）"""
+    return (
+        '<div style="text-align: right; margin-bottom: 10px;">'
+        '<div style="background-color: #DCF8C6; padding: 10px; border-radius: 10px; display: inline-block; max-width: 70%; text-align: left;">'
+        f'{message_content_html(content)}</div>'
+        f'<div style="font-size: 0.8em; color: #666; margin-top: 5px;">您 {time_str}</div>'
+        '</div>'
+    )
+
+def ai_bubble_html(content: str, time_str: str = '') -> str:
+    """AI回應的聊天氣泡 HTML（單行，可與其他氣泡串接後一次輸出）"""
+    return (
+        '<div style="text-align: left; margin-bottom: 10px;">'
+        '<div style="background-color: #F1F1F1; padding: 10px; border-radius: 10px; display: inline-block; max-width: 70%;">'
+        f'{message_content_html(content)}</div>'
+        f'<div style="font-size: 0.8em; color: #666; margin-top: 5px;">AI助手 {time_str}</div>'
+        '</div>'
+    )
+
+@lru_cache(maxsize=4096)
+def history_bubble_html(is_user: bool, content: str, time_str: str) -> str:
+    """歷史消息的氣泡 HTML（消息存入後不再變動，依內容快取；重新執行時只需組出新消息）"""
+    return user_bubble_html(content, time_str) if is_user else ai_bubble_html(content, time_str)
+
+def render_history_html(messages) -> str:
+    """將一段聊天消息組成單一 HTML 字串"""
+    time_strs = [
+        timestamp.split('T')[1][:5] if 'T' in timestamp else ''
+        for timestamp in (message.get('timestamp', '') for message in messages)
+    ]
+    bubbles = []
+    for message, time_str in zip(messages, time_strs):
+        if message['type'] in ['user_message', 'user_query']:
+            bubbles.append(history_bubble_html(True, message['content'], time_str))
+        elif message['type'] in ['ai_response', 'system_response']:
+            bubbles.append(history_bubble_html(False, message['content'], time_str))
+            if message.get('courses'):
+                bubbles.append(recommended_courses_html(message['courses']))
+    return "\n".join(bubbles)
+
+def display_chat_history(messages):
+    """顯示聊天歷史：氣泡與推薦課程卡片合併為一次 st.markdown 輸出"""
+    st.markdown(render_history_html(messages), unsafe_allow_html=True)
+
+def course_card_html(course: Dict[str, Any], show_similarity: bool = True) -> str:
+    """課程卡片 HTML：名稱、類別、相似度、介紹與詳細資訊組成單一區塊（使用者資料皆已轉義）"""
+    parts = [
+        '<div class="course-card">',
+        '<div class="course-card-header">',
+        f'<h3>{html.escape(course["title"])}</h3>',
+        f'<span class="category-tag">{html.escape(course["category"])}</span>',
+        '</div>',
+    ]
+
+    # 相似度分數
+    if show_similarity and 'similarity_score' in course:
+        parts.append(f'<span class="similarity-score">相似度: {course["similarity_score"]:.1%}</span>')
+
+    # 課程描述
+    parts.append(f'<p>{message_content_html(course["description"])}</p>')
+
+    # 額外資訊
+    metadata = course.get('metadata', {})
+    details = "".join(
+        f'<li><b>{label}</b>: {html.escape(str(value))}</li>'
+        for key, label in COURSE_DETAIL_FIELDS
+        if (value := metadata.get(key))
+    )
+    if details:
+        parts.append(f'<b>詳細資訊:</b><ul>{details}</ul>')
+
+    parts.append('</div>')
+    return "".join(parts)
+
+def course_item_html(summary: str, course: Dict[str, Any], show_similarity: bool = True) -> str:
+    """以原生 <details> 摺疊的課程卡片（取代 st.expander，可與其他卡片合併為一次輸出）"""
+    return (
+        f'<details class="course-item"><summary>{html.escape(summary)}</summary>'
+        f'{course_card_html(course, show_similarity)}</details>'
+    )
+
+def recommended_courses_html(courses) -> str:
+    """聊天室中的推薦課程區塊 HTML（最多顯示3個）"""
+    items = "".join(
+        course_item_html(f"📚 {course['title']} ({course['category']})", course, show_similarity=False)
+        for course in courses[:3]
+    )
+    return f'<div><b>推薦課程：</b>{items}</div>'
+
+def stream_ai_reply(rag_system, session_id: str, user_input: str):
+    """逐段串流顯示AI回應（首段文字到達即呈現），完成後補上時間與推薦課程，不需重新載入頁面"""
+    placeholder = st.empty()
+    placeholder.info("🤖 AI正在思考回應中...")
+    try:
+        # 使用聊天功能（但不添加用戶消息，因為已經添加了）；串流結束時回應已寫入對話歷史
+        pieces = []
+        for piece in rag_system.process_user_query_for_existing_message_stream(session_id, user_input):
+            pieces.append(piece)
+            placeholder.markdown(ai_bubble_html("".join(pieces)), unsafe_allow_html=True)
+    except Exception as e:
+        st.error(f"AI回應時發生錯誤: {e}")
+        return
+    
+    history = rag_system.get_conversation_history(session_id)
+    messages = history.get('messages') if history else None
+    if messages and messages[-1]['type'] in ['ai_response', 'system_response']:
+        reply = messages[-1]
+        timestamp = reply.get('timestamp', '')
+        time_str = timestamp.split('T')[1][:5] if 'T' in timestamp else ''
+        reply_html = ai_bubble_html(reply['content'], time_str)
+        if reply.get('courses'):
+            reply_html += recommended_courses_html(reply['courses'])
+        # 回應氣泡與推薦課程卡片在同一元素中一次輸出
+        placeholder.markdown(reply_html, unsafe_allow_html=True)
+
+# Streamlit 1.37+ 為 st.fragment（1.33–1.36 為 st.experimental_fragment）；舊版退回一般函式
+_fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda func: func)
+
+@_fragment
+def chat_panel(rag_system, api_key: str):
+    """AI聊天室頁面（獨立片段：聊天互動只重新執行此區塊，不重跑側邊欄與其他分頁）"""
+    st.header("💬 AI課程推薦聊天室")
+    st.write("與AI助手聊天，詢問任何關於課程的問題！AI會記住我們的對話內容。")
+
+    # 初始化會話狀態
+    if 'conversation_session_id' not in st.session_state:
+        st.session_state.conversation_session_id = rag_system.create_conversation_session()
+
+    if 'chat_input' not in st.session_state:
+        st.session_state.chat_input = ""
+
+    # 聊天界面
+    chat_container = st.container()
+
+    # 顯示聊天歷史
+    with chat_container:
+        # 獲取對話歷史（本次執行中沿用）
+        conversation_history = rag_system.get_conversation_history(st.session_state.conversation_session_id)
+
+        if conversation_history and conversation_history.get('messages'):
+            messages = conversation_history['messages']
+
+            # 顯示歷史消息
+            display_chat_history(messages)
+        else:
+            # 歡迎消息
+            st.markdown(f"""
+            <div style="text-align: left; margin-bottom: 20px;">
+                <div style="background-color: #F1F1F1; padding: 15px; border-radius: 10px; display: inline-block; max-width: 70%;">
+                    您好！我是您的AI課程推薦助手 😊<br><br>
+                    您可以：<br>
+                    • 詢問任何課程相關問題<br>
+                    • 直接說出您的需求，我會推薦適合的課程<br><br>
+                    試著問問我：「有什麼適合減肥的課程？」
+                </div>
+                <div style="font-size: 0.8em; color: #666; margin-top: 5px;">
+                    AI助手
+                </div>
+            </div>
+            """, unsafe_allow_html=True)
+
+    # 檢查是否需要處理AI回應（在顯示聊天歷史之後）
+    # 消息依序附加，AI回應必定排在其回覆的用戶消息之後：最後一條是用戶消息即表示尚未回應
+    messages = conversation_history.get('messages') if conversation_history else None
+    needs_ai_response = bool(messages) and messages[-1]['type'] == 'user_message'
+
+    # 上一次回應被中斷（例如串流途中頁面重新載入）時補上AI回應
+    if needs_ai_response and api_key:
+        with chat_container:
+            stream_ai_reply(rag_system, st.session_state.conversation_session_id, messages[-1]['content'])
+
+    # 快速範例
+    st.write("**💡 快速開始：**")
+    col1, col2, col3, col4 = st.columns(4)
+
+    quick_examples = {
+        "👋 打招呼": "你好！",
+        "🔥 減肥課程": "有什麼減肥課程？",
+        "🧘 瑜珈課程": "推薦瑜珈課程",
+        "🏊 游泳課程": "我想學游泳"
+    }
+
+    cols = [col1, col2, col3, col4]
+    for i, (button_text, example_text) in enumerate(quick_examples.items()):
+        with cols[i]:
+            if st.button(button_text, key=f"quick_{i}"):
+                st.session_state.chat_input = example_text
+                st.rerun()
+
+    # 聊天輸入區域
+    st.divider()
+
+    # 使用表單來處理輸入
+    with st.form("chat_form", clear_on_submit=True):
+        col1, col2 = st.columns([4, 1])
+
         with col1:
-            st.markdown(f"### {course['title']}")
+            user_input = st.text_input(
+                "輸入消息",
+                value=st.session_state.chat_input,
+                placeholder="輸入您的消息...",
+                key="current_input",
+                label_visibility="collapsed"
+            )
+
         with col2:
-            st.markdown(f'<span class="category-tag">{course["category"]}</span>', 
-                       unsafe_allow_html=True)
-        
-        # 相似度分數
-        if show_similarity and 'similarity_score' in course:
-            st.markdown(f'<span class="similarity-score">相似度: {course["similarity_score"]:.1%}</span>', 
-                       unsafe_allow_html=True)
-        
-        # 課程描述
-        st.write(course['description'])
-        
-        # 額外資訊
-        metadata = course.get('metadata', {})
-        additional_info = []
-        
-        for key in ['meta_授課教師', 'meta_年齡限制', 'meta_上課時間', 'meta_課程費用', 'meta_體驗費用']:
-            if key in metadata and metadata[key]:
-                field_name = key.replace('meta_', '')
-                additional_info.append(f"**{field_name}**: {metadata[key]}")
-        
-        if additional_info:
-            st.markdown("**詳細資訊:**")
-            for info in additional_info:
-                st.markdown(f"- {info}")
-        
-        st.markdown('</div>', unsafe_allow_html=True)
+            send_button = st.form_submit_button("發送 📤", type="primary")
+
+        # 處理發送
+        if send_button and user_input.strip():
+            if not api_key:
+                st.error("請先在側邊欄輸入OpenAI API金鑰！")
+            else:
+                # 清空輸入
+                st.session_state.chat_input = ""
+
+                # 立即將用戶消息添加到對話歷史
+                from datetime import datetime
+                rag_system.conversation_manager.add_message(
+                    st.session_state.conversation_session_id, 
+                    "user_message", 
+                    user_input
+                )
+
+                # 在同一次執行中直接顯示用戶消息並串流AI回應，不重新載入頁面
+                with chat_container:
+                    st.markdown(user_bubble_html(user_input, datetime.now().strftime('%H:%M')),
+                                unsafe_allow_html=True)
+                    stream_ai_reply(rag_system, st.session_state.conversation_session_id, user_input)
+
+    # 清空聊天記錄
+    st.divider()
+    col1, col2 = st.columns([3, 1])
+    with col2:
+        if st.button("🗑️ 清空聊天", type="secondary"):
+            rag_system.clear_conversation(st.session_state.conversation_session_id)
+            st.session_state.conversation_session_id = rag_system.create_conversation_session()
+            st.success("聊天記錄已清空！")
+            st.rerun()
 
 def main():
     """主應用程式"""
@@ -140,19 +369,19 @@ def main():
         st.error("無法初始化RAG系統，請檢查配置。")
         st.stop()
     
-    # 啟動時自動檢查檔案更新（只在第一次載入時執行）
-    if 'auto_check_done' not in st.session_state:
-        from auto_file_monitor import check_and_update_data
+    # 背景監控偵測到檔案更新時只同步有變動的課程向量（保留已載入的模型與連線，不重建整個系統）
+    from auto_file_monitor import get_file_monitor
+    monitor = get_file_monitor()
+    file_changed = monitor.consume_change() if monitor.is_monitoring else monitor.check_file_changed()
+    if file_changed:
         try:
-            update_result = check_and_update_data()
-            if update_result['updated']:
-                st.info("🔄 檢測到資料檔案更新，正在重新載入...")
-                st.cache_resource.clear()
-                st.rerun()
+            with st.spinner("🔄 檢測到資料檔案更新，正在更新知識庫..."):
+                rag_system.reload_index()
+            load_courses_by_category.clear()
+            load_category_courses.clear()
+            st.rerun()
         except Exception as e:
-            st.warning(f"自動更新檢查失敗: {e}")
-        finally:
-            st.session_state['auto_check_done'] = True
+            st.warning(f"自動更新失敗: {e}")
     
 
     
@@ -177,10 +406,9 @@ def main():
         )
         if api_key:
             st.session_state['api_key'] = api_key
-            rag_system.config.OPENAI_API_KEY = api_key
             # 以新 Key 重新建立 OpenAI 客戶端（v1 寫法）
             try:
-                rag_system.openai_client = OpenAI(api_key=api_key)
+                rag_system.update_api_key(api_key)
             except Exception as _:
                 pass
         
@@ -196,231 +424,8 @@ def main():
     tab1, tab2, tab3, tab4 = st.tabs(["💬 AI聊天室", "📜 對話記錄", "📚 瀏覽課程", "ℹ️ 關於系統"])
     
     with tab1:
-        st.header("💬 AI課程推薦聊天室")
-        st.write("與AI助手聊天，詢問任何關於課程的問題！AI會記住我們的對話內容。")
-        
-        # 初始化會話狀態
-        if 'conversation_session_id' not in st.session_state:
-            st.session_state.conversation_session_id = rag_system.create_conversation_session()
-        
-        if 'chat_input' not in st.session_state:
-            st.session_state.chat_input = ""
-        
-        if 'processing_ai_response' not in st.session_state:
-            st.session_state.processing_ai_response = False
-            
-        if 'just_sent_message' not in st.session_state:
-            st.session_state.just_sent_message = False
-        
-        # 聊天界面
-        chat_container = st.container()
-        
-        # 顯示聊天歷史
-        with chat_container:
-            # 獲取對話歷史
-            conversation_history = rag_system.get_conversation_history(st.session_state.conversation_session_id)
-            
-            if conversation_history and conversation_history.get('messages'):
-                messages = conversation_history['messages']
-                
-                # 顯示歷史消息
-                for message in messages:
-                    timestamp = message.get('timestamp', '')
-                    time_str = timestamp.split('T')[1][:5] if 'T' in timestamp else ''
-                    
-                    if message['type'] in ['user_message', 'user_query']:
-                        # 用戶消息
-                        st.markdown(f"""
-                        <div style="text-align: right; margin-bottom: 10px;">
-                            <div style="background-color: #DCF8C6; padding: 10px; border-radius: 10px; display: inline-block; max-width: 70%; text-align: left;">
-                                {message['content']}
-                            </div>
-                            <div style="font-size: 0.8em; color: #666; margin-top: 5px;">
-                                您 {time_str}
-                            </div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                    elif message['type'] in ['ai_response', 'system_response']:
-                        # AI回應
-                        st.markdown(f"""
-                        <div style="text-align: left; margin-bottom: 10px;">
-                            <div style="background-color: #F1F1F1; padding: 10px; border-radius: 10px; display: inline-block; max-width: 70%;">
-                                {message['content']}
-                            </div>
-                            <div style="font-size: 0.8em; color: #666; margin-top: 5px;">
-                                AI助手 {time_str}
-                            </div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                        # 如果有推薦課程，顯示課程卡片
-                        if message.get('courses'):
-                            st.write("**推薦課程：**")
-                            for course in message['courses'][:3]:  # 最多顯示3個
-                                with st.expander(f"📚 {course['title']} ({course['category']})"):
-                                    display_course_card(course, show_similarity=False)
-            else:
-                # 歡迎消息
-                st.markdown(f"""
-                <div style="text-align: left; margin-bottom: 20px;">
-                    <div style="background-color: #F1F1F1; padding: 15px; border-radius: 10px; display: inline-block; max-width: 70%;">
-                        您好！我是您的AI課程推薦助手 😊<br><br>
-                        您可以：<br>
-                        • 詢問任何課程相關問題<br>
-                        • 直接說出您的需求，我會推薦適合的課程<br><br>
-                        試著問問我：「有什麼適合減肥的課程？」
-                    </div>
-                    <div style="font-size: 0.8em; color: #666; margin-top: 5px;">
-                        AI助手
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
-        
-        # 檢查是否需要處理AI回應（在顯示聊天歷史之後）
-        conversation_history = rag_system.get_conversation_history(st.session_state.conversation_session_id)
-        needs_ai_response = False
-        
-        if conversation_history and conversation_history.get('messages'):
-            messages = conversation_history['messages']
-            # 檢查最後一條消息是否是用戶消息且沒有AI回應
-            if messages and messages[-1]['type'] == 'user_message':
-                # 檢查是否有對應的AI回應
-                last_user_msg = messages[-1]
-                has_ai_response = False
-                
-                # 檢查是否已經有AI回應這條用戶消息
-                for i in range(len(messages) - 1, -1, -1):
-                    if messages[i]['type'] in ['ai_response', 'system_response']:
-                        # 找到最近的AI回應，檢查時間戳
-                        ai_timestamp = messages[i].get('timestamp', '')
-                        user_timestamp = last_user_msg.get('timestamp', '')
-                        if ai_timestamp >= user_timestamp:
-                            has_ai_response = True
-                        break
-                
-                if not has_ai_response:
-                    needs_ai_response = True
-        
-        # 如果需要AI回應，根據狀態決定是否處理
-        if needs_ai_response and api_key:
-            if st.session_state.just_sent_message:
-                # 剛發送消息，先讓用戶看到消息，然後設置觸發AI回應
-                st.session_state.just_sent_message = False
-                st.session_state.processing_ai_response = True
-                # 顯示一個提示並在短時間後自動觸發AI回應
-                st.info("🤖 AI正在準備回應...")
-                import time
-                time.sleep(0.1)  # 短暫延遲讓用戶看到自己的消息
-                st.rerun()
-            elif not st.session_state.processing_ai_response:
-                # 開始處理AI回應
-                st.session_state.processing_ai_response = True
-                st.rerun()
-            else:
-                # 正在處理AI回應
-                st.info("🤖 AI正在思考回應中...")
-                
-                # 自動處理AI回應
-                try:
-                    last_user_input = messages[-1]['content']
-                    
-                    # 使用聊天功能（但不添加用戶消息，因為已經添加了）
-                    with st.spinner("正在生成回應..."):
-                        chat_result = rag_system.process_user_query_for_existing_message(
-                            st.session_state.conversation_session_id, 
-                            last_user_input
-                        )
-                        
-                        if chat_result['success']:
-                            # 重置狀態並重新載入頁面顯示AI回應
-                            st.session_state.processing_ai_response = False
-                            st.rerun()
-                        else:
-                            st.error("AI回應時出現錯誤，請重試。")
-                            st.session_state.processing_ai_response = False
-                            
-                except Exception as e:
-                    st.error(f"AI回應時發生錯誤: {e}")
-                    st.session_state.processing_ai_response = False
-        
-        # 快速範例
-        st.write("**💡 快速開始：**")
-        col1, col2, col3, col4 = st.columns(4)
-        
-        quick_examples = {
-            "👋 打招呼": "你好！",
-            "🔥 減肥課程": "有什麼減肥課程？",
-            "🧘 瑜珈課程": "推薦瑜珈課程",
-            "🏊 游泳課程": "我想學游泳"
-        }
-        
-        cols = [col1, col2, col3, col4]
-        for i, (button_text, example_text) in enumerate(quick_examples.items()):
-            with cols[i]:
-                if st.button(button_text, key=f"quick_{i}"):
-                    st.session_state.chat_input = example_text
-                    st.rerun()
-        
-        # 聊天輸入區域
-        st.divider()
-        
-        # 使用表單來處理輸入
-        with st.form("chat_form", clear_on_submit=True):
-            col1, col2 = st.columns([4, 1])
-            
-            with col1:
-                user_input = st.text_input(
-                    "輸入消息",
-                    value=st.session_state.chat_input,
-                    placeholder="輸入您的消息...",
-                    key="current_input",
-                    label_visibility="collapsed"
-                )
-            
-            with col2:
-                send_button = st.form_submit_button("發送 📤", type="primary")
-            
-            # 處理發送
-            if send_button and user_input.strip():
-                if not api_key:
-                    st.error("請先在側邊欄輸入OpenAI API金鑰！")
-                else:
-                    # 清空輸入
-                    st.session_state.chat_input = ""
-                    
-                    # 先添加用戶消息到會話中
-                    from datetime import datetime
-                    user_message = {
-                        'type': 'user_message',
-                        'content': user_input,
-                        'timestamp': datetime.now().isoformat()
-                    }
-                    
-                    # 立即將用戶消息添加到對話歷史
-                    rag_system.conversation_manager.add_message(
-                        st.session_state.conversation_session_id, 
-                        "user_message", 
-                        user_input
-                    )
-                    
-                    # 設置剛發送消息的標記
-                    st.session_state.just_sent_message = True
-                    st.session_state.processing_ai_response = False
-                    
-                    # 重新載入頁面顯示用戶消息
-                    st.rerun()
-        
-        # 清空聊天記錄
-        st.divider()
-        col1, col2 = st.columns([3, 1])
-        with col2:
-            if st.button("🗑️ 清空聊天", type="secondary"):
-                rag_system.clear_conversation(st.session_state.conversation_session_id)
-                st.session_state.conversation_session_id = rag_system.create_conversation_session()
-                st.success("聊天記錄已清空！")
-                st.rerun()
-    
+        chat_panel(rag_system, api_key)
+
     with tab2:
         st.header("對話記錄")
         
@@ -524,7 +529,13 @@ def main():
         
         if selected_category and selected_category != "全部":
             with st.spinner("載入課程中..."):
-                courses = rag_system.get_courses_by_category(selected_category, limit=max_courses)
+                courses, search_index = load_category_courses(
+                    rag_system, selected_category, max_courses, rag_system.last_data_file_mtime
+                )
+                if not courses:
+                    # 不保留空結果，下次瀏覽時重新查詢
+                    load_courses_by_category.clear()
+                    load_category_courses.clear()
                 
                 if courses:
                     if show_all:
@@ -536,11 +547,9 @@ def main():
                     if len(courses) > 5:
                         search_term = st.text_input("🔍 在此類別中搜尋課程", placeholder="輸入課程名稱或關鍵字...")
                         if search_term:
-                            filtered_courses = [
-                                course for course in courses 
-                                if search_term.lower() in course['title'].lower() or 
-                                   search_term.lower() in course['description'].lower()
-                            ]
+                            # 以預先建立的索引一次比對（搜尋詞為單行，不會跨越名稱與介紹的分隔）
+                            matches = search_index.str.contains(search_term.lower(), regex=False)
+                            filtered_courses = [courses[i] for i in matches[matches].index]
                             if filtered_courses:
                                 st.write(f"搜尋到 {len(filtered_courses)} 個包含「{search_term}」的課程：")
                                 courses = filtered_courses
@@ -548,10 +557,21 @@ def main():
                                 st.warning(f"沒有找到包含「{search_term}」的課程")
                                 courses = []
                     
-                    # 顯示課程
-                    for i, course in enumerate(courses, 1):
-                        with st.expander(f"{i}. {course['title']} ({course['category']})", expanded=False):
-                            display_course_card(course, show_similarity=False)
+                    # 分頁顯示課程（每次執行只建立一頁的元件）
+                    page_count = max(1, -(-len(courses) // COURSES_PER_PAGE))
+                    page = 1
+                    if page_count > 1:
+                        # 以類別與結果數作為元件 key，切換類別或搜尋後自動回到第一頁
+                        page = st.number_input(
+                            f"頁數（共 {page_count} 頁）", min_value=1, max_value=page_count, value=1,
+                            key=f"course_page_{selected_category}_{len(courses)}"
+                        )
+                    start = (page - 1) * COURSES_PER_PAGE
+                    # 整頁課程卡片組成單一 HTML 區塊一次輸出
+                    st.markdown("".join(
+                        course_item_html(f"{i}. {course['title']} ({course['category']})", course, show_similarity=False)
+                        for i, course in enumerate(courses[start:start + COURSES_PER_PAGE], start + 1)
+                    ), unsafe_allow_html=True)
                 else:
                     st.info("此類別暫無課程資料")
         else:
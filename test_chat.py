@@ -7,7 +7,7 @@
 import sys
 import os
 from config import Config
-from rag_system import RAGSystem
+from rag_system import RAGSystem, _BannedTermStreamFilter, _strip_banned_terms
 
 def test_chat_functionality():
     """測試聊天功能"""
@@ -89,6 +89,67 @@ def test_chat_functionality():
         import traceback
         traceback.print_exc()
 
+def test_chat_cache_paraphrase():
+    """測試語意快取：相同對話脈絡下，換句話說的追問沿用先前的聊天回應"""
+    print("=== 測試聊天語意快取 ===")
+    
+    config = Config()
+    if not config.OPENAI_API_KEY:
+        print("警告: 未設定OpenAI API金鑰，跳過聊天語意快取測試")
+        return
+    
+    rag_system = RAGSystem(config)
+    rag_system.initialize_knowledge_base(force_rebuild=False)
+    
+    # 兩個會話先寫入相同的對話歷史
+    opening = [
+        {"type": "user_message", "content": "你好！"},
+        {"type": "ai_response", "content": "你好！我是AI課程推薦助手。"}
+    ]
+    session_ids = []
+    for user_id in ("chat_cache_user_a", "chat_cache_user_b"):
+        session_id = rag_system.create_conversation_session(user_id)
+        rag_system.conversation_manager.batch_add_messages(session_id, opening)
+        session_ids.append(session_id)
+    
+    try:
+        first = rag_system.chat_with_user(session_ids[0], "你能做什麼？")
+        hits_before = rag_system.chat_cache.hits
+        second = rag_system.chat_with_user(session_ids[1], "你能做些什麼？")
+        
+        assert not first['is_course_query'] and not second['is_course_query']
+        assert rag_system.chat_cache.hits == hits_before + 1, "換句話說的追問未命中聊天語意快取"
+        assert second['ai_response'] == first['ai_response']
+        print("聊天語意快取測試通過！")
+    finally:
+        for session_id in session_ids:
+            rag_system.clear_conversation(session_id)
+
+def test_banned_terms_split_across_chunks():
+    """測試串流禁詞過濾：禁詞被切在不同片段時，結果與整段清理一致（不需 API 金鑰）"""
+    print("=== 測試串流禁詞過濾 ===")
+    
+    texts = [
+        "我們有線上課程，也有實體課程喔！",
+        "推薦流瑜伽與阿斯坦加，還有線上、線下與遠距選擇。",
+        "線上課",
+        "線",
+    ]
+    for text in texts:
+        expected = _strip_banned_terms(text)
+        # 逐一嘗試所有兩段切法與逐字切法
+        splits = [[text[:i], text[i:]] for i in range(len(text) + 1)] + [list(text)]
+        for chunks in splits:
+            banned_filter = _BannedTermStreamFilter()
+            result = "".join(banned_filter.feed(chunk) for chunk in chunks) + banned_filter.flush()
+            assert result == expected, f"{chunks!r}: {result!r} != {expected!r}"
+    
+    # 「線上」在前一片段結尾、「課程」在下一片段開頭時，應移除較長的「線上課」
+    banned_filter = _BannedTermStreamFilter()
+    result = banned_filter.feed("我們有線上") + banned_filter.feed("課程") + banned_filter.flush()
+    assert result == "我們有程", result
+    print("串流禁詞過濾測試通過！")
+
 def interactive_chat_test():
     """互動式聊天測試"""
     print("\n=== 互動式聊天測試 ===")
@@ -153,7 +214,9 @@ def main():
     print("=" * 50)
     
     # 自動測試
+    test_banned_terms_split_across_chunks()
     test_chat_functionality()
+    test_chat_cache_paraphrase()
     
     # 詢問是否進行互動測試
     while True:
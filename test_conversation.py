@@ -6,6 +6,8 @@
 
 import sys
 import os
+import tempfile
+import threading
 from config import Config
 from conversation_manager import ConversationManager
 from rag_system import RAGSystem
@@ -106,6 +108,43 @@ def test_rag_system_with_conversation():
         import traceback
         traceback.print_exc()
 
+def test_concurrent_add_messages():
+    """測試多執行緒同時添加消息後，保存的文件與記憶體中的對話一致"""
+    print("\n=== 測試並行添加消息 ===")
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cm = ConversationManager()
+        cm.session_file = os.path.join(tmp_dir, "conversations.json")
+        cm.conversations = {}
+        session_id = cm.create_session("concurrent_user")
+        
+        def worker(worker_id):
+            for i in range(50):
+                cm.add_message(session_id, "user_message", f"執行緒{worker_id} 消息{i}")
+        
+        # 縮短執行緒切換間隔，讓保存過程更容易被其他執行緒打斷
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+        
+        # 最後再加一條消息，確認片段快取沒有錯位
+        cm.add_message(session_id, "ai_response", "最後一條")
+        
+        reloaded = ConversationManager()
+        reloaded.session_file = cm.session_file
+        reloaded.load_conversations()
+        
+        assert len(cm.conversations[session_id]["messages"]) == 8 * 50 + 1
+        assert reloaded.conversations == cm.conversations, "保存的對話與記憶體中的對話不一致"
+    print("並行添加消息測試通過！")
+
 def main():
     """主測試函數"""
     print("開始測試新的對話功能...\n")
@@ -113,6 +152,9 @@ def main():
     # 測試對話管理器
     test_conversation_manager()
     
+    # 測試並行保存對話
+    test_concurrent_add_messages()
+    
     # 測試RAG系統對話功能
     test_rag_system_with_conversation()
     
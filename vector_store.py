@@ -2,15 +2,35 @@ import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
 import numpy as np
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+import functools
 import logging
 import os
+import threading
+import time
 from config import Config
+from semantic_cache import TTLCache
+from onnx_embedder import OnnxEmbedder
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@functools.lru_cache(maxsize=None)
+def load_embedding_model(model_name: str, onnx_path: str = ""):
+    """載入嵌入模型（同一行程內共用）；在 fork 前呼叫可讓子進程以寫入時複製共用權重。
+
+    指定 onnx_path 時改用 ONNX Runtime 推論，無法載入則退回 sentence-transformers。
+    """
+    logger.info("載入嵌入模型...")
+    if onnx_path:
+        try:
+            return OnnxEmbedder(onnx_path)
+        except Exception as e:
+            logger.warning(f"無法使用 ONNX 嵌入模型，改用 sentence-transformers: {e}")
+    return SentenceTransformer(model_name)
+
 class VectorStore:
     """向量數據庫管理器 - 使用ChromaDB儲存和檢索課程向量"""
     
@@ -19,14 +39,24 @@ class VectorStore:
         self.embedding_model = None
         self.client = None
         self.collection = None
+        # 查詢文本 → 向量；熱門查詢與重複的對話片段不必再經過模型
+        self._embedding_cache = TTLCache(
+            max_entries=self.config.EMBEDDING_CACHE_MAX_ENTRIES, ttl_seconds=float('inf')
+        )
+        # 記憶體內的完整向量矩陣 (ids, 正規化矩陣, metadatas, documents)；集合內容變動時清除
+        self._exact_index = None
+        self._exact_index_lock = threading.Lock()
+        # 既有集合的距離空間不是內積（本版本之前建立）時為 True，需重建知識庫
+        self.index_outdated = False
         self.setup_vector_store()
     
     def setup_vector_store(self):
         """初始化向量數據庫和嵌入模型"""
         try:
             # 初始化嵌入模型
-            logger.info("載入嵌入模型...")
-            self.embedding_model = SentenceTransformer(self.config.EMBEDDING_MODEL)
+            self.embedding_model = load_embedding_model(
+                self.config.EMBEDDING_MODEL, self.config.EMBEDDING_ONNX_PATH
+            )
             
             # 初始化ChromaDB客戶端
             logger.info("初始化ChromaDB...")
@@ -43,11 +73,20 @@ class VectorStore:
                 settings=chroma_settings
             )
             
-            # 創建或獲取集合
-            self.collection = self.client.get_or_create_collection(
-                name=self.config.COLLECTION_NAME,
-                metadata={"hnsw:space": "cosine"}
-            )
+            # 獲取既有集合（不傳入 metadata，避免覆寫其索引設定）；不存在時以目前設定建立
+            try:
+                self.collection = self.client.get_collection(name=self.config.COLLECTION_NAME)
+            except Exception:
+                self.collection = self.client.create_collection(
+                    name=self.config.COLLECTION_NAME,
+                    metadata=self._collection_metadata()
+                )
+            
+            # 既有集合若以其他距離空間建立，其中的向量也未經正規化，需重建後才能以內積檢索
+            space = (self.collection.metadata or {}).get("hnsw:space", "l2")
+            self.index_outdated = space != "ip"
+            if self.index_outdated:
+                logger.warning(f"既有集合的距離空間為 {space}，需重建知識庫以改用內積")
             
             logger.info("向量數據庫初始化完成")
             
@@ -57,137 +96,244 @@ class VectorStore:
     
     def embed_text(self, text: str) -> List[float]:
         """將文本轉換為向量"""
-        try:
-            embedding = self.embedding_model.encode([text])[0]
-            return embedding.tolist()
-        except Exception as e:
-            logger.error(f"文本嵌入失敗: {e}")
-            return []
+        embeddings = self.embed_texts([text])
+        return embeddings[0] if embeddings else []
     
     def embed_texts(self, texts: List[str]) -> List[List[float]]:
-        """批量將文本轉換為向量"""
+        """批量將文本轉換為向量（經 LRU 快取，只對未命中的文本執行模型）"""
         try:
-            embeddings = self.embedding_model.encode(texts)
-            return [embedding.tolist() for embedding in embeddings]
+            embeddings = [self._embedding_cache.get(text) for text in texts]
+            missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            if missing:
+                computed = self._encode([texts[i] for i in missing])
+                for i, embedding in zip(missing, computed):
+                    embeddings[i] = embedding
+                    self._embedding_cache.put(texts[i], embedding)
+            return embeddings
         except Exception as e:
             logger.error(f"批量文本嵌入失敗: {e}")
             return []
     
+    def warm_up(self):
+        """以一次小型推論完成模型的延遲初始化（tokenizer、運算執行緒池），避免首個查詢承擔"""
+        try:
+            self._encode(["課程"])
+        except Exception as e:
+            logger.warning(f"嵌入模型預熱失敗: {e}")
+    
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        """直接以模型計算向量（不經快取；建立知識庫時使用，避免課程文本擠掉查詢快取）"""
+        embeddings = self.embedding_model.encode(
+            texts,
+            batch_size=self.config.EMBEDDING_ENCODE_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True  # 單位向量：內積即餘弦相似度，檢索與語意快取免再正規化
+        )
+        # 整個矩陣一次轉為巢狀 list，不逐列轉換
+        return embeddings.tolist()
+    
     def add_courses(self, courses_data: List[Dict[str, Any]]):
         """將課程數據添加到向量數據庫"""
         try:
             logger.info(f"開始向量化 {len(courses_data)} 筆課程數據...")
-            
-            # 準備數據
-            texts = [course['searchable_text'] for course in courses_data]
-            ids = [course['id'] for course in courses_data]
-            metadatas = []
-            
-            for course in courses_data:
-                metadata = {
-                    'course_id': str(course['course_id']),
-                    'title': course['title'],
-                    'category': course['category'],
-                    'description': course['description'][:500]  # 限制長度避免超出限制
-                }
-                # 添加其他有用的元數據
-                for key, value in course['metadata'].items():
-                    if key not in ['課程介紹'] and value is not None:
-                        metadata[f"meta_{key}"] = str(value)[:100]  # 限制長度
+            batch_size = max(1, self.config.EMBEDDING_ADD_BATCH_SIZE)
+            
+            # 分批處理：背景執行緒寫入 ChromaDB 的同時，主執行緒計算下一批的嵌入向量
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="chroma-add") as writer:
+                pending_write = None
+                for start in range(0, len(courses_data), batch_size):
+                    batch = courses_data[start:start + batch_size]
+                    texts, ids, metadatas = self._prepare_course_batch(batch)
+                    
+                    # 生成嵌入向量
+                    logger.info(f"生成嵌入向量 ({start + 1}-{start + len(batch)})...")
+                    embeddings = self._encode(texts)
+                    
+                    # 等待上一批寫入完成後再送出本批（寫入失敗時在此拋出）
+                    if pending_write is not None:
+                        pending_write.result()
+                    pending_write = writer.submit(
+                        self.collection.add,
+                        embeddings=embeddings,
+                        documents=texts,
+                        metadatas=metadatas,
+                        ids=ids
+                    )
                 
-                metadatas.append(metadata)
-            
-            # 生成嵌入向量
-            logger.info("生成嵌入向量...")
-            embeddings = self.embed_texts(texts)
-            
-            # 添加到集合
-            logger.info("將數據添加到向量數據庫...")
-            self.collection.add(
-                embeddings=embeddings,
-                documents=texts,
-                metadatas=metadatas,
-                ids=ids
-            )
+                if pending_write is not None:
+                    pending_write.result()
             
+            self._exact_index = None
             logger.info(f"成功添加 {len(courses_data)} 筆課程到向量數據庫")
             
         except Exception as e:
             logger.error(f"添加課程到向量數據庫失敗: {e}")
             raise
     
-    def search_similar_courses(self, query: str, k: int = None) -> List[Dict[str, Any]]:
+    def sync_courses(self, courses_data: List[Dict[str, Any]]) -> Dict[str, int]:
+        """以最新課程數據同步集合：只重新嵌入文本或元數據有變動的課程，並刪除已不存在的課程"""
+        try:
+            texts, ids, metadatas = self._prepare_course_batch(courses_data)
+            existing = self.collection.get(include=['documents', 'metadatas'])
+            current = {
+                course_id: (document, metadata)
+                for course_id, document, metadata in zip(
+                    existing['ids'], existing['documents'], existing['metadatas']
+                )
+            }
+            
+            changed = [i for i, course_id in enumerate(ids) if current.get(course_id) != (texts[i], metadatas[i])]
+            removed = list(current.keys() - set(ids))
+            
+            batch_size = max(1, self.config.EMBEDDING_ADD_BATCH_SIZE)
+            for start in range(0, len(changed), batch_size):
+                batch = changed[start:start + batch_size]
+                batch_texts = [texts[i] for i in batch]
+                self.collection.upsert(
+                    embeddings=self._encode(batch_texts),
+                    documents=batch_texts,
+                    metadatas=[metadatas[i] for i in batch],
+                    ids=[ids[i] for i in batch]
+                )
+            if removed:
+                self.collection.delete(ids=removed)
+            if changed or removed:
+                self._exact_index = None
+            
+            logger.info(f"集合同步完成：更新 {len(changed)} 筆，刪除 {len(removed)} 筆，未變動 {len(ids) - len(changed)} 筆")
+            return {'updated': len(changed), 'removed': len(removed), 'unchanged': len(ids) - len(changed)}
+            
+        except Exception as e:
+            logger.error(f"同步課程到向量數據庫失敗: {e}")
+            raise
+    
+    def _prepare_course_batch(self, courses_data: List[Dict[str, Any]]) -> Tuple[List[str], List[str], List[Dict[str, Any]]]:
+        """準備一批課程的文本、id 與元數據"""
+        texts = [course['searchable_text'] for course in courses_data]
+        ids = [course['id'] for course in courses_data]
+        metadatas = []
+        
+        for course in courses_data:
+            metadata = {
+                'course_id': str(course['course_id']),
+                'title': course['title'],
+                'category': course['category'],
+                'description': course['description'][:500]  # 限制長度避免超出限制
+            }
+            # 添加其他有用的元數據
+            for key, value in course['metadata'].items():
+                if key not in ['課程介紹'] and value is not None:
+                    metadata[f"meta_{key}"] = str(value)[:100]  # 限制長度
+            
+            metadatas.append(metadata)
+        
+        return texts, ids, metadatas
+    
+    def search_similar_courses(self, query: str, k: int = None,
+                               query_embedding: List[float] = None) -> List[Dict[str, Any]]:
         """搜尋相似的課程 - 使用混合策略（向量檢索 + 關鍵詞匹配）"""
+        return self.search_similar_courses_batch([query], k, [query_embedding])[0]
+
+    def search_similar_courses_batch(self, queries: List[str], k: int = None,
+                                     query_embeddings: List[List[float]] = None) -> List[List[Dict[str, Any]]]:
+        """批次搜尋相似的課程 - 多個查詢共用一次嵌入計算與一次向量檢索。
+        query_embeddings 可提供預先計算的查詢向量（缺漏者以 None 表示）。
+        """
         try:
             # 檢查集合是否存在
             if not self._check_collection_exists():
                 logger.error("集合不存在，需要重新初始化")
-                return []
+                return [[] for _ in queries]
             
             k = k or self.config.RETRIEVAL_K
-            # 抽取使用者對『上課週次（星期幾）』與『時段（早/午/晚）』的偏好
-            weekday_filter = self._extract_weekday_filter(query)
-            time_bucket = self._extract_time_bucket(query)
-            
-            # 0) 若查詢中包含課程代碼，優先以代碼精準匹配
-            course_codes = self._extract_course_codes(query)
-            if course_codes:
-                logger.info(f"偵測到課程代碼查詢: {course_codes}")
-                code_results = self._search_by_course_code(course_codes, k)
-                if weekday_filter:
-                    code_results = self._filter_by_weekday(code_results, weekday_filter)
-                if time_bucket:
-                    code_results = self._filter_by_time(code_results, time_bucket)
+            results: List[List[Dict[str, Any]]] = [[] for _ in queries]
+            
+            # 0) 若查詢中包含課程代碼，優先以代碼精準匹配；其餘查詢合併為一次向量檢索
+            vector_indices = []
+            for i, query in enumerate(queries):
+                code_results = self._search_by_code_in_query(query, k)
                 if code_results:
-                    logger.info(f"課程代碼匹配找到 {len(code_results)} 筆結果")
-                    return code_results[:k]
+                    results[i] = code_results
+                else:
+                    vector_indices.append(i)
             
-            # 先執行向量檢索（保留未過濾版本供匱乏時回退）
-            vector_results_raw = self._vector_search(query, k)
-            vector_results = vector_results_raw
-            if weekday_filter:
-                vector_results = self._filter_by_weekday(vector_results, weekday_filter)
-            if time_bucket:
-                vector_results = self._filter_by_time(vector_results, time_bucket)
-            
-            # 檢查是否需要關鍵詞回退
-            if self._should_use_keyword_fallback(query, vector_results):
-                logger.info(f"查詢: '{query}' 向量檢索效果不佳，使用關鍵詞搜索補充")
-                keyword_results_raw = self._keyword_search(query, k)
-                keyword_results = keyword_results_raw
-                if weekday_filter:
-                    keyword_results = self._filter_by_weekday(keyword_results, weekday_filter)
-                if time_bucket:
-                    keyword_results = self._filter_by_time(keyword_results, time_bucket)
-                
-                # 合併結果
-                all_results = self._merge_results(vector_results, keyword_results, k)
-                logger.info(f"查詢: '{query}' 混合搜索找到 {len(all_results)} 個相似課程")
-                
-                # 如果混合搜索仍然沒有結果，至少返回向量搜索的結果
-                if not all_results:
-                    # 優先回退到未過濾的向量結果，再不行回退未過濾的關鍵詞結果
-                    if vector_results:
-                        logger.info(f"混合搜索無結果，返回已過濾的向量結果: {len(vector_results)} 個課程")
-                        return vector_results
-                    if vector_results_raw:
-                        logger.info(f"混合搜索無結果，返回未過濾的向量結果: {len(vector_results_raw)} 個課程")
-                        return vector_results_raw[:k]
-                    if keyword_results:
-                        logger.info(f"混合搜索無結果，返回已過濾的關鍵詞結果: {len(keyword_results)} 個課程")
-                        return keyword_results
-                    if keyword_results_raw:
-                        logger.info(f"混合搜索無結果，返回未過濾的關鍵詞結果: {len(keyword_results_raw)} 個課程")
-                        return keyword_results_raw[:k]
-                
-                return all_results
+            vector_batches = self._vector_search_batch(
+                [queries[i] for i in vector_indices], k,
+                [query_embeddings[i] for i in vector_indices] if query_embeddings else None
+            )
+            for i, vector_results_raw in zip(vector_indices, vector_batches):
+                results[i] = self._hybrid_search(queries[i], k, vector_results_raw)
             
-            logger.info(f"查詢: '{query}' 向量搜索找到 {len(vector_results)} 個相似課程")
-            return vector_results
+            return results
             
         except Exception as e:
             logger.error(f"搜尋相似課程失敗: {e}")
+            return [[] for _ in queries]
+
+    def _search_by_code_in_query(self, query: str, k: int) -> List[Dict[str, Any]]:
+        """若查詢包含課程代碼，以代碼搜尋並套用星期/時段過濾"""
+        course_codes = self._extract_course_codes(query)
+        if not course_codes:
             return []
+        logger.info(f"偵測到課程代碼查詢: {course_codes}")
+        code_results = self._search_by_course_code(course_codes, k)
+        weekday_filter = self._extract_weekday_filter(query)
+        time_bucket = self._extract_time_bucket(query)
+        if weekday_filter:
+            code_results = self._filter_by_weekday(code_results, weekday_filter)
+        if time_bucket:
+            code_results = self._filter_by_time(code_results, time_bucket)
+        if code_results:
+            logger.info(f"課程代碼匹配找到 {len(code_results)} 筆結果")
+        return code_results[:k]
+
+    def _hybrid_search(self, query: str, k: int, vector_results_raw: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """以向量檢索結果為基礎，套用過濾並視需要以關鍵詞搜索補充"""
+        # 抽取使用者對『上課週次（星期幾）』與『時段（早/午/晚）』的偏好
+        weekday_filter = self._extract_weekday_filter(query)
+        time_bucket = self._extract_time_bucket(query)
+        
+        # 保留未過濾版本供匱乏時回退
+        vector_results = vector_results_raw
+        if weekday_filter:
+            vector_results = self._filter_by_weekday(vector_results, weekday_filter)
+        if time_bucket:
+            vector_results = self._filter_by_time(vector_results, time_bucket)
+        
+        # 檢查是否需要關鍵詞回退
+        if self._should_use_keyword_fallback(query, vector_results):
+            logger.info(f"查詢: '{query}' 向量檢索效果不佳，使用關鍵詞搜索補充")
+            keyword_results_raw = self._keyword_search(query, k)
+            keyword_results = keyword_results_raw
+            if weekday_filter:
+                keyword_results = self._filter_by_weekday(keyword_results, weekday_filter)
+            if time_bucket:
+                keyword_results = self._filter_by_time(keyword_results, time_bucket)
+            
+            # 合併結果
+            all_results = self._merge_results(vector_results, keyword_results, k)
+            logger.info(f"查詢: '{query}' 混合搜索找到 {len(all_results)} 個相似課程")
+            
+            # 如果混合搜索仍然沒有結果，至少返回向量搜索的結果
+            if not all_results:
+                # 優先回退到未過濾的向量結果，再不行回退未過濾的關鍵詞結果
+                if vector_results:
+                    logger.info(f"混合搜索無結果，返回已過濾的向量結果: {len(vector_results)} 個課程")
+                    return vector_results
+                if vector_results_raw:
+                    logger.info(f"混合搜索無結果，返回未過濾的向量結果: {len(vector_results_raw)} 個課程")
+                    return vector_results_raw[:k]
+                if keyword_results:
+                    logger.info(f"混合搜索無結果，返回已過濾的關鍵詞結果: {len(keyword_results)} 個課程")
+                    return keyword_results
+                if keyword_results_raw:
+                    logger.info(f"混合搜索無結果，返回未過濾的關鍵詞結果: {len(keyword_results_raw)} 個課程")
+                    return keyword_results_raw[:k]
+            
+            return all_results
+        
+        logger.info(f"查詢: '{query}' 向量搜索找到 {len(vector_results)} 個相似課程")
+        return vector_results
 
     def _extract_time_bucket(self, query: str) -> str:
         """從查詢中抽取時段偏好：morning/afternoon/evening 或空字串"""
@@ -351,46 +497,113 @@ class VectorStore:
     
     def _vector_search(self, query: str, k: int) -> List[Dict[str, Any]]:
         """執行向量檢索"""
-        # 將查詢轉換為向量
-        query_embedding = self.embed_text(query)
-        if not query_embedding:
+        return self._vector_search_batch([query], k)[0]
+    
+    def _vector_search_batch(self, queries: List[str], k: int,
+                             query_embeddings: List[List[float]] = None) -> List[List[Dict[str, Any]]]:
+        """批次執行向量檢索（一次嵌入計算、一次 ChromaDB 查詢）"""
+        if not queries:
             return []
         
-        # 執行搜尋
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=min(k * 3, 20),
-            include=['metadatas', 'documents', 'distances']
-        )
+        # 將查詢轉換為向量（已提供向量的查詢不重複計算）
+        query_embeddings = list(query_embeddings) if query_embeddings else [None] * len(queries)
+        missing = [i for i, emb in enumerate(query_embeddings) if not emb]
+        if missing:
+            computed = self.embed_texts([queries[i] for i in missing])
+            if not computed:
+                return [[] for _ in queries]
+            for i, emb in zip(missing, computed):
+                query_embeddings[i] = emb
         
-        # 格式化結果
-        formatted_results = []
-        for i in range(len(results['ids'][0])):
-            similarity_score = 1 - results['distances'][0][i]
-            result = {
-                'id': results['ids'][0][i],
-                'title': results['metadatas'][0][i].get('title', ''),
-                'category': results['metadatas'][0][i].get('category', ''),
-                'description': results['metadatas'][0][i].get('description', ''),
-                'similarity_score': similarity_score,
-                'document': results['documents'][0][i],
-                'metadata': results['metadatas'][0][i],
-                'search_type': 'vector'
-            }
-            formatted_results.append(result)
+        # 執行搜尋：小型語料以記憶體內矩陣精確計算，否則查詢 ChromaDB 的 HNSW 索引
+        n_results = min(k * 3, 20)
+        exact_index = self._get_exact_index()
+        if exact_index is not None:
+            hits = self._exact_search(exact_index, query_embeddings, n_results)
+        else:
+            results = self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                include=['metadatas', 'documents', 'distances']
+            )
+            hits = [
+                list(zip(
+                    results['ids'][q_idx],
+                    [1 - distance for distance in results['distances'][q_idx]],
+                    results['metadatas'][q_idx],
+                    results['documents'][q_idx]
+                ))
+                for q_idx in range(len(queries))
+            ]
+        
+        batch_results = []
+        for q_idx, query in enumerate(queries):
+            # 格式化結果
+            formatted_results = []
+            for course_id, similarity_score, metadata, document in hits[q_idx]:
+                result = {
+                    'id': course_id,
+                    'title': metadata.get('title', ''),
+                    'category': metadata.get('category', ''),
+                    'description': metadata.get('description', ''),
+                    'similarity_score': similarity_score,
+                    'document': document,
+                    'metadata': metadata,
+                    'search_type': 'vector'
+                }
+                formatted_results.append(result)
+            
+            # 記錄相似度分數
+            if formatted_results and logger.isEnabledFor(logging.INFO):
+                top_scores = [f"{r['similarity_score']:.3f}" for r in formatted_results[:5]]
+                logger.info(f"查詢: '{query}' 前5個結果的相似度分數: {top_scores}")
+            
+            # 過濾並返回結果
+            filtered_results = [
+                result for result in formatted_results 
+                if result['similarity_score'] >= self.config.SIMILARITY_THRESHOLD
+            ]
+            batch_results.append(filtered_results[:k])
         
-        # 記錄相似度分數
-        if formatted_results:
-            top_scores = [f"{r['similarity_score']:.3f}" for r in formatted_results[:5]]
-            logger.info(f"查詢: '{query}' 前5個結果的相似度分數: {top_scores}")
+        return batch_results
+    
+    def _get_exact_index(self) -> Optional[Tuple[List[str], np.ndarray, List[dict], List[str]]]:
+        """取得記憶體內的完整向量矩陣；課程數超過 EXACT_SEARCH_MAX_COURSES 或集合為空時回傳 None"""
+        count = self.collection.count()
+        index = self._exact_index
+        if index is not None and len(index[0]) == count:
+            return index
+        if count == 0 or count > self.config.EXACT_SEARCH_MAX_COURSES:
+            return None
         
-        # 過濾並返回結果
-        filtered_results = [
-            result for result in formatted_results 
-            if result['similarity_score'] >= self.config.SIMILARITY_THRESHOLD
-        ]
+        with self._exact_index_lock:
+            index = self._exact_index
+            if index is not None and len(index[0]) == count:
+                return index
+            data = self.collection.get(include=['embeddings', 'metadatas', 'documents'])
+            matrix = np.array(data['embeddings'], dtype=np.float32)
+            # 舊的 cosine 集合可能存有未正規化的向量，載入時統一正規化
+            matrix /= np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+            index = (list(data['ids']), np.ascontiguousarray(matrix), data['metadatas'], data['documents'])
+            self._exact_index = index
+            logger.info(f"已載入 {len(index[0])} 筆課程向量供精確檢索")
+            return index
+    
+    @staticmethod
+    def _exact_search(index, query_embeddings: List[List[float]], n_results: int) -> List[List[Tuple]]:
+        """以一次矩陣乘法計算所有查詢對全部課程的餘弦相似度，各取前 n_results 名"""
+        ids, matrix, metadatas, documents = index
+        queries = np.array(query_embeddings, dtype=np.float32)
+        queries /= np.clip(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12, None)
+        similarities = queries @ matrix.T  # (查詢數, 課程數)
+        n_results = min(n_results, matrix.shape[0])
         
-        return filtered_results[:k]
+        hits = []
+        for row in similarities:
+            top = np.argpartition(-row, n_results - 1)[:n_results]
+            top = top[np.argsort(-row[top])]
+            hits.append([(ids[i], float(row[i]), metadatas[i], documents[i]) for i in top])
+        return hits
     
     def _keyword_search(self, query: str, k: int) -> List[Dict[str, Any]]:
         """執行關鍵詞匹配搜索"""
@@ -614,6 +827,32 @@ class VectorStore:
             logger.error(f"根據類別獲取課程失敗: {e}")
             return []
     
+    def get_all_courses(self) -> List[Dict[str, Any]]:
+        """一次取出集合中的全部課程（直接讀取，不做向量檢索）"""
+        try:
+            if not self._check_collection_exists():
+                logger.error("集合不存在，無法獲取課程")
+                return []
+            
+            results = self.collection.get(include=['metadatas', 'documents'])
+            return [
+                {
+                    'id': course_id,
+                    'title': metadata.get('title', ''),
+                    'category': metadata.get('category', ''),
+                    'description': metadata.get('description', ''),
+                    'document': document,
+                    'metadata': metadata
+                }
+                for course_id, metadata, document in zip(
+                    results['ids'], results['metadatas'], results['documents']
+                )
+            ]
+            
+        except Exception as e:
+            logger.error(f"獲取全部課程失敗: {e}")
+            return []
+    
     def get_collection_stats(self) -> Dict[str, Any]:
         """獲取集合統計資訊"""
         try:
@@ -638,14 +877,26 @@ class VectorStore:
                 'collection_name': self.config.COLLECTION_NAME
             }
     
+    def _collection_metadata(self) -> Dict[str, Any]:
+        """建立集合時的索引設定：向量已正規化，以內積作為距離空間"""
+        return {
+            "hnsw:space": "ip",
+            "hnsw:M": self.config.HNSW_M,
+            "hnsw:construction_ef": self.config.HNSW_CONSTRUCTION_EF,
+            "hnsw:search_ef": self.config.HNSW_SEARCH_EF
+        }
+    
     def reset_collection(self):
         """重置集合（慎用）"""
         try:
             self.client.delete_collection(self.config.COLLECTION_NAME)
+            # 重建時一併套用 HNSW 參數（既有集合建立後無法再調整）
             self.collection = self.client.create_collection(
                 name=self.config.COLLECTION_NAME,
-                metadata={"hnsw:space": "cosine"}
+                metadata=self._collection_metadata()
             )
+            self.index_outdated = False
+            self._exact_index = None
             logger.info("集合已重置")
         except Exception as e:
             logger.error(f"重置集合失敗: {e}")
@@ -680,6 +931,7 @@ class VectorStore:
             # 清理引用
             self.collection = None
             self.client = None
+            self._exact_index = None
             
             # 強制垃圾回收
             import gc
@@ -698,4 +950,64 @@ class VectorStore:
         try:
             self.close_connection()
         except:
-            pass 
+            pass
+
+
+class RetrievalBatcher:
+    """檢索批次器 - 檢索進行中時到達的查詢先排隊，待該次檢索完成後合併為一次向量檢索
+
+    沒有其他檢索進行時查詢立即執行，不額外等待；只有並發請求才會被合併。
+    """
+    
+    def __init__(self, vector_store: VectorStore, enabled: bool = True):
+        self.vector_store = vector_store
+        self.enabled = enabled
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[str, int, List[float], Future]] = []
+        self._busy = False
+    
+    def search(self, query: str, k: int, query_embedding: List[float] = None) -> List[Dict[str, Any]]:
+        """送出查詢並等待結果；停用時直接檢索"""
+        if not self.enabled:
+            return self.vector_store.search_similar_courses(query, k, query_embedding)
+        
+        future: Future = Future()
+        with self._cond:
+            self._pending.append((query, k, query_embedding, future))
+            # 已有檢索進行中則等待：結果可能由該批次之後的合併檢索產生，或輪到本執行緒執行下一批
+            self._cond.wait_for(lambda: future.done() or not self._busy)
+            is_leader = not future.done()
+            if is_leader:
+                self._busy = True
+                batch, self._pending = self._pending, []
+        
+        if is_leader:
+            try:
+                self._flush(batch)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+        
+        return future.result()
+    
+    def _flush(self, batch: List[Tuple[str, int, List[float], Future]]):
+        """依 k 分組執行批次檢索並分派結果"""
+        groups: Dict[int, List[Tuple[str, List[float], Future]]] = {}
+        for query, k, query_embedding, future in batch:
+            groups.setdefault(k, []).append((query, query_embedding, future))
+        
+        if len(batch) > 1:
+            logger.info(f"合併 {len(batch)} 個並發查詢為 {len(groups)} 次批次檢索")
+        
+        for k, items in groups.items():
+            try:
+                results = self.vector_store.search_similar_courses_batch(
+                    [q for q, _, _ in items], k, [emb for _, emb, _ in items]
+                )
+                for (_, _, future), result in zip(items, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)